@@ -0,0 +1 @@
+"""Wavefront Django SDK Benchmarks."""
@@ -0,0 +1,129 @@
+"""
+Benchmark of WavefrontMiddleware under sync, async and hybrid stacks.
+
+Runs the benchmark project with a stub reporter and tracer, and prints
+the mean time per request of each stack. Run from the repository root::
+
+    python -m benchmarks.async_middleware --requests 2000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from django.http import HttpResponse
+from django.test import AsyncClient, Client, override_settings
+from django.urls import path
+
+from opentracing.scope_managers import ThreadLocalScopeManager
+from opentracing.scope_managers.contextvars import ContextVarsScopeManager
+
+from wavefront_django_sdk.middleware import WavefrontMiddleware
+
+from . import project
+from .project import MIDDLEWARE
+
+
+def sync_view(request):
+    """Sync view under benchmark."""
+    return HttpResponse('ok')
+
+
+async def async_view(request):
+    """Async view under benchmark."""
+    return HttpResponse('ok')
+
+
+urlpatterns = [
+    path('sync/', sync_view, name='sync'),
+    path('async/', async_view, name='async'),
+]
+
+
+class SyncOnlyMiddleware:
+    """Plain sync-only middleware which forces Django to adapt the chain."""
+
+    sync_capable = True
+    async_capable = False
+
+    def __init__(self, get_response):
+        """Construct Sync Only Middleware."""
+        self.get_response = get_response
+
+    def __call__(self, request):
+        """Pass the request through."""
+        return self.get_response(request)
+
+
+class SyncOnlyWavefrontMiddleware(WavefrontMiddleware):
+    """WavefrontMiddleware as it ran before native async support."""
+
+    async_capable = False
+
+
+# name: (handler mode, path, middleware, scope manager)
+STACKS = {
+    'sync-baseline': ('sync', '/sync/', [], ThreadLocalScopeManager),
+    'sync': ('sync', '/sync/', [MIDDLEWARE], ThreadLocalScopeManager),
+    'async-baseline': ('async', '/async/', [], ContextVarsScopeManager),
+    'async': ('async', '/async/', [MIDDLEWARE], ContextVarsScopeManager),
+    # Hooks run in sync_to_async threads, where contextvars scopes can't
+    # be closed, so this stack can only use thread-local scopes.
+    'async-sync-only': ('async', '/async/', [
+        __name__ + '.SyncOnlyWavefrontMiddleware'], ThreadLocalScopeManager),
+    'hybrid': ('async', '/async/', [
+        __name__ + '.SyncOnlyMiddleware', MIDDLEWARE],
+               ContextVarsScopeManager),
+}
+
+
+def run_stack(name, requests):
+    """Drive requests through a stack.
+
+    :param name: Name of the stack in STACKS.
+    :param requests: Number of requests to send.
+    :return: Mean microseconds per request.
+    """
+    mode, url, middleware, scope_manager = STACKS[name]
+    with override_settings(
+            MIDDLEWARE=middleware,
+            OPENTRACING_TRACING=project.stub_tracing(scope_manager())):
+        if mode == 'sync':
+            client = Client()
+            client.get(url)
+            start = time.perf_counter()
+            for _ in range(requests):
+                client.get(url)
+            elapsed = time.perf_counter() - start
+        else:
+            client = AsyncClient()
+
+            async def drive():
+                await client.get(url)
+                begin = time.perf_counter()
+                for _ in range(requests):
+                    await client.get(url)
+                return time.perf_counter() - begin
+
+            elapsed = asyncio.run(drive())
+    return elapsed / requests * 1e6
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    args = parser.parse_args()
+    project.setup_django(ROOT_URLCONF=__name__, MIDDLEWARE=[])
+    results = {name: run_stack(name, args.requests) for name in STACKS}
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+    for name, usec in results.items():
+        print('{:<16} {:>10.1f} us/request'.format(name, usec))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Compare two results of the middleware benchmark suite.
+
+Prints the per-request overhead of every scenario in both results and
+exits with status 1 if any scenario got slower than the threshold::
+
+    python -m benchmarks.compare before.json after.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+
+def load(path):
+    """Load benchmark results keyed by scenario name."""
+    with open(path) as fd:
+        data = json.load(fd)
+    return {result['name']: result for result in data['results']}
+
+
+def main():
+    """Compare two benchmark results."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='percent of extra overhead counted as a '
+                             'regression')
+    args = parser.parse_args()
+    before = load(args.before)
+    after = load(args.after)
+    regressions = 0
+    for name in sorted(set(before) & set(after)):
+        old = before[name]['overhead_us']
+        new = after[name]['overhead_us']
+        change = (new - old) / abs(old) * 100 if old else 0.0
+        regressed = change > args.threshold
+        regressions += regressed
+        print('{:<48} {:>8.1f} us -> {:>8.1f} us {:>+7.1f}%{}'.format(
+            name, old, new, change, '  REGRESSION' if regressed else ''))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""
+Benchmark suite of the WavefrontMiddleware overhead.
+
+Drives requests through the Django handler of the benchmark project with
+and without WavefrontMiddleware, for every combination of route count,
+status mix, thread count and tracing on/off, and reports per-request
+overhead, p50/p99 latency and memory allocated per request. Run from the
+repository root::
+
+    python -m benchmarks.middleware --output before.json
+    python -m benchmarks.middleware --output after.json
+    python -m benchmarks.compare before.json after.json
+"""
+import argparse
+import itertools
+import json
+import platform
+import random
+import threading
+import time
+import tracemalloc
+
+import django
+from django.test import RequestFactory, override_settings
+from django.test.client import ClientHandler
+
+from . import project
+
+ROUTE_COUNTS = (1, 100, 1000)
+STATUS_MIXES = {
+    'ok': ((200, 1.0),),
+    'mixed': ((200, 0.9), (404, 0.05), (500, 0.05)),
+}
+THREAD_COUNTS = (1, 4)
+TRACING = (False, True)
+
+
+def build_environs(route_count, status_mix, requests, seed=0):
+    """Build WSGI environs of requests spread over routes and statuses.
+
+    :param route_count: Number of routes.
+    :param status_mix: Tuple of (status code, weight).
+    :param requests: Number of environs.
+    :param seed: Random seed, so every run sends the same requests.
+    :return: List of WSGI environs.
+    """
+    rand = random.Random(seed)
+    statuses = [status for status, _ in status_mix]
+    weights = [weight for _, weight in status_mix]
+    factory = RequestFactory()
+    return [factory.get('/r{}/{}/'.format(
+        rand.randrange(route_count),
+        rand.choices(statuses, weights)[0])).environ
+            for _ in range(requests)]
+
+
+def drive(handler, environs, threads):
+    """Send requests to a handler from several threads.
+
+    :param handler: ClientHandler of the benchmark project.
+    :param environs: WSGI environs to send, split across threads.
+    :param threads: Number of threads.
+    :return: Tuple of latencies in nanoseconds and wall time in seconds.
+    """
+    latencies = []
+    lock = threading.Lock()
+
+    def work(chunk):
+        perf_counter_ns = time.perf_counter_ns
+        local = []
+        for environ in chunk:
+            start = perf_counter_ns()
+            handler(dict(environ))
+            local.append(perf_counter_ns() - start)
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=work, args=(environs[i::threads],))
+               for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return latencies, time.perf_counter() - start
+
+
+def percentile(values, pct):
+    """Get the pct percentile of sorted values."""
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def measure_allocations(handler, environs):
+    """Measure memory a handler allocates while serving a request.
+
+    :return: Mean peak of bytes allocated per request, on top of what was
+        allocated before the request.
+    """
+    tracemalloc.start()
+    total = 0
+    try:
+        for environ in environs:
+            environ = dict(environ)
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            handler(environ)
+            _, peak = tracemalloc.get_traced_memory()
+            total += peak - before
+    finally:
+        tracemalloc.stop()
+    return total / len(environs)
+
+
+def measure(middleware, environs, threads, trace_all):
+    """Measure latency and allocations of a middleware stack.
+
+    :return: Dict of mean, p50 and p99 in microseconds, throughput and
+        allocated bytes per request.
+    """
+    with override_settings(MIDDLEWARE=middleware,
+                           OPENTRACING_TRACE_ALL=trace_all):
+        handler = ClientHandler()
+        drive(handler, environs[:100], 1)
+        latencies, wall = drive(handler, environs, threads)
+        alloc = measure_allocations(handler, environs[:1000])
+    latencies.sort()
+    return {
+        'mean_us': sum(latencies) / len(latencies) / 1e3,
+        'p50_us': percentile(latencies, 50) / 1e3,
+        'p99_us': percentile(latencies, 99) / 1e3,
+        'requests_per_second': len(latencies) / wall,
+        'alloc_bytes': alloc,
+    }
+
+
+def run_scenario(route_count, status_mix, threads, trace_all, requests):
+    """Benchmark one scenario with and without the middleware.
+
+    :return: Dict describing the scenario and its results.
+    """
+    project.set_routes(route_count)
+    environs = build_environs(route_count, STATUS_MIXES[status_mix],
+                              requests)
+    baseline = measure([], environs, threads, trace_all)
+    wavefront = measure([project.MIDDLEWARE], environs, threads, trace_all)
+    return {
+        'name': 'routes={},status={},threads={},tracing={}'.format(
+            route_count, status_mix, threads,
+            'on' if trace_all else 'off'),
+        'routes': route_count,
+        'status_mix': status_mix,
+        'threads': threads,
+        'tracing': trace_all,
+        'overhead_us': wavefront['mean_us'] - baseline['mean_us'],
+        'overhead_p50_us': wavefront['p50_us'] - baseline['p50_us'],
+        'overhead_p99_us': wavefront['p99_us'] - baseline['p99_us'],
+        'overhead_alloc_bytes': (wavefront['alloc_bytes'] -
+                                 baseline['alloc_bytes']),
+        'baseline': baseline,
+        'wavefront': wavefront,
+    }
+
+
+def get_environment():
+    """Get versions the results were produced with."""
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+        try:
+            sdk_version = version('wavefront-django-sdk-python')
+        except PackageNotFoundError:
+            sdk_version = None
+    except ImportError:
+        sdk_version = None
+    return {
+        'sdk_version': sdk_version,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+
+
+def main():
+    """Run the benchmark suite."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--requests', type=int, default=5000,
+                        help='requests per scenario and stack')
+    parser.add_argument('--routes', type=int, nargs='+',
+                        default=ROUTE_COUNTS)
+    parser.add_argument('--status-mixes', nargs='+', default=STATUS_MIXES,
+                        choices=sorted(STATUS_MIXES))
+    parser.add_argument('--threads', type=int, nargs='+',
+                        default=THREAD_COUNTS)
+    parser.add_argument('--tracing', choices=('on', 'off', 'both'),
+                        default='both')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+    tracing = {'on': (True,), 'off': (False,), 'both': TRACING}[args.tracing]
+
+    project.setup_django()
+    results = []
+    for route_count, status_mix, threads, trace_all in itertools.product(
+            args.routes, args.status_mixes, args.threads, tracing):
+        result = run_scenario(route_count, status_mix, threads, trace_all,
+                              args.requests)
+        results.append(result)
+        print('{:<48} overhead {:>8.1f} us  p50 {:>8.1f} us  p99 {:>8.1f} us'
+              '  alloc {:>8.0f} B'.format(
+                  result['name'], result['overhead_us'],
+                  result['wavefront']['p50_us'],
+                  result['wavefront']['p99_us'],
+                  result['overhead_alloc_bytes']))
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump({'environment': get_environment(), 'results': results},
+                      fd, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
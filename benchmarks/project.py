@@ -0,0 +1,143 @@
+"""Minimal in-process Django project for the benchmarks."""
+import logging
+import time
+
+import django
+from django.conf import settings
+from django.http import HttpResponse
+from django.urls import clear_url_caches, path
+
+from wavefront_django_sdk.tracing import DjangoTracing
+
+from wavefront_opentracing_sdk import WavefrontTracer
+from wavefront_opentracing_sdk.reporting.reporter import Reporter
+
+from wavefront_pyformance.wavefront_reporter import WavefrontReporter
+
+from wavefront_sdk.common import ApplicationTags
+
+MIDDLEWARE = 'wavefront_django_sdk.middleware.WavefrontMiddleware'
+
+APPLICATION_TAGS = ApplicationTags(application='benchmark',
+                                   service='django', cluster='local',
+                                   shard='primary')
+
+urlpatterns = []
+
+
+class StubClient:
+    """Wavefront client which only counts what it is asked to send."""
+
+    def __init__(self, send_delay=0):
+        """Construct Stub Client.
+
+        :param send_delay: Seconds every send takes, e.g. to a remote proxy.
+        """
+        self.sent = 0
+        self.send_delay = send_delay
+
+    def _send(self, *args, **kwargs):
+        """Count one sent entity."""
+        if self.send_delay:
+            time.sleep(self.send_delay)
+        self.sent += 1
+
+    send_metric = send_delta_counter = send_distribution = _send
+    send_span = send_event = _send
+
+    def flush_now(self):
+        """Nothing to flush."""
+
+    def close(self):
+        """Nothing to close."""
+
+    @staticmethod
+    def get_failure_count():
+        """Never fails."""
+        return 0
+
+
+class StubSpanReporter(Reporter):
+    """Span reporter which only counts reported spans."""
+
+    def __init__(self):
+        """Construct Stub Span Reporter."""
+        super().__init__(source='benchmark')
+        self.reported = 0
+
+    def report(self, wavefront_span):
+        """Count a finished span."""
+        self.reported += 1
+
+    def get_failure_count(self):
+        """Never fails."""
+        return 0
+
+    def close(self):
+        """Nothing to close."""
+
+
+def stub_reporter(send_delay=0):
+    """Get a WavefrontReporter sending to a StubClient.
+
+    :param send_delay: Seconds every send takes.
+    """
+    reporter = WavefrontReporter(source='benchmark', reporting_interval=60)
+    reporter.wavefront_client = StubClient(send_delay)
+    return reporter
+
+
+def stub_tracing(scope_manager=None):
+    """Get DjangoTracing of a WavefrontTracer reporting to a stub.
+
+    :param scope_manager: Scope manager replacing the thread-local one.
+    """
+    tracer = WavefrontTracer(reporter=StubSpanReporter(),
+                             application_tags=APPLICATION_TAGS)
+    if scope_manager is not None:
+        # pylint: disable=protected-access
+        tracer._scope_manager = scope_manager
+    return DjangoTracing(tracer)
+
+
+def make_view(name):
+    """Get a view answering with the status code in its URL."""
+    def view(request, status):
+        return HttpResponse(name, status=status)
+    view.__name__ = name
+    return view
+
+
+def set_routes(route_count):
+    """Replace the URLconf with route_count routes.
+
+    Route i is served at /r<i>/<status>/ by a view named view_<i>.
+    """
+    urlpatterns[:] = [
+        path('r{}/<int:status>/'.format(i), make_view('view_{}'.format(i)),
+             name='route_{}'.format(i))
+        for i in range(route_count)]
+    clear_url_caches()
+
+
+def setup_django(**overrides):
+    """Configure the benchmark project and set up Django.
+
+    :param overrides: Settings overriding the defaults.
+    """
+    conf = {
+        'DEBUG': False,
+        'SECRET_KEY': 'benchmark',
+        'ALLOWED_HOSTS': ['*'],
+        'ROOT_URLCONF': __name__,
+        'MIDDLEWARE': [MIDDLEWARE],
+        'LOGGING_CONFIG': None,
+        'WF_REPORTER': stub_reporter(),
+        'APPLICATION_TAGS': APPLICATION_TAGS,
+        'OPENTRACING_TRACING': stub_tracing(),
+    }
+    conf.update(overrides)
+    settings.configure(**conf)
+    django.setup()
+    # 404 and 500 responses would otherwise be logged on every request.
+    logging.getLogger('django.request').disabled = True
@@ -0,0 +1,112 @@
+"""
+Benchmark of the direct and buffered response recorders.
+
+Records responses of a few routes from several threads, then merges and
+rolls them up into the registry the way the reporter does before a flush,
+and prints the time spent on the request threads and in the merge. Run
+from the repository root::
+
+    python -m benchmarks.recorder --records 100000 --threads 4
+"""
+import argparse
+import json
+import threading
+import time
+
+from wavefront_django_sdk.metric_cache import RouteMetrics
+from wavefront_django_sdk.recorder import BufferedRecorder, DirectRecorder
+from wavefront_django_sdk.rollup import CounterRollup
+
+from wavefront_pyformance.delta import delta_counter
+from wavefront_pyformance.tagged_registry import TaggedRegistry
+from wavefront_pyformance.wavefront_histogram import wavefront_histogram
+
+ROUTES = 8
+
+
+def build_routes(registry, rollup):
+    """Register the metrics of ROUTES routes the way the middleware does."""
+    routes = []
+    for i in range(ROUTES):
+        key = 'response.route_{}.GET.200'.format(i)
+        tags = {'application': 'benchmark',
+                'django.resource.func': 'view_{}'.format(i)}
+        counters = [registry.counter(key + '.cumulative', tags=tags)]
+        counters.extend(
+            delta_counter(registry, key + level, tags=tags)
+            for level in ('.aggregated_per_shard', '.aggregated_per_service',
+                          '.aggregated_per_cluster',
+                          '.aggregated_per_application'))
+        counters.append(registry.counter(
+            'response.completed.aggregated_per_source',
+            tags={'application': 'benchmark'}))
+        routes.append(RouteMetrics(
+            responses=rollup.counter(key, counters),
+            latency=wavefront_histogram(registry, key + '.latency',
+                                        tags=tags),
+            cpu_ns=wavefront_histogram(registry, key + '.cpu_ns', tags=tags),
+            total_time=registry.counter(key + '.total_time', tags=tags)))
+    return routes
+
+
+def run(recorder_name, records, threads):
+    """Record responses with a recorder and merge them.
+
+    :param recorder_name: 'direct' or 'buffered'.
+    :param records: Number of responses per thread.
+    :param threads: Number of request threads.
+    :return: Dict of record and merge time in microseconds.
+    """
+    registry = TaggedRegistry()
+    rollup = CounterRollup()
+    routes = build_routes(registry, rollup)
+    if recorder_name == 'direct':
+        recorder = DirectRecorder()
+    else:
+        recorder = BufferedRecorder(max_buffer_size=records + 1)
+
+    def work():
+        record = recorder.record
+        for i in range(records):
+            record(routes[i % ROUTES], 0.001, 0.0005)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    record_time = time.perf_counter() - start
+    start = time.perf_counter()
+    recorder.merge()
+    rollup.flush()
+    merge_time = time.perf_counter() - start
+    total = records * threads
+    return {'record_us_per_response': record_time / total * 1e6,
+            'merge_us_per_response': merge_time / total * 1e6,
+            'merge_ms': merge_time * 1e3}
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--records', type=int, default=100000,
+                        help='responses recorded per thread')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    args = parser.parse_args()
+    results = {name: run(name, args.records, args.threads)
+               for name in ('direct', 'buffered')}
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+    for name, result in results.items():
+        print('{:<10} record {:>7.2f} us/response  merge {:>7.2f} '
+              'us/response ({:.1f} ms)'.format(
+                  name, result['record_us_per_response'],
+                  result['merge_us_per_response'], result['merge_ms']))
+
+
+if __name__ == '__main__':
+    main()
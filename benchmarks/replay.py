@@ -0,0 +1,142 @@
+"""
+Replay benchmark of the reporting pipeline.
+
+Replays files captured with WF_CAPTURE_FILE into a stub proxy, directly or
+through the QueuedSender of WF_REPORTING_QUEUE, in a fresh interpreter per
+mode. The reporter modes register the captured metrics into a registry
+again and report it through a WavefrontReporter, so the registry, delta
+counters, histograms and the reporter handle the captured volume. Reports
+the entries replayed per second, the reports made, the entries the stub
+received, the entries dropped and the peak memory. Every send to the stub
+proxy takes --send-delay seconds. Run from the repository root::
+
+    python -m benchmarks.replay wavefront-1234.capture --loops 10
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from wavefront_django_sdk.capture import replay, replay_through_reporter
+from wavefront_django_sdk.constants import REPORTER_PREFIX
+from wavefront_django_sdk.sender import KINDS, QueuedSender
+
+from wavefront_pyformance.tagged_registry import TaggedRegistry
+from wavefront_pyformance.wavefront_reporter import WavefrontReporter
+
+from .middleware import get_environment
+from .project import StubClient
+
+MODES = ('direct', 'queued', 'reporter', 'reporter-queued')
+
+
+# pylint: disable=too-many-arguments, too-many-locals
+def sample(mode, captures, loops, rate, speed, send_delay):
+    """Replay capture files into a stub proxy in this interpreter.
+
+    :param mode: 'direct' to send to the stub, 'queued' to send through a
+        QueuedSender, 'reporter' and 'reporter-queued' to report through a
+        WavefrontReporter sending to either.
+    :param captures: Paths of the capture files.
+    :param loops: Number of times every file is replayed.
+    :return: Dict describing the mode and its results.
+    """
+    stub = StubClient(send_delay)
+    queued = mode.endswith('queued')
+    client = QueuedSender(stub) if queued else stub
+    reporter = None
+    if mode.startswith('reporter'):
+        reporter = WavefrontReporter(source='replay',
+                                     registry=TaggedRegistry(),
+                                     prefix=REPORTER_PREFIX)
+        reporter.wavefront_client = client
+    entries = reports = 0
+    start = time.perf_counter()
+    for _ in range(loops):
+        for capture in captures:
+            if reporter is None:
+                entries += replay(capture, client, rate=rate, speed=speed)
+            else:
+                replayed, made = replay_through_reporter(
+                    capture, reporter, rate=rate, speed=speed)
+                entries += replayed
+                reports += made
+    replayed = time.perf_counter() - start
+    dropped = 0
+    if queued:
+        client.close()
+        dropped = sum(client.get_dropped_count(kind) for kind in KINDS)
+    elapsed = time.perf_counter() - start
+    return {
+        'name': 'replay={}'.format(mode), 'mode': mode, 'loops': loops,
+        'rate': rate, 'speed': speed, 'send_delay': send_delay,
+        'entries': entries, 'reports': reports,
+        'entries_per_second': entries / replayed if replayed else None,
+        'drain_seconds': elapsed - replayed,
+        'sent': stub.sent,
+        'dropped': dropped,
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss /
+        (1 << 20 if sys.platform == 'darwin' else 1 << 10),
+    }
+
+
+# pylint: disable=too-many-arguments
+def run_mode(mode, captures, loops, rate, speed, send_delay):
+    """Replay capture files in a fresh interpreter.
+
+    :return: Dict describing the mode and its results.
+    """
+    command = [sys.executable, '-m', 'benchmarks.replay', '--sample', mode,
+               '--loops', str(loops), '--send-delay', str(send_delay)]
+    if rate is not None:
+        command += ['--rate', str(rate)]
+    if speed is not None:
+        command += ['--speed', str(speed)]
+    output = subprocess.run(command + list(captures), check=True,
+                            stdout=subprocess.PIPE).stdout
+    return json.loads(output)
+
+
+def main():
+    """Run the replay benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('captures', nargs='+',
+                        help='files captured with WF_CAPTURE_FILE')
+    parser.add_argument('--loops', type=int, default=1,
+                        help='times every file is replayed')
+    parser.add_argument('--rate', type=float,
+                        help='entries per second, default as fast as possible')
+    parser.add_argument('--speed', type=float,
+                        help='multiple of the captured pace, e.g. 2')
+    parser.add_argument('--send-delay', type=float, default=0,
+                        help='seconds every send to the proxy takes')
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+    parser.add_argument('--sample', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+    if args.sample:
+        json.dump(sample(args.sample, args.captures, args.loops, args.rate,
+                         args.speed, args.send_delay), sys.stdout)
+        return
+
+    results = []
+    for mode in args.modes:
+        result = run_mode(mode, args.captures, args.loops, args.rate,
+                          args.speed, args.send_delay)
+        results.append(result)
+        print('{:<23} {:>9} entries {:>11.0f}/s  reports {:>5}  sent {:>9}  '
+              'dropped {:>7}  max rss {:>7.1f} MB'.format(
+                  result['name'], result['entries'],
+                  result['entries_per_second'] or 0, result['reports'],
+                  result['sent'], result['dropped'], result['max_rss_mb']))
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump({'environment': get_environment(), 'results': results},
+                      fd, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
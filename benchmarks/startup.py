@@ -0,0 +1,115 @@
+"""
+Startup benchmark of the WavefrontMiddleware.
+
+Starts a fresh interpreter per sample and measures the time to import the
+middleware, to construct the middleware chain of the benchmark project and
+to serve the first request, and the threads running after construction,
+with reporting started eagerly at construction and lazily on the first
+request. Every send to the stub proxy takes --send-delay seconds. Run from
+the repository root::
+
+    python -m benchmarks.startup --output startup.json
+"""
+import argparse
+import importlib
+import json
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from django.test import RequestFactory
+from django.test.client import ClientHandler
+
+from . import project
+from .middleware import get_environment
+
+MODES = ('eager', 'lazy')
+METRICS = ('import_ms', 'construct_ms', 'first_request_ms',
+           'threads_after_construct')
+
+
+def sample(mode, send_delay):
+    """Measure the startup of the middleware in this interpreter.
+
+    :param mode: 'eager' or 'lazy' start of reporting.
+    :param send_delay: Seconds every send to the stub proxy takes.
+    :return: Dict of METRICS.
+    """
+    project.setup_django(WF_REPORTER=project.stub_reporter(send_delay),
+                         WF_LAZY_START=mode == 'lazy')
+    project.set_routes(1)
+    environ = RequestFactory().get('/r0/200/').environ
+
+    start = time.perf_counter()
+    importlib.import_module(project.MIDDLEWARE.rsplit('.', 1)[0])
+    imported = time.perf_counter()
+    threads = threading.active_count()
+    handler = ClientHandler()
+    handler.load_middleware()
+    constructed = time.perf_counter()
+    threads = threading.active_count() - threads
+    handler(dict(environ))
+    served = time.perf_counter()
+    return {
+        'import_ms': (imported - start) * 1e3,
+        'construct_ms': (constructed - imported) * 1e3,
+        'first_request_ms': (served - constructed) * 1e3,
+        'threads_after_construct': threads,
+    }
+
+
+def run_mode(mode, samples, send_delay):
+    """Sample the startup of a mode in fresh interpreters.
+
+    :return: Dict describing the mode and the median and max of METRICS.
+    """
+    runs = []
+    for _ in range(samples):
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.startup', '--sample', mode,
+             '--send-delay', str(send_delay)],
+            check=True, stdout=subprocess.PIPE).stdout
+        runs.append(json.loads(output))
+    result = {'name': 'start={}'.format(mode), 'mode': mode,
+              'samples': samples, 'send_delay': send_delay}
+    for metric in METRICS:
+        values = [run[metric] for run in runs]
+        result[metric] = statistics.median(values)
+        result[metric + '_max'] = max(values)
+    return result
+
+
+def main():
+    """Run the startup benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--samples', type=int, default=10,
+                        help='fresh interpreters per mode')
+    parser.add_argument('--send-delay', type=float, default=0.05,
+                        help='seconds every send to the proxy takes')
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+    parser.add_argument('--sample', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+    if args.sample:
+        json.dump(sample(args.sample, args.send_delay), sys.stdout)
+        return
+
+    results = []
+    for mode in args.modes:
+        result = run_mode(mode, args.samples, args.send_delay)
+        results.append(result)
+        print('{:<12} import {:>7.1f} ms  construct {:>7.1f} ms  first '
+              'request {:>7.1f} ms  threads {:>2.0f}'.format(
+                  result['name'], result['import_ms'],
+                  result['construct_ms'], result['first_request_ms'],
+                  result['threads_after_construct']))
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump({'environment': get_environment(), 'results': results},
+                      fd, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
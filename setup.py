@@ -15,7 +15,7 @@ with open(os.path.join(os.path.abspath(os.path.dirname(__file__)),
 
 setuptools.setup(
     name='wavefront-django-sdk-python',
-    version='1.1.0',
+    version='1.2.0',
     author='Wavefront by VMware',
     author_email='songhao@vmware.com',
     url='https://github.com/wavefrontHQ/wavefront-django-sdk-python',
@@ -29,18 +29,24 @@ setuptools.setup(
         'Django'
     ],
     classifiers=[
+        'Framework :: Django',
         'License :: OSI Approved :: Apache Software License',
-        'Programming Language :: Python :: 2.7',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
         'Programming Language :: Python :: 3.6',
-        'Programming Language :: Python :: 3.7'
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9'
     ],
+    python_requires='>=3.6',
     include_package_data=True,
     packages=setuptools.find_packages(exclude=('*.tests', '*.tests.*',
-                                               'tests.*', 'tests')),
+                                               'tests.*', 'tests',
+                                               'benchmarks.*', 'benchmarks')),
     install_requires=(
         'django>=1.11',
         'django-opentracing>=1.1',
+        'requests>=2.18',
         'wavefront-opentracing-sdk-python>=1.2',
         'wavefront-sdk-python>=1.7.4',
     )
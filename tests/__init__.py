@@ -0,0 +1,7 @@
+"""Tests of the Wavefront Django SDK, run with python -m unittest."""
+import os
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+django.setup()
@@ -0,0 +1,43 @@
+"""Django settings of the tests, reporting nothing."""
+from opentracing.mocktracer import MockTracer
+
+from wavefront_django_sdk.tracing import DjangoTracing
+
+from wavefront_sdk.common import ApplicationTags
+
+
+class StubReporter:
+    """Reporter which is never started, as reporting is disabled."""
+
+    prefix = ''
+    registry = None
+    wavefront_client = None
+    source = 'test'
+
+    def start(self):
+        """Start nothing."""
+
+    def stop(self):
+        """Stop nothing."""
+
+
+SECRET_KEY = 'wavefront-django-sdk-tests'
+ALLOWED_HOSTS = ['*']
+ROOT_URLCONF = 'tests.urls'
+INSTALLED_APPS = ['django.contrib.contenttypes', 'django.contrib.auth']
+DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3',
+                         'NAME': ':memory:'}}
+MIDDLEWARE = ['wavefront_django_sdk.middleware.WavefrontMiddleware']
+USE_TZ = True
+
+APPLICATION_TAGS = ApplicationTags(application='app', service='svc')
+OPENTRACING_TRACING = DjangoTracing(MockTracer())
+WF_REPORTER = StubReporter()
+WF_DEBUG = True
+WF_DISABLE_REPORTING = True
+ENABLE_INTERNAL_REPORT = False
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'loggers': {'django.request': {'level': 'CRITICAL'}},
+}
@@ -0,0 +1,60 @@
+"""Tests of the middleware served natively on the event loop."""
+import unittest
+from unittest import mock
+
+import django.test
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from wavefront_django_sdk.middleware import WavefrontMiddleware
+
+from .utils import get_metrics
+
+try:
+    from asgiref.sync import SyncToAsync
+except ImportError:
+    SyncToAsync = None
+
+AsyncClient = getattr(django.test, 'AsyncClient', None)
+
+
+@unittest.skipUnless(AsyncClient, 'Django has no AsyncClient')
+class AsyncMiddlewareTest(SimpleTestCase):
+    """Tests of requests through the async handler."""
+
+    def setUp(self):
+        """Forget the spans of earlier tests."""
+        self.tracer = settings.OPENTRACING_TRACING.tracer
+        self.tracer.reset()
+
+    async def test_async_view(self):
+        """Requests are traced and counted without sync_to_async hops."""
+        wrapped = []
+        init = SyncToAsync.__init__
+
+        def record(self, func, *args, **kwargs):
+            wrapped.append(func)
+            init(self, func, *args, **kwargs)
+        with mock.patch.object(SyncToAsync, '__init__', record), \
+                self.assertLogs('wavefront_django_sdk.middleware',
+                                'WARNING'):
+            # The MockTracer keeps the active span in a thread local.
+            response = await AsyncClient().get('/async/items/')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([], [
+            func for func in wrapped
+            if isinstance(getattr(func, '__self__', None),
+                          WavefrontMiddleware)])
+
+        span, = self.tracer.finished_spans()
+        self.assertEqual('async_items', span.operation_name)
+        self.assertEqual('200', span.tags['http.status_code'])
+
+        inflight = get_metrics('gauges', 'request.async_items.GET.inflight')
+        self.assertTrue(inflight)
+        self.assertEqual([0] * len(inflight),
+                         [gauge.get_value() for gauge in inflight])
+        self.assertEqual([0], [gauge.get_value() for gauge in get_metrics(
+            'gauges', 'total_requests.inflight')])
+        self.assertEqual(1, sum(counter.get_count() for counter in get_metrics(
+            'counters', 'response.async_items.GET.200.cumulative')))
@@ -0,0 +1,195 @@
+"""Tests of capturing reported data and replaying it."""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+import warnings
+
+from wavefront_django_sdk.capture import CaptureClient, read_capture, \
+    replay, replay_through_reporter
+
+from wavefront_pyformance.delta import delta_counter
+from wavefront_pyformance.tagged_registry import TaggedRegistry
+from wavefront_pyformance.wavefront_histogram import wavefront_histogram
+from wavefront_pyformance.wavefront_reporter import WavefrontReporter
+
+from wavefront_sdk.entities.tracing.span_log import SpanLog
+
+
+class RecordingClient:
+    """Wavefront client recording every call."""
+
+    def __init__(self):
+        """Construct Recording Client."""
+        self.calls = []
+
+    def __getattr__(self, method):
+        """Record calls of any send method."""
+        if not method.startswith('send_'):
+            raise AttributeError(method)
+        return lambda *args, **kwargs: self.calls.append(
+            (method, args, kwargs))
+
+    def flush_now(self):
+        """Nothing to flush."""
+
+    def close(self):
+        """Nothing to close."""
+
+
+class FakeClock:
+    """Monotonic clock advanced only by sleeping."""
+
+    def __init__(self):
+        """Construct Fake Clock."""
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        """Get the current time."""
+        return self.now
+
+    def sleep(self, seconds):
+        """Advance the clock."""
+        self.sleeps.append(round(seconds, 6))
+        self.now += seconds
+
+
+def new_reporter(registry, client):
+    """Create a WavefrontReporter sending to a client."""
+    with warnings.catch_warnings():
+        # pyformance starts its thread with the deprecated setDaemon().
+        warnings.simplefilter('ignore', DeprecationWarning)
+        reporter = WavefrontReporter(source='host', registry=registry,
+                                     prefix='django.')
+    reporter.wavefront_client = client
+    return reporter
+
+
+class CaptureTest(unittest.TestCase):
+    """Tests of capture files."""
+
+    def setUp(self):
+        """Create a directory for the capture files."""
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write_capture(self, name, entries):
+        """Write a capture file of (capture time, method, *args) entries."""
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as capture:
+            for entry in entries:
+                capture.write(json.dumps(entry) + '\n')
+        return path
+
+    def test_capture_and_read(self):
+        """Every kind of entry is read back with its original types."""
+        client = CaptureClient(
+            os.path.join(self.directory, 'wavefront-{pid}.capture'))
+        self.assertEqual(os.path.join(
+            self.directory, 'wavefront-{}.capture'.format(os.getpid())),
+            client.path)
+        trace_id, span_id, parent_id = uuid.uuid4(), uuid.uuid4(), \
+            uuid.uuid4()
+        client.send_metric('django.m.value', 1.5, 100, 'host', {'a': 'b'})
+        client.send_delta_counter('∆django.d.count', 2, 'host', None)
+        client.send_distribution('django.h', [(1.0, 3)], {'!M'}, 100,
+                                 'host', None)
+        client.send_span('op', 1000, 5, 'host', trace_id, span_id,
+                         [parent_id], None, [('k', 'v')],
+                         [SpanLog(1000, {'event': 'error'})])
+        client.send_event('deploy', 1, 2, 'host', None, {'x': 'y'})
+        client.close()
+        client.send_metric('django.late.value', 1, 101, 'host', None)
+        client.close()
+        self.assertEqual(6, client.count)
+
+        entries = [(method, args) for _, method, args
+                   in read_capture(client.path)]
+        self.assertEqual(
+            ['send_metric', 'send_delta_counter', 'send_distribution',
+             'send_span', 'send_event', 'send_metric'],
+            [method for method, _ in entries])
+        self.assertEqual(['django.m.value', 1.5, 100, 'host', {'a': 'b'}],
+                         entries[0][1])
+        self.assertEqual([(1.0, 3)], entries[2][1][1])
+        self.assertEqual({'!M'}, entries[2][1][2])
+        span = entries[3][1]
+        self.assertEqual([trace_id, span_id, [parent_id], []], span[4:8])
+        self.assertEqual([('k', 'v')], span[8])
+        self.assertEqual({'event': 'error'}, span[9][0].fields)
+
+    def test_unknown_entry(self):
+        """Entries of unknown methods are rejected."""
+        path = self.write_capture('bad.capture', [[1, 'drop_table']])
+        with self.assertRaises(ValueError):
+            list(read_capture(path))
+
+    def test_replay_sends_every_entry(self):
+        """Replaying sends every captured entry to the client."""
+        path = self.write_capture('replay.capture', [
+            [1, 'send_metric', 'm.value', 1, 10, 'host', None],
+            [2, 'send_event', 'e', 1, 2, 'host', None, None],
+        ])
+        client = RecordingClient()
+        self.assertEqual(2, replay(path, client))
+        self.assertEqual([
+            ('send_metric', ('m.value', 1, 10, 'host', None), {}),
+            ('send_event', ('e', 1, 2, 'host', None, None), {}),
+        ], client.calls)
+
+    def test_replay_pacing(self):
+        """Entries are sent at a rate or a multiple of the captured pace."""
+        path = self.write_capture('paced.capture', [
+            [10.0, 'send_metric', 'm.value', 1, 10, 'host', None],
+            [11.0, 'send_metric', 'm.value', 2, 11, 'host', None],
+            [15.0, 'send_metric', 'm.value', 3, 15, 'host', None],
+        ])
+        clock = FakeClock()
+        replay(path, RecordingClient(), rate=4, clock=clock,
+               sleep=clock.sleep)
+        self.assertEqual([0.25, 0.25], clock.sleeps)
+        clock = FakeClock()
+        replay(path, RecordingClient(), speed=2, clock=clock,
+               sleep=clock.sleep)
+        self.assertEqual([0.5, 2.0], clock.sleeps)
+        with self.assertRaises(ValueError):
+            replay(path, RecordingClient(), rate=0)
+
+    def test_replay_through_reporter(self):
+        """Captured metrics are registered and reported as captured."""
+        registry = TaggedRegistry()
+        tags = {'application': 'app'}
+        registry.counter('requests', tags=tags).inc(3)
+        delta_counter(registry, 'responses', tags=tags).inc(2)
+        registry.gauge('inflight', tags=tags).set_value(5)
+        histogram = wavefront_histogram(registry, 'latency', tags=tags)
+        for value in (1.0, 1.0, 2.0):
+            histogram.add(value)
+        capture = CaptureClient(os.path.join(self.directory, 'r.capture'))
+        reporter = new_reporter(registry, capture)
+        reporter._report(flush_current_hist=True)
+        capture.send_span('op', 1000, 5, 'host', uuid.uuid4(), uuid.uuid4(),
+                          None, None, [], None)
+        capture.close()
+
+        client = RecordingClient()
+        replayed = new_reporter(TaggedRegistry(), client)
+        self.assertEqual((5, 1),
+                         replay_through_reporter(capture.path, replayed))
+        sent = {(method, kwargs.get('name', args[0] if args else None)):
+                (kwargs, args) for method, args, kwargs in client.calls}
+        self.assertEqual(3, sent['send_metric', 'django.requests.count'][0]
+                         ['value'])
+        self.assertEqual(5, sent['send_metric', 'django.inflight.value'][0]
+                         ['value'])
+        delta = sent['send_delta_counter', '∆django.responses.count'][0]
+        self.assertEqual((2, tags), (delta['value'], delta['tags']))
+        distribution = sent['send_distribution', 'django.latency'][0]
+        self.assertEqual(tags, distribution['tags'])
+        self.assertEqual(
+            {1.0: 2, 2.0: 1},
+            {mean: count for mean, count in distribution['centroids']})
+        self.assertIn(('send_span', 'op'), sent)
@@ -0,0 +1,258 @@
+"""Tests of the cardinality limiter and the expiry of idle series."""
+import unittest
+from unittest import mock
+
+from django.http import HttpResponse
+from django.test import Client, SimpleTestCase, override_settings
+
+from wavefront_django_sdk.cardinality import CardinalityLimiter, \
+    OTHER_VIEW_NAMES
+from wavefront_django_sdk.inflight import InflightGauge
+from wavefront_django_sdk.metric_cache import RouteMetrics
+from wavefront_django_sdk.middleware import WavefrontMiddleware, \
+    _middlewares
+from wavefront_django_sdk.resolver import ViewNames
+from wavefront_django_sdk.rollup import RollupCounter
+from wavefront_django_sdk.runtime import get_runtime
+
+from wavefront_pyformance.delta import delta_counter
+from wavefront_pyformance.tagged_registry import TaggedRegistry
+
+
+def view_names(entity_name):
+    """Get ViewNames of a route of the test URLs."""
+    return ViewNames(entity_name, 'tests.urls', entity_name)
+
+
+def new_series(registry, name, shared=None):
+    """Register the metrics of a series the way the middleware does.
+
+    :param registry: TaggedRegistry to register the metrics in.
+    :param name: Name of the route.
+    :param shared: Counter also counted by other series, or None.
+    :return: RouteMetrics of the series.
+    """
+    targets = [registry.counter('response.{}.cumulative'.format(name)),
+               delta_counter(registry,
+                             'response.{}.aggregated'.format(name))]
+    if shared is not None:
+        targets.append(shared)
+    return RouteMetrics(
+        inflight=registry.gauge(key='request.{}.inflight'.format(name),
+                                gauge=InflightGauge()),
+        responses=RollupCounter(targets),
+        latency=registry.histogram('response.{}.latency'.format(name)))
+
+
+def get_keys(registry):
+    """Get the keys of all metrics of a registry."""
+    # pylint: disable=protected-access
+    return set(registry._counters) | set(registry._gauges) | \
+        set(registry._histograms)
+
+
+class FoldTest(unittest.TestCase):
+    """Tests of folding routes, methods and status codes over their caps."""
+
+    def test_routes_over_cap_are_other(self):
+        """Routes over the cap fold into OTHER, UNKNOWN never does."""
+        limiter = CardinalityLimiter(max_routes=1)
+        self.assertEqual((view_names('items'), 'GET'),
+                         limiter.fold_route(view_names('items'), 'GET'))
+        self.assertEqual((OTHER_VIEW_NAMES, 'GET'),
+                         limiter.fold_route(view_names('fail'), 'GET'))
+        unknown = ViewNames('UNKNOWN', None, None)
+        self.assertEqual((unknown, 'GET'),
+                         limiter.fold_route(unknown, 'GET'))
+        self.assertEqual((view_names('items'), 'GET'),
+                         limiter.fold_route(view_names('items'), 'GET'))
+        self.assertEqual(1, limiter.get_folded_count())
+
+    def test_standard_methods_are_pinned(self):
+        """HTTP methods always pass, other methods only up to the cap."""
+        limiter = CardinalityLimiter(max_methods=1)
+        for method in ('GET', 'POST', 'PATCH', 'OPTIONS'):
+            self.assertEqual(method, limiter.fold_route(
+                view_names('items'), method)[1])
+        self.assertEqual('OTHER', limiter.fold_route(
+            view_names('items'), 'PURGE')[1])
+
+        limiter = CardinalityLimiter(max_methods=10)
+        self.assertEqual('PURGE', limiter.fold_route(
+            view_names('items'), 'PURGE')[1])
+        self.assertEqual('OTHER', limiter.fold_route(
+            view_names('items'), 'BREW')[1])
+        self.assertEqual('GET', limiter.fold_route(
+            view_names('items'), 'GET')[1])
+        self.assertEqual(1, limiter.get_folded_count())
+
+    def test_status_codes_over_cap_are_their_class(self):
+        """Status codes over the cap fold into their class."""
+        limiter = CardinalityLimiter(max_status_codes=1)
+        self.assertEqual('200', limiter.fold_status(200))
+        self.assertEqual('200', limiter.fold_status(200))
+        self.assertEqual('4xx', limiter.fold_status(404))
+        self.assertEqual('5xx', limiter.fold_status(503))
+        self.assertEqual('2xx', limiter.fold_status(204))
+        self.assertEqual(3, limiter.get_folded_count())
+
+    def test_invalid_status_codes_are_unknown(self):
+        """Invalid status codes are UNKNOWN without using up the cap."""
+        limiter = CardinalityLimiter(max_status_codes=1)
+        self.assertEqual('UNKNOWN', limiter.fold_status(42))
+        self.assertEqual('UNKNOWN', limiter.fold_status(600))
+        self.assertEqual('404', limiter.fold_status(404))
+        self.assertEqual(0, limiter.get_folded_count())
+
+    def test_caps_must_be_positive(self):
+        """Caps of zero are rejected."""
+        with self.assertRaises(ValueError):
+            CardinalityLimiter(max_routes=0)
+
+
+class ExpireTest(unittest.TestCase):
+    """Tests of removing idle series from the registry."""
+
+    def setUp(self):
+        """Track two idle series, used 100s ago."""
+        self.registry = TaggedRegistry()
+        self.limiter = CardinalityLimiter(series_ttl=10)
+        self.shared = self.registry.counter('response.completed.aggregated')
+        self.keys = {}
+        self.series = {}
+        for name in ('items', 'fail'):
+            key = (name, 'GET', '200', 'tests.urls', name)
+            self.limiter.fold_route(view_names(name), 'GET')
+            self.limiter.fold_status(200)
+            self.series[name] = new_series(self.registry, name, self.shared)
+            self.limiter.track(key, self.series[name])
+            self.limiter.touch(self.series[name], now=1000)
+            self.keys[name] = key
+
+    def expire(self, now=1100):
+        """Expire series idle at a time.
+
+        :return: Tuple of the number of expired series and their keys.
+        """
+        forgotten = []
+        return self.limiter.expire(self.registry, forgotten.append,
+                                   now=now), forgotten
+
+    def test_idle_series_are_removed(self):
+        """Metrics of idle series are removed, shared ones are kept."""
+        self.series['items'].last_used = 1095
+        self.assertEqual((1, [self.keys['fail']]), self.expire())
+        self.assertTrue(self.series['fail'].expired)
+        self.assertFalse(self.series['items'].expired)
+        keys = get_keys(self.registry)
+        self.assertFalse([key for key in keys if '.fail.' in key])
+        self.assertTrue([key for key in keys if '.items.' in key])
+        self.assertIn('response.completed.aggregated', keys)
+        self.assertEqual(1, self.limiter.get_series_count())
+        self.assertEqual(1, self.limiter.expired)
+
+    def test_expired_values_are_released(self):
+        """Values of expired series no longer count towards the caps."""
+        limiter = CardinalityLimiter(max_routes=1, series_ttl=10)
+        series = new_series(self.registry, 'items')
+        limiter.fold_route(view_names('items'), 'GET')
+        limiter.track(('items', 'GET', '200', 'tests.urls', 'items'), series)
+        self.assertEqual(OTHER_VIEW_NAMES, limiter.fold_route(
+            view_names('fail'), 'GET')[0])
+        self.assertEqual(1, limiter.expire(self.registry, now=1000))
+        self.assertEqual(view_names('fail'), limiter.fold_route(
+            view_names('fail'), 'GET')[0])
+
+    def test_shared_metrics_are_kept(self):
+        """Metrics of an expired series also used by a live one stay."""
+        self.series['items'].latency = self.series['fail'].latency
+        self.series['items'].last_used = 1095
+        self.expire()
+        self.assertIn('response.fail.latency', get_keys(self.registry))
+
+    def test_inflight_series_are_kept(self):
+        """Series of running requests are not expired."""
+        self.series['fail'].inflight.add(1)
+        self.assertEqual((1, [self.keys['items']]), self.expire())
+        self.assertIn('request.fail.inflight', get_keys(self.registry))
+        self.series['fail'].inflight.add(-1)
+        self.assertEqual((1, [self.keys['fail']]), self.expire())
+
+    def test_unreported_deltas_are_kept(self):
+        """Series with responses or deltas not reported yet are kept."""
+        self.series['items'].responses.inc()
+        self.assertEqual((1, [self.keys['fail']]), self.expire())
+        self.series['items'].responses.flush()
+        self.assertEqual((0, []), self.expire())
+        self.assertEqual(1, self.registry.counter(
+            'response.items.cumulative').get_count())
+        # Reporting resets delta counters.
+        self.series['items'].get_counters()[1].dec(1)
+        self.assertEqual((1, [self.keys['items']]), self.expire())
+
+    def test_touched_series_are_kept(self):
+        """Series used within the TTL are kept, expired ones stay dead."""
+        self.assertTrue(self.limiter.touch(self.series['items'], now=1095))
+        self.assertEqual(1, self.expire()[0])
+        self.assertFalse(self.limiter.touch(self.series['fail'], now=1100))
+
+    def test_no_ttl_keeps_everything(self):
+        """Nothing expires without a TTL."""
+        self.limiter.series_ttl = None
+        self.assertEqual((0, []), self.expire(now=10 ** 9))
+
+
+def get_reporting_middleware():
+    """Get the middleware whose cardinality gauges are reported."""
+    limiter = get_runtime().gauges['cardinality.folded'].__self__
+    # pylint: disable=protected-access
+    return next(middleware for middleware in _middlewares
+                if middleware.cardinality is limiter)
+
+
+@override_settings(WF_METRIC_SERIES_TTL=10, WF_MAX_ROUTES=1,
+                   WF_MAX_STATUS_CODES=1)
+class MiddlewareExpireTest(SimpleTestCase):
+    """Tests of the middleware with capped and expiring series."""
+
+    def test_gauges(self):
+        """Folded, live and expired series are reported as gauges."""
+        client = Client()
+        client.get('/items/')
+        client.get('/status/404/')
+        client.get('/fail/')
+        gauges = get_runtime().gauges
+        # The status and fail routes, and the 404 and 500 status codes.
+        self.assertEqual(4, gauges['cardinality.folded']())
+        # Requests and responses of items, OTHER, OTHER 4xx and OTHER 5xx.
+        self.assertEqual(5, gauges['cardinality.series']())
+        self.assertEqual(0, gauges['cardinality.expired']())
+
+        # Responses are not rolled up yet, only the request series expire.
+        with mock.patch('time.monotonic', return_value=10 ** 9):
+            get_reporting_middleware().expire_series()
+        self.assertEqual(3, gauges['cardinality.series']())
+        self.assertEqual(2, gauges['cardinality.expired']())
+
+    def test_expired_handles_are_resolved_again(self):
+        """A handle looked up right before it expired is not recorded to."""
+        middleware = WavefrontMiddleware(lambda request: None)
+        names = ViewNames('expiry', 'tests.urls', 'expiry')
+        response = HttpResponse(status=200)
+        stale = middleware.get_route_metrics(names, 'GET', response)
+        with mock.patch('time.monotonic', return_value=10 ** 9):
+            middleware.expire_series()
+        self.assertTrue(stale.expired)
+
+        # A request thread got the handle from the cache just before.
+        with mock.patch.object(middleware.metric_cache, 'get',
+                               side_effect=[stale, None]):
+            route_metrics = middleware.get_route_metrics(names, 'GET',
+                                                         response)
+        self.assertIsNot(stale, route_metrics)
+        self.assertFalse(route_metrics.expired)
+        self.assertEqual(1, middleware.cardinality.get_series_count())
+        # pylint: disable=protected-access
+        histograms = middleware.reg._histograms.values()
+        self.assertIn(route_metrics.latency, histograms)
+        self.assertNotIn(stale.latency, histograms)
@@ -0,0 +1,134 @@
+"""Tests of the database query instrumentation, against SQLite."""
+import unittest
+from unittest import mock
+
+from django.conf import settings
+from django.db import connection
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.test import Client, SimpleTestCase, override_settings
+
+from wavefront_django_sdk.db import QueryStats, get_sql_fingerprint, \
+    install_query_instrumentation, normalize_sql
+
+from .utils import get_metrics
+
+
+class FingerprintTest(unittest.TestCase):
+    """Tests of grouping queries by their normalized statement."""
+
+    def test_literals_and_placeholders_are_grouped(self):
+        """Executions of a statement share a fingerprint."""
+        self.assertEqual(
+            get_sql_fingerprint("SELECT * FROM item WHERE id = 1"),
+            get_sql_fingerprint("SELECT * FROM item WHERE id = %s"))
+        self.assertEqual(
+            "SELECT * FROM item WHERE name = ? AND id = ?",
+            normalize_sql("SELECT  *\nFROM item WHERE name = 'it''s' "
+                          "AND id = -2.5"))
+
+    def test_lists_are_collapsed(self):
+        """IN lists and multi-row VALUES of any length are grouped."""
+        self.assertEqual(
+            get_sql_fingerprint("SELECT * FROM item WHERE id IN (1, 2)"),
+            get_sql_fingerprint("SELECT * FROM item WHERE id IN (%s)"))
+        self.assertEqual(
+            "INSERT INTO item VALUES (?)",
+            normalize_sql("INSERT INTO item VALUES (1, 'a'), (2, 'b')"))
+
+    def test_statements_are_told_apart(self):
+        """Different statements, or columns, have different fingerprints."""
+        self.assertNotEqual(
+            get_sql_fingerprint("SELECT * FROM item WHERE id = 1")[1],
+            get_sql_fingerprint("SELECT * FROM item WHERE name = 1")[1])
+        self.assertNotEqual(
+            get_sql_fingerprint("SELECT id FROM item")[1],
+            get_sql_fingerprint("SELECT id FROM item2")[1])
+
+    def test_duplicates(self):
+        """Queries repeating an earlier statement count as duplicates."""
+        stats = QueryStats(clock=lambda: 0)
+        for sql in ("SELECT * FROM item WHERE id = 1",
+                    "SELECT * FROM item WHERE id = 2",
+                    "SELECT * FROM item WHERE id = 3",
+                    "SELECT * FROM other"):
+            stats.add(get_sql_fingerprint(sql)[1], 10)
+        self.assertEqual((4, 2, 40), stats.get_values())
+
+
+@override_settings(WF_DB_INSTRUMENTATION=True,
+                   WF_DB_SLOW_QUERY_THRESHOLD=0.05)
+class QueryInstrumentationTest(SimpleTestCase):
+    """Tests of the queries of requests, against SQLite in memory."""
+
+    databases = {'default'}
+
+    def setUp(self):
+        """Forget the spans of earlier tests."""
+        self.tracer = settings.OPENTRACING_TRACING.tracer
+        self.tracer.reset()
+
+    def test_request_queries(self):
+        """Query counters are attached to the request and its route."""
+        self.assertEqual(200, Client().get('/queries/').status_code)
+        spans = self.tracer.finished_spans()
+        request_span, = [span for span in spans
+                         if span.operation_name == 'queries']
+        self.assertEqual(7, request_span.tags['db.query_count'])
+        self.assertEqual(4, request_span.tags['db.duplicate_queries'])
+
+        histograms = {
+            name: [mean for histogram in get_metrics(
+                'histograms', 'response.queries.GET.200.' + name)
+                for dist in histogram.get_current_minute_distribution()
+                for mean, _ in dist.centroids]
+            for name in ('db_queries', 'db_duplicates', 'db_time_ns',
+                         'db_query_ns')}
+        self.assertEqual([7], histograms['db_queries'])
+        self.assertEqual([4], histograms['db_duplicates'])
+        self.assertGreaterEqual(histograms['db_time_ns'][0], 0.05e9)
+        self.assertEqual(7, sum(
+            count for histogram in get_metrics(
+                'histograms', 'response.queries.GET.200.db_query_ns')
+            for dist in histogram.get_current_minute_distribution()
+            for _, count in dist.centroids))
+
+    def test_slow_query_spans(self):
+        """Only queries over the threshold get a child span."""
+        Client().get('/queries/')
+        spans = self.tracer.finished_spans()
+        request_span, = [span for span in spans
+                         if span.operation_name == 'queries']
+        query_span, = [span for span in spans
+                       if span.operation_name.startswith('django.db.')]
+        self.assertEqual('django.db.select', query_span.operation_name)
+        self.assertEqual(request_span.context.span_id, query_span.parent_id)
+        self.assertEqual('SELECT wf_sleep(?)',
+                         query_span.tags['db.statement'])
+        self.assertEqual(get_sql_fingerprint('SELECT wf_sleep(0.06)')[1],
+                         query_span.tags['db.fingerprint'])
+        self.assertEqual('sqlite', query_span.tags['db.type'])
+
+    def test_queries_outside_requests(self):
+        """Queries outside of a request are not counted."""
+        Client().get('/items/')
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        self.assertEqual([], [span for span in self.tracer.finished_spans()
+                              if span.operation_name.startswith('django.')])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+class InstallTest(unittest.TestCase):
+    """Tests of installing the instrumentation per Django version."""
+
+    def test_without_execute_wrappers(self):
+        """Without execute wrappers nothing is installed."""
+        with mock.patch.object(BaseDatabaseWrapper, 'execute_wrapper',
+                               create=True, new=None):
+            del BaseDatabaseWrapper.execute_wrapper
+            with self.assertLogs('wavefront_django_sdk.db', 'WARNING'):
+                self.assertFalse(install_query_instrumentation())
+        self.assertTrue(install_query_instrumentation())
@@ -0,0 +1,61 @@
+"""Tests of the deprecated helpers of the middleware."""
+import types
+
+from django.test import SimpleTestCase, override_settings
+
+from wavefront_django_sdk.middleware import WavefrontMiddleware
+
+from .utils import get_registry
+
+
+class DeprecatedHelpersTest(SimpleTestCase):
+    """Tests of the helpers kept for subclasses and callers."""
+
+    def test_metric_names(self):
+        """Metric names are built as before, with a warning."""
+        request = types.SimpleNamespace(method='GET')
+        response = types.SimpleNamespace(status_code=404)
+        with self.assertWarns(DeprecationWarning):
+            self.assertEqual('request.items.GET',
+                             WavefrontMiddleware.get_metric_name(
+                                 'items', request))
+        with self.assertWarns(DeprecationWarning):
+            self.assertEqual('response.items.GET.404',
+                             WavefrontMiddleware.get_metric_name(
+                                 'items', request, response))
+        with self.assertWarns(DeprecationWarning):
+            self.assertEqual(
+                'request.items.GET',
+                WavefrontMiddleware.get_metric_name_without_status(
+                    'items', request))
+
+    def test_update_gauge(self):
+        """Updates add to an inflight gauge of the registry."""
+        registry = get_registry()
+        tags = {'application': 'app'}
+        with self.assertWarns(DeprecationWarning):
+            WavefrontMiddleware.update_gauge(
+                registry, 'test.deprecated.inflight', tags, 1)
+            WavefrontMiddleware.update_gauge(
+                registry, 'test.deprecated.inflight', tags, 1)
+            WavefrontMiddleware.update_gauge(
+                registry, 'test.deprecated.inflight', tags, -1)
+        self.assertEqual(1, registry.gauge(
+            'test.deprecated.inflight', tags=tags).get_value())
+
+    def test_update_plain_gauge(self):
+        """Gauges registered without InflightGauge are still updated."""
+        registry = get_registry()
+        registry.gauge('test.deprecated.plain', default=0)
+        with self.assertWarns(DeprecationWarning):
+            WavefrontMiddleware.update_gauge(
+                registry, 'test.deprecated.plain', None, 2)
+        self.assertEqual(2, registry.gauge(
+            'test.deprecated.plain').get_value())
+
+    @override_settings(OPENTRACING_TRACED_ATTRIBUTES=['path', 'method'])
+    def test_traced_attributes(self):
+        """Traced attributes are read from settings."""
+        with self.assertWarns(DeprecationWarning):
+            self.assertEqual(['path', 'method'],
+                             WavefrontMiddleware.get_traced_attributes())
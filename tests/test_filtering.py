@@ -0,0 +1,175 @@
+"""Tests of the include and exclude rules of requests."""
+import unittest
+
+from django.conf import settings
+from django.test import Client, SimpleTestCase, override_settings
+from django.urls import resolve
+
+from wavefront_django_sdk.filtering import PathMatcher, RequestFilter, \
+    RouteMatcher
+
+from .utils import get_metrics
+
+
+def get_skipped():
+    """Get the number of requests skipped so far."""
+    return sum(counter.get_count()
+               for counter in get_metrics('counters', 'requests.skipped'))
+
+
+class PathMatcherTest(unittest.TestCase):
+    """Tests of PathMatcher."""
+
+    def test_prefixes(self):
+        """Rules without ^ match the start of the path."""
+        matcher = PathMatcher(['/static/', '/health'])
+        self.assertTrue(matcher.match('/static/app.css'))
+        self.assertTrue(matcher.match('/health'))
+        self.assertTrue(matcher.match('/healthz'))
+        self.assertFalse(matcher.match('/api/static/'))
+        self.assertFalse(matcher.match('/'))
+
+    def test_covered_prefixes_are_dropped(self):
+        """Prefixes of other prefixes cover them."""
+        self.assertEqual(('/api/', '/static'), PathMatcher(
+            ['/static/css/', '/api/', '/static', '/api/v1/']).prefixes)
+
+    def test_regular_expressions(self):
+        """Rules with ^ are regular expressions matched at the start."""
+        matcher = PathMatcher([r'^/favicon\.ico$', r'^/items/\d+/$'])
+        self.assertIsNone(matcher.prefixes or None)
+        self.assertTrue(matcher.match('/favicon.ico'))
+        self.assertFalse(matcher.match('/favicon.ico.bak'))
+        self.assertTrue(matcher.match('/items/42/'))
+        self.assertFalse(matcher.match('/items/new/'))
+        self.assertFalse(matcher.match('/api/items/42/'))
+
+    def test_prefixes_and_regular_expressions(self):
+        """Both kinds of rules are checked."""
+        matcher = PathMatcher(['/static/', r'^/items/\d+/$'])
+        self.assertTrue(matcher.match('/static/app.js'))
+        self.assertTrue(matcher.match('/items/1/'))
+        self.assertFalse(matcher.match('/items/'))
+
+    def test_no_rules(self):
+        """A matcher without rules is falsy and matches nothing."""
+        self.assertFalse(PathMatcher())
+        self.assertFalse(PathMatcher().match('/'))
+        self.assertTrue(PathMatcher(['^/']))
+
+
+class RouteMatcherTest(unittest.TestCase):
+    """Tests of RouteMatcher, against the routes of the test URLs."""
+
+    def test_names(self):
+        """URL names match with or without their namespace."""
+        matcher = RouteMatcher(['items'])
+        self.assertTrue(matcher.match(resolve('/items/')))
+        self.assertTrue(matcher.match(resolve('/api/items/')))
+        self.assertFalse(matcher.match(resolve('/fail/')))
+
+    def test_namespaced_names(self):
+        """Namespaced URL names only match in their namespace."""
+        matcher = RouteMatcher(['api:items'])
+        self.assertTrue(matcher.match(resolve('/api/items/')))
+        self.assertFalse(matcher.match(resolve('/items/')))
+
+    def test_namespaces(self):
+        """Rules ending with a colon match every route of a namespace."""
+        matcher = RouteMatcher(['api:'])
+        self.assertTrue(matcher.match(resolve('/api/items/')))
+        self.assertFalse(matcher.match(resolve('/items/')))
+        self.assertFalse(RouteMatcher(['ap:']).match(resolve('/api/items/')))
+
+    def test_unresolved(self):
+        """Requests which did not resolve match no route."""
+        self.assertFalse(RouteMatcher(['items', 'api:']).match(None))
+
+
+class RequestFilterTest(unittest.TestCase):
+    """Tests of the precedence of the rules of RequestFilter."""
+
+    def test_no_rules(self):
+        """A filter without rules is falsy and skips nothing."""
+        request_filter = RequestFilter()
+        self.assertFalse(request_filter)
+        self.assertFalse(request_filter.skip_request('/items/', 'GET'))
+        self.assertFalse(request_filter.skip_route(None))
+
+    def test_exclude_wins_over_include(self):
+        """Requests matching both kinds of rules are skipped."""
+        request_filter = RequestFilter(
+            included_paths=['/api/'], excluded_paths=['/api/items/'],
+            included_methods=['get', 'post'], excluded_methods=['post'],
+            included_routes=['api:'], excluded_routes=['api:items'])
+        self.assertTrue(request_filter.skip_request('/api/items/', 'GET'))
+        self.assertTrue(request_filter.skip_request('/api/other/', 'POST'))
+        self.assertFalse(request_filter.skip_request('/api/other/', 'GET'))
+        self.assertTrue(request_filter.skip_route(resolve('/api/items/')))
+
+    def test_include(self):
+        """Requests matching no include rule of a kind are skipped."""
+        request_filter = RequestFilter(included_paths=['/api/'],
+                                       included_methods=['GET'])
+        self.assertFalse(request_filter.skip_request('/api/items/', 'GET'))
+        self.assertTrue(request_filter.skip_request('/items/', 'GET'))
+        self.assertTrue(request_filter.skip_request('/api/items/', 'PUT'))
+        # Other kinds of rules are not restricted.
+        self.assertFalse(request_filter.skip_route(resolve('/items/')))
+
+    def test_include_routes(self):
+        """Only included routes are kept, unresolved requests are not."""
+        request_filter = RequestFilter(included_routes=['items'])
+        self.assertFalse(request_filter.skip_route(resolve('/items/')))
+        self.assertTrue(request_filter.skip_route(resolve('/fail/')))
+        self.assertTrue(request_filter.skip_route(None))
+        self.assertFalse(request_filter.skip_request('/missing/', 'GET'))
+
+
+class MiddlewareFilteringTest(SimpleTestCase):
+    """Tests of the requests the middleware skips."""
+
+    def setUp(self):
+        """Get the tracer of the spans of requests."""
+        self.tracer = settings.OPENTRACING_TRACING.tracer
+
+    def request(self, path, method='get'):
+        """Request a path.
+
+        :return: Tuple of the status code, whether the request was traced
+            and whether it was counted as skipped.
+        """
+        self.tracer.reset()
+        skipped = get_skipped()
+        response = getattr(Client(), method)(path)
+        return (response.status_code, bool(self.tracer.finished_spans()),
+                get_skipped() - skipped)
+
+    @override_settings(WF_EXCLUDED_PATHS=['/status/', r'^/fail/$'],
+                       WF_EXCLUDED_METHODS=['HEAD'])
+    def test_excluded_paths_and_methods(self):
+        """Excluded requests are served without a span."""
+        self.assertEqual((200, True, 0), self.request('/items/'))
+        self.assertEqual((201, False, 1), self.request('/status/201/'))
+        self.assertEqual((500, False, 1), self.request('/fail/'))
+        self.assertEqual((200, False, 1), self.request('/items/', 'head'))
+
+    @override_settings(WF_INCLUDED_ROUTES=['api:'],
+                       WF_EXCLUDED_ROUTES=['fail'])
+    def test_routes(self):
+        """Routes outside the included namespace are skipped."""
+        self.assertEqual((200, True, 0), self.request('/api/items/'))
+        self.assertEqual((200, False, 1), self.request('/items/'))
+        self.assertEqual((500, False, 1), self.request('/fail/'))
+
+    def test_unresolved_under_included_routes(self):
+        """Requests which did not resolve are skipped, and counted once."""
+        def count_not_found():
+            return sum(counter.get_count() for counter in get_metrics(
+                'counters', 'response.UNKNOWN.GET.404.cumulative'))
+        self.assertEqual((404, False, 0), self.request('/missing/'))
+        not_found = count_not_found()
+        with override_settings(WF_INCLUDED_ROUTES=['items']):
+            self.assertEqual((404, False, 1), self.request('/missing/'))
+            self.assertEqual((200, True, 0), self.request('/items/'))
+        self.assertEqual(not_found, count_not_found())
@@ -0,0 +1,79 @@
+"""Tests of the hooks and receivers of replaced middleware instances."""
+import gc
+import types
+import unittest
+
+from django.http import HttpResponse
+from django.test import SimpleTestCase, override_settings
+from django.test.signals import setting_changed
+
+from wavefront_django_sdk.middleware import WavefrontMiddleware
+from wavefront_django_sdk.recorder import BufferedRecorder
+from wavefront_django_sdk.registry import run_pre_report_hooks
+from wavefront_django_sdk.rollup import CounterRollup
+
+from .utils import get_registry
+
+
+def get_response(request):  # pylint: disable=unused-argument
+    """Respond to every request with an empty page."""
+    return HttpResponse()
+
+
+def count_hooks():
+    """Get number of live pre-report hooks of the registry."""
+    registry = get_registry()
+    run_pre_report_hooks(registry)
+    return len(registry._wf_pre_report_hooks)
+
+
+class MiddlewareHooksTest(SimpleTestCase):
+    """Tests of constructing the middleware over and over."""
+
+    def test_hooks_go_away_with_the_middleware(self):
+        """Hooks of collected middleware instances are dropped."""
+        before = count_hooks()
+        middlewares = [WavefrontMiddleware(get_response) for _ in range(5)]
+        per_instance = (count_hooks() - before) // 5
+        self.assertGreater(per_instance, 0)
+        del middlewares
+        gc.collect()
+        self.assertLessEqual(count_hooks(), before + per_instance)
+
+    def test_settings_receiver_is_connected_once(self):
+        """Every middleware instance reloads through one receiver."""
+        WavefrontMiddleware(get_response)
+        receivers = len(setting_changed.receivers)
+        middlewares = [WavefrontMiddleware(get_response) for _ in range(5)]
+        self.assertEqual(receivers, len(setting_changed.receivers))
+        with override_settings(WF_EXCLUDED_PATHS='/health'):
+            for middleware in middlewares:
+                self.assertIsNotNone(middleware.request_filter)
+        for middleware in middlewares:
+            self.assertIsNone(middleware.request_filter)
+
+
+class FinalizeTest(unittest.TestCase):
+    """Tests of counts pending in collected rollups and recorders."""
+
+    def test_rollup_flushes_when_collected(self):
+        """Responses rolled up but not yet flushed are not lost."""
+        target = get_registry().counter('test.rollup.finalize')
+        rollup = CounterRollup(get_registry())
+        rollup.counter('key', [target]).inc(3)
+        del rollup
+        gc.collect()
+        self.assertEqual(3, target.get_count())
+
+    def test_recorder_merges_when_collected(self):
+        """Responses buffered but not yet merged are not lost."""
+        registry = get_registry()
+        route_metrics = types.SimpleNamespace(
+            responses=registry.counter('test.recorder.finalize'),
+            total_time=registry.counter('test.recorder.finalize.time'))
+        recorder = BufferedRecorder(registry)
+        recorder.record(route_metrics)
+        recorder.record(route_metrics)
+        del recorder
+        gc.collect()
+        self.assertEqual(2, route_metrics.responses.get_count())
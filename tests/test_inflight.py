@@ -0,0 +1,115 @@
+"""Tests of the inflight gauges under concurrent requests."""
+import _thread
+import threading
+import unittest
+
+from django.test import Client
+
+from wavefront_django_sdk.inflight import InflightGauge
+
+from .utils import get_metrics
+
+THREADS = 32
+PAIRS = 20000
+
+
+def run_threads(target, count=THREADS):
+    """Run a function in threads started together, and wait for them."""
+    barrier = threading.Barrier(count)
+
+    def run():
+        barrier.wait()
+        target()
+    threads = [threading.Thread(target=run) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class InflightGaugeTest(unittest.TestCase):
+    """Tests of InflightGauge."""
+
+    def test_concurrent_pairs_end_at_zero(self):
+        """Increments and decrements of many threads are never lost."""
+        gauge = InflightGauge()
+        peaks = []
+
+        def work():
+            for _ in range(PAIRS):
+                gauge.add(1)
+                gauge.add(-1)
+            gauge.add(1)
+            peaks.append(gauge.get_value())
+        run_threads(work)
+        self.assertEqual(THREADS, gauge.get_value())
+        self.assertTrue(all(0 < peak <= THREADS for peak in peaks))
+
+        run_threads(lambda: gauge.add(-1))
+        self.assertEqual(0, gauge.get_value())
+
+    def test_finished_threads_are_folded(self):
+        """Counters of finished threads are folded into the base value."""
+        gauge = InflightGauge()
+        run_threads(lambda: gauge.add(1))
+        self.assertEqual(THREADS, gauge.get_value())
+        self.assertEqual([], gauge._cells)  # pylint: disable=W0212
+        gauge.add(-THREADS)
+        self.assertEqual(0, gauge.get_value())
+
+    def test_threads_started_outside_python_are_folded(self):
+        """Counters of threads without threading.Thread are folded too."""
+        gauge = InflightGauge()
+        done = threading.Event()
+
+        def work():
+            gauge.add(1)
+            gauge.add(1)
+            gauge.add(-1)
+            done.set()
+        # Runs with a threading._DummyThread, which is always alive.
+        _thread.start_new_thread(work, ())
+        done.wait(5)
+        for _ in range(100):
+            if not gauge._cells:  # pylint: disable=W0212
+                break
+            threading.Event().wait(0.01)
+            gauge.get_value()
+        self.assertEqual(1, gauge.get_value())
+        self.assertEqual([], gauge._cells)  # pylint: disable=W0212
+
+
+def get_responses():
+    """Get number of successful responses of the items route so far."""
+    return sum(counter.get_count() for counter in get_metrics(
+        'counters', 'response.items.GET.200.cumulative'))
+
+
+class MiddlewareInflightTest(unittest.TestCase):
+    """Tests of the inflight gauges of the middleware."""
+
+    def test_gauges_return_to_zero(self):
+        """Total and route inflight gauges are 0 once requests are done."""
+        statuses = []
+        responses = get_responses()
+
+        def work():
+            client = Client()
+            for _ in range(20):
+                statuses.append(client.get('/items/').status_code)
+                statuses.append(client.get('/fail/').status_code)
+        run_threads(work, count=8)
+        self.assertEqual([200] * 160 + [500] * 160, sorted(statuses))
+
+        total = get_metrics('gauges', 'total_requests.inflight')
+        routes = get_metrics('gauges', 'request.items.GET.inflight') + \
+            get_metrics('gauges', 'request.fail.GET.inflight')
+        self.assertEqual(1, len(total))
+        self.assertEqual(2, len(routes))
+        for gauge in total + routes:
+            self.assertEqual(0, gauge.get_value())
+        self.assertEqual(160, get_responses() - responses)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+"""Tests of forwarding worker metrics to a host collector."""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import types
+import unittest
+from unittest import mock
+
+from wavefront_django_sdk.inflight import InflightGauge
+from wavefront_django_sdk.multiprocess import CollectorHistogram, \
+    MetricsCollector, MetricsForwarder
+
+from wavefront_pyformance.delta import delta_counter
+from wavefront_pyformance.tagged_registry import TaggedRegistry
+from wavefront_pyformance.wavefront_histogram import wavefront_histogram
+
+TAGS = {'application': 'app'}
+
+
+def wait_until(condition, timeout=5):
+    """Wait until a condition holds, as the collector merges in a thread."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not met within {}s".format(
+                timeout))
+        threading.Event().wait(0.01)
+
+
+class Worker:
+    """Registry and forwarder of a simulated pre-fork worker."""
+
+    def __init__(self, socket_path, pid):
+        """Construct Worker.
+
+        :param socket_path: Unix socket of the collector.
+        :param pid: Process id the worker forwards as.
+        """
+        self.pid = pid
+        self.registry = TaggedRegistry()
+        self.forwarder = MetricsForwarder(socket_path, self.registry)
+
+    def forward(self):
+        """Forward the metrics changed since the last forward."""
+        with mock.patch('os.getpid', return_value=self.pid):
+            self.forwarder.report_now()
+
+    def stop(self):
+        """Forward the remaining metrics and disconnect."""
+        with mock.patch('os.getpid', return_value=self.pid):
+            self.forwarder.stop()
+
+
+class MultiprocessTest(unittest.TestCase):
+    """Tests of MetricsForwarder and MetricsCollector."""
+
+    def setUp(self):
+        """Start a collector listening on a temporary unix socket."""
+        self.directory = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.directory, 'collector.sock')
+        self.registry = TaggedRegistry()
+        reporter = types.SimpleNamespace(registry=None, prefix='',
+                                         wavefront_client=None)
+        self.collector = MetricsCollector(self.socket_path, reporter,
+                                          registry=self.registry)
+        self.collector.start(start_reporter=False)
+        self.workers = [Worker(self.socket_path, pid)
+                        for pid in (1001, 1002)]
+
+    def tearDown(self):
+        """Stop the collector and remove its socket."""
+        for worker in self.workers:
+            worker.forwarder._close_socket()  # pylint: disable=W0212
+        self.collector.stop()
+        shutil.rmtree(self.directory)
+
+    def get_count(self, key):
+        """Get the count of a counter of the collector, 0 if missing."""
+        counter = self.registry._counters.get(key)  # pylint: disable=W0212
+        return counter.get_count() if counter is not None else 0
+
+    def get_gauge(self, key):
+        """Get the value of a gauge of the collector."""
+        return self.registry._gauges[key].get_value()  # pylint: disable=W0212
+
+    # pylint: disable=protected-access
+    def test_merge_workers(self):
+        """Counters add up, gauges sum per live worker, histograms merge."""
+        for i, worker in enumerate(self.workers, 1):
+            worker.registry.counter('requests', tags=TAGS).inc(10 * i)
+            delta_counter(worker.registry, 'responses', tags=TAGS).inc(i)
+            worker.registry.gauge('inflight', gauge=InflightGauge(),
+                                  tags=TAGS).add(i)
+            histogram = wavefront_histogram(worker.registry, 'latency',
+                                            tags=TAGS)
+            for value in range(i * 100):
+                histogram.add(value)
+        keys = list(self.workers[0].registry._counters)
+        counter_key = next(key for key in keys if 'requests' in key)
+        delta_key = next(key for key in keys if 'responses' in key)
+        gauge_key, = self.workers[0].registry._gauges
+        histogram_key, = self.workers[0].registry._histograms
+        for worker in self.workers:
+            worker.forward()
+        wait_until(lambda: self.get_count(counter_key) == 30 and
+                   self.get_count(delta_key) == 3 and
+                   gauge_key in self.registry._gauges and
+                   self.get_gauge(gauge_key) == 3)
+        for worker in self.workers:
+            # Delta counters are sent once, then reset in the worker.
+            self.assertEqual(0, worker.registry._counters[delta_key]
+                             .get_count())
+
+        # Only increments since the last forward are sent.
+        self.workers[0].registry.counter('requests', tags=TAGS).inc(5)
+        self.workers[0].forward()
+        wait_until(lambda: self.get_count(counter_key) == 35)
+
+        # Finished minutes and, when stopping, the current one are sent.
+        for worker in self.workers:
+            worker.stop()
+        histogram = self.registry._histograms[histogram_key]
+        self.assertIsInstance(histogram, CollectorHistogram)
+        wait_until(lambda: sum(
+            count for centroids in list(histogram._distributions.values())
+            for _, count in centroids) == 300)
+        distributions = histogram.get_distribution()
+        self.assertEqual(300, sum(count for dist in distributions
+                                  for _, count in dist.centroids))
+
+        # Workers which disconnected no longer count towards gauges.
+        wait_until(lambda: self.get_gauge(gauge_key) == 0)
+        self.assertEqual(35, self.get_count(counter_key))
+
+    # pylint: disable=protected-access
+    def test_remove_worker(self):
+        """Gauge values of a removed worker are dropped."""
+        for i, worker in enumerate(self.workers, 1):
+            worker.registry.gauge('inflight', gauge=InflightGauge(),
+                                  tags=TAGS).add(i)
+            worker.forward()
+        gauge_key, = self.workers[0].registry._gauges
+        wait_until(lambda: gauge_key in self.registry._gauges and
+                   self.get_gauge(gauge_key) == 3)
+        self.collector.remove_worker(1001)
+        self.assertEqual(2, self.get_gauge(gauge_key))
+        self.collector.remove_worker(1002)
+        self.assertEqual(0, self.get_gauge(gauge_key))
+
+    # pylint: disable=protected-access
+    def test_counter_registered_again(self):
+        """A counter expired and registered again is forwarded from 0."""
+        worker = self.workers[0]
+        worker.registry.counter('requests', tags=TAGS).inc(4)
+        worker.forward()
+        counter_key, = worker.registry._counters
+        wait_until(lambda: self.get_count(counter_key) == 4)
+
+        del worker.registry._counters[counter_key]
+        worker.registry.counter('requests', tags=TAGS).inc(1)
+        worker.forward()
+        wait_until(lambda: self.get_count(counter_key) == 5)
+        self.assertEqual({counter_key: 1}, worker.forwarder._sent_counts)
+
+        # Counters dropped for good are forgotten.
+        del worker.registry._counters[counter_key]
+        worker.forward()
+        self.assertEqual({}, worker.forwarder._sent_counts)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+"""Tests of the traced session against a local HTTP server."""
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from django.conf import settings
+
+from opentracing.propagation import Format
+
+import requests
+
+from wavefront_django_sdk.outbound import TracedSession
+from wavefront_django_sdk.runtime import get_runtime
+
+from .utils import get_metrics
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    """HTTP server answering every request in a thread."""
+
+    daemon_threads = True
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Answer GET requests, with 500 for paths containing 'fail'."""
+
+    protocol_version = 'HTTP/1.1'
+
+    # pylint: disable=invalid-name
+    def do_GET(self):  # noqa: N802
+        """Record the request and answer it."""
+        self.server.requests.append((self.path, dict(self.headers)))
+        self.server.clients.add(self.client_address)
+        self.send_response(500 if 'fail' in self.path else 200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Log nothing."""
+
+
+class TracedSessionTest(unittest.TestCase):
+    """Tests of TracedSession."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Start the local HTTP server."""
+        cls.server = Server(('127.0.0.1', 0), Handler)
+        cls.server.requests = []
+        cls.server.clients = set()
+        cls.thread = threading.Thread(target=cls.server.serve_forever,
+                                      daemon=True)
+        cls.thread.start()
+        cls.url = 'http://127.0.0.1:{}'.format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Stop the local HTTP server."""
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        """Start every test with a new session and no spans."""
+        self.server.requests.clear()
+        self.server.clients.clear()
+        self.tracer = settings.OPENTRACING_TRACING.tracer
+        self.tracer.reset()
+        self.session = TracedSession(pool_size=2)
+
+    def tearDown(self):
+        """Close the connections of the session."""
+        self.session.close()
+
+    def get_latencies(self, status):
+        """Get number of calls timed into a latency histogram."""
+        return sum(count for histogram in get_metrics(
+            'histograms', 'client.127_0_0_1.GET.{}.latency'.format(status))
+            for dist in histogram.get_current_minute_distribution()
+            for _, count in dist.centroids)
+
+    def test_child_spans_and_headers(self):
+        """Calls get child spans of the active span, sent as headers."""
+        with self.tracer.start_active_span('request') as scope:
+            self.assertEqual(200, self.session.get(self.url + '/a')
+                             .status_code)
+            self.assertEqual(500, self.session.get(self.url + '/fail')
+                             .status_code)
+        spans = {span.operation_name: span
+                 for span in self.tracer.finished_spans()}
+        calls = [span for span in self.tracer.finished_spans()
+                 if span.operation_name == 'http.get']
+        self.assertEqual(2, len(calls))
+        for call, (path, headers) in zip(calls, self.server.requests):
+            self.assertEqual(scope.span.context.span_id, call.parent_id)
+            self.assertEqual('client', call.tags['span.kind'])
+            self.assertEqual(self.url + path, call.tags['http.url'])
+            context = self.tracer.extract(
+                Format.HTTP_HEADERS,
+                {name.lower(): value for name, value in headers.items()})
+            self.assertEqual(call.context.span_id, context.span_id)
+            self.assertEqual(call.context.trace_id, context.trace_id)
+        self.assertEqual(200, calls[0].tags['http.status_code'])
+        self.assertNotIn('error', calls[0].tags)
+        self.assertEqual('true', calls[1].tags['error'])
+        self.assertIn('request', spans)
+
+    def test_latency_histograms(self):
+        """Calls are timed per host, method and status in the registry."""
+        before = {status: self.get_latencies(status)
+                  for status in ('200', '500', 'error')}
+        self.session.get(self.url + '/a')
+        self.session.get(self.url + '/fail')
+        with self.assertRaises(requests.ConnectionError):
+            self.session.get('http://127.0.0.1:1/', timeout=1)
+        for status in ('200', '500', 'error'):
+            self.assertEqual(1, self.get_latencies(status) - before[status])
+
+    def test_runtime_registry(self):
+        """Without middleware, the registry of the runtime is used."""
+        self.assertIs(get_runtime().get_registry(),
+                      TracedSession().get_registry())
+
+    def test_orphan_calls(self):
+        """Calls without an active span are only timed, unless asked."""
+        self.session.get(self.url + '/a')
+        self.assertEqual([], self.tracer.finished_spans())
+        session = TracedSession(trace_orphans=True)
+        session.get(self.url + '/a')
+        session.close()
+        span, = self.tracer.finished_spans()
+        self.assertIsNone(span.parent_id)
+
+    def test_connections_are_reused(self):
+        """Sequential calls to a host share one kept-alive connection."""
+        for _ in range(5):
+            self.session.get(self.url + '/a')
+        self.assertEqual(5, len(self.server.requests))
+        self.assertEqual(1, len(self.server.clients))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+"""Tests of following streaming responses until they are closed."""
+import io
+import itertools
+import types
+import unittest
+
+from django.http import FileResponse, StreamingHttpResponse
+
+from wavefront_django_sdk.payload import StreamedBytes, follow_stream
+
+
+class FollowStreamTest(unittest.TestCase):
+    """Tests of the callback once a streaming response is closed."""
+
+    def setUp(self):
+        """Count the calls of a fake clock and record the callbacks."""
+        self.clock = itertools.count(1).__next__
+        self.closed = []
+
+    def on_close(self, end_ns, size):
+        """Record a callback."""
+        self.closed.append((end_ns, size))
+
+    def test_streamed_bytes_are_counted(self):
+        """The bytes and end of the stream are reported on close."""
+        response = StreamingHttpResponse(iter([b'ab', b'cde']))
+        follow_stream(response, self.clock, self.on_close)
+        self.assertEqual(b'abcde', b''.join(response))
+        self.assertEqual([], self.closed)
+        response.close()
+        self.assertEqual([(1, 5)], self.closed)
+
+    def test_file_response_is_not_wrapped(self):
+        """A file response keeps its file and reports its Content-Length."""
+        response = FileResponse(io.BytesIO(b'abc'))
+        follow_stream(response, self.clock, self.on_close)
+        self.assertNotIsInstance(response._iterator, StreamedBytes)
+        self.assertEqual(b'abc', b''.join(response))
+        response.close()
+        self.assertEqual([(None, 3)], self.closed)
+
+    def test_response_without_resource_closers(self):
+        """Before Django 3.0 the close method of the response is wrapped."""
+        response_closed = []
+        response = types.SimpleNamespace(
+            streaming_content=iter([b'abc']),
+            close=lambda: response_closed.append(True))
+        follow_stream(response, self.clock, self.on_close)
+        self.assertEqual([b'abc'], list(response.streaming_content))
+        response.close()
+        self.assertEqual([(1, 3)], self.closed)
+        self.assertEqual([True], response_closed)
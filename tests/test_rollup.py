@@ -0,0 +1,165 @@
+"""Tests that rolled up counters are reported like counters per response."""
+from django.test import Client, SimpleTestCase, override_settings
+
+from wavefront_django_sdk.registry import run_pre_report_hooks
+
+from wavefront_pyformance.delta import DeltaCounter, delta_counter
+from wavefront_pyformance.tagged_registry import TaggedRegistry
+
+from wavefront_sdk.common import ApplicationTags
+
+from .utils import get_registry
+
+# (path, URL name, view function, status) of the responses of every test.
+RESPONSES = (
+    [('/items/', 'items', 'items', 200)] * 3 +
+    [('/status/201/', 'status', 'status', 201)] +
+    [('/status/404/', 'status', 'status', 404)] * 2 +
+    [('/status/400/', 'status', 'status', 400)] +
+    [('/fail/', 'fail', 'fail', 500)] * 2 +
+    [('/status/503/', 'status', 'status', 503)])
+
+
+def count_responses(registry, application_tags, entity_name, func_name,
+                    status):
+    """Count a response the way the middleware did before the rollup."""
+    # pylint: disable=too-many-locals
+    null = 'none'
+    application = application_tags.application or null
+    cluster = application_tags.cluster or null
+    service = application_tags.service or null
+    shard = application_tags.shard or null
+
+    def tags(cluster=None, service=None, shard=None, module_name=None,
+             func_name=None, source=None):
+        tags_map = {'application': application}
+        for key, value in (('cluster', cluster), ('service', service),
+                           ('shard', shard),
+                           ('django.resource.module', module_name),
+                           ('django.resource.func', func_name),
+                           ('source', source)):
+            if value:
+                tags_map[key] = value
+        return tags_map
+
+    route = dict(module_name='tests.urls', func_name=func_name)
+    source = 'wavefront-provided'
+    key = 'response.{}.GET.{}'.format(entity_name, status)
+    complete = tags(cluster, service, shard, **route)
+    registry.counter(key + '.cumulative', tags=complete).inc()
+    if application_tags.shard:
+        delta_counter(registry, key + '.aggregated_per_shard',
+                      tags=tags(cluster, service, shard, source=source,
+                                **route)).inc()
+    delta_counter(registry, key + '.aggregated_per_service',
+                  tags=tags(cluster, service, source=source, **route)).inc()
+    if application_tags.cluster:
+        delta_counter(registry, key + '.aggregated_per_cluster',
+                      tags=tags(cluster, source=source, **route)).inc()
+    delta_counter(registry, key + '.aggregated_per_application',
+                  tags=tags(source=source, **route)).inc()
+    if 400 <= status <= 599:
+        registry.counter('request.{}.GET'.format(entity_name),
+                         tags=complete).inc()
+        registry.counter('response.errors', tags=complete).inc()
+        registry.counter('response.errors.aggregated_per_source',
+                         tags=tags(cluster, service, shard)).inc()
+        if application_tags.shard:
+            delta_counter(registry, 'response.errors.aggregated_per_shard',
+                          tags=tags(cluster, service, shard,
+                                    source=source)).inc()
+        delta_counter(registry, 'response.errors.aggregated_per_service',
+                      tags=tags(cluster, service, source=source)).inc()
+        if application_tags.cluster:
+            delta_counter(registry, 'response.errors.aggregated_per_cluster',
+                          tags=tags(cluster, source=source)).inc()
+        delta_counter(registry, 'response.errors.aggregated_per_application',
+                      tags=tags(source=source)).inc()
+    registry.counter('response.completed.aggregated_per_source',
+                     tags=tags(cluster, service, shard)).inc()
+    if shard != null:
+        delta_counter(registry, 'response.completed.aggregated_per_shard',
+                      tags=tags(cluster, service, shard, source=source)).inc()
+        registry.counter('response.completed.aggregated_per_service',
+                         tags=tags(cluster, service, source=source)).inc()
+    if cluster != null:
+        delta_counter(registry, 'response.completed.aggregated_per_cluster',
+                      tags=tags(cluster, source=source)).inc()
+        registry.counter('response.completed.aggregated_per_application',
+                         tags=tags(source=source)).inc()
+
+
+def get_response_counters(registry):
+    """Get count and type of the response counters of a registry."""
+    return {key: (counter.get_count(), isinstance(counter, DeltaCounter))
+            for key, counter in registry._counters.items()
+            if key.lstrip('∆').startswith(('response.', 'request.'))
+            and '.total_time-' not in key and '.over_slo' not in key}
+
+
+class RollupTest(SimpleTestCase):
+    """Tests of the counters reported for a mix of responses."""
+
+    def assert_counters(self, application_tags, buffered):
+        """Compare the counters of the responses with the reference."""
+        registry = get_registry()
+        run_pre_report_hooks(registry)
+        before = get_response_counters(registry)
+        with override_settings(APPLICATION_TAGS=application_tags,
+                               WF_BUFFERED_RECORDING=buffered):
+            client = Client()
+            for path, _, _, status in RESPONSES:
+                self.assertEqual(status, client.get(path).status_code)
+            run_pre_report_hooks(registry)
+        after = get_response_counters(registry)
+        counted = {}
+        for key, (count, is_delta) in after.items():
+            count -= before.get(key, (0, is_delta))[0]
+            if count:
+                counted[key] = (count, is_delta)
+
+        reference = TaggedRegistry()
+        for _, entity_name, func_name, status in RESPONSES:
+            count_responses(reference, application_tags, entity_name,
+                            func_name, status)
+        self.assertEqual(get_response_counters(reference), counted)
+        return counted
+
+    def test_shard_and_cluster_combinations(self):
+        """Names, tags, types and counts match with and without buffers."""
+        for cluster in (None, 'us-west'):
+            for shard in (None, 'primary'):
+                for buffered in (False, True):
+                    with self.subTest(cluster=cluster, shard=shard,
+                                      buffered=buffered):
+                        self.assert_counters(ApplicationTags(
+                            application='rollup', service='svc',
+                            cluster=cluster, shard=shard), buffered)
+
+    def test_counter_names(self):
+        """Spot check the reported names of one configuration."""
+        counted = self.assert_counters(ApplicationTags(
+            application='names', service='svc', cluster='c', shard='s'),
+            False)
+        names = {key.split('-tags=')[0] for key in counted}
+        self.assertEqual({
+            'response.items.GET.200.cumulative',
+            '∆response.items.GET.200.aggregated_per_shard',
+            '∆response.items.GET.200.aggregated_per_service',
+            '∆response.items.GET.200.aggregated_per_cluster',
+            '∆response.items.GET.200.aggregated_per_application',
+            'response.completed.aggregated_per_source',
+            '∆response.completed.aggregated_per_shard',
+            'response.completed.aggregated_per_service',
+            '∆response.completed.aggregated_per_cluster',
+            'response.completed.aggregated_per_application',
+        }, {name for name in names if 'items' in name or
+            'completed' in name})
+        shared = {'application': 'names', 'cluster': 'c', 'service': 'svc',
+                  'shard': 's'}
+        self.assertEqual((6, False), counted[TaggedRegistry.encode_key(
+            'response.errors.aggregated_per_source', shared)])
+        self.assertEqual((2, False), counted[TaggedRegistry.encode_key(
+            'response.fail.GET.500.cumulative',
+            dict(shared, **{'django.resource.module': 'tests.urls',
+                            'django.resource.func': 'fail'}))])
@@ -0,0 +1,21 @@
+"""Tests of the reporter runtime across forks."""
+import os
+import unittest
+from unittest import mock
+
+from wavefront_django_sdk.runtime import ReporterRuntime
+
+
+class ForkTest(unittest.TestCase):
+    """Tests of a runtime inherited by a forked child."""
+
+    def test_start_resets_runtime_of_parent(self):
+        """Without fork hooks, start notices the new pid and starts over."""
+        runtime = ReporterRuntime()
+        runtime.started = True
+        self.assertFalse(runtime.start())
+        with mock.patch('os.getpid', return_value=os.getpid() + 1):
+            runtime.start()
+            self.assertEqual(os.getpid(), runtime.pid)
+        self.assertTrue(runtime.forked)
+        self.assertFalse(runtime.started)
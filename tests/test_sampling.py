@@ -0,0 +1,199 @@
+"""Tests of head-based trace sampling and keeping failed or slow requests."""
+import itertools
+import time
+import types
+import unittest
+from unittest import mock
+
+from django.conf import settings
+from django.test import Client, SimpleTestCase, override_settings
+
+from wavefront_django_sdk.sampling import TokenBucket, TraceSampler, \
+    get_trace_sampler
+
+SECONDS = 10 ** 9
+
+
+def slow_clock():
+    """Get a wall clock advancing two seconds on every call."""
+    ticks = itertools.count(0, 2 * SECONDS)
+    return lambda: next(ticks)
+
+
+class TokenBucketTest(unittest.TestCase):
+    """Tests of TokenBucket, on a frozen monotonic clock."""
+
+    def setUp(self):
+        """Freeze time.monotonic, advanced by the tests."""
+        self.now = 1000.0
+        patcher = mock.patch('time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def consume(self, times):
+        """Get the number of tokens taken out of some attempts."""
+        return sum(self.bucket.consume() for _ in range(times))
+
+    def test_burst_up_to_capacity(self):
+        """A full bucket allows one second worth of tokens at once."""
+        self.bucket = TokenBucket(3)
+        self.assertEqual(3, self.consume(10))
+
+    def test_refill_at_rate(self):
+        """Tokens come back at the rate, up to the capacity."""
+        self.bucket = TokenBucket(4)
+        self.consume(4)
+        self.now += 0.5
+        self.assertEqual(2, self.consume(10))
+        self.now += 100
+        self.assertEqual(4, self.consume(10))
+
+    def test_rates_below_one(self):
+        """Rates below one per second still allow a single token."""
+        self.bucket = TokenBucket(0.5)
+        self.assertEqual(1, self.consume(10))
+        self.now += 1
+        self.assertEqual(0, self.consume(10))
+        self.now += 1
+        self.assertEqual(1, self.consume(10))
+
+    def test_capacity(self):
+        """An explicit capacity allows larger bursts."""
+        self.bucket = TokenBucket(1, capacity=5)
+        self.assertEqual(5, self.consume(10))
+
+
+class TraceSamplerTest(unittest.TestCase):
+    """Tests of the decisions of TraceSampler."""
+
+    def test_rates(self):
+        """Requests are sampled with the probability of their rate."""
+        self.assertTrue(all(TraceSampler(1).sample('items')
+                            for _ in range(100)))
+        self.assertFalse(any(TraceSampler(0).sample('items')
+                             for _ in range(100)))
+        sampler = TraceSampler(0.5)
+        with mock.patch('random.random', return_value=0.49):
+            self.assertTrue(sampler.sample('items'))
+        with mock.patch('random.random', return_value=0.5):
+            self.assertFalse(sampler.sample('items'))
+
+    def test_route_rates(self):
+        """Rates of routes override the rate of the others."""
+        sampler = TraceSampler(0, route_rates={'items': 1, 'fail': 0.25})
+        self.assertTrue(sampler.sample('items'))
+        self.assertFalse(sampler.sample('status'))
+        with mock.patch('random.random', return_value=0.2):
+            self.assertTrue(sampler.sample('fail'))
+            self.assertFalse(TraceSampler(1, route_rates={
+                'items': 0.1}).sample('items'))
+
+    def test_max_spans_per_second(self):
+        """Sampled requests are capped by the token bucket."""
+        with mock.patch('time.monotonic', return_value=1000.0):
+            sampler = TraceSampler(1, max_spans_per_second=2)
+            self.assertEqual([True, True, False, False],
+                             [sampler.sample('items') for _ in range(4)])
+        with mock.patch('time.monotonic', return_value=1001.0):
+            self.assertTrue(sampler.sample('items'))
+
+    def test_sampled_out_requests_take_no_tokens(self):
+        """Requests sampled out by their rate leave the tokens alone."""
+        with mock.patch('time.monotonic', return_value=1000.0):
+            sampler = TraceSampler(1, route_rates={'fail': 0},
+                                   max_spans_per_second=1)
+            self.assertFalse(sampler.sample('fail'))
+            self.assertTrue(sampler.sample('items'))
+
+    def test_keep_errors(self):
+        """Sampled out 4xx and 5xx responses are kept unless disabled."""
+        sampler = TraceSampler(0)
+        for status, kept in ((200, False), (302, False), (404, True),
+                             (500, True), (503, True)):
+            self.assertEqual(kept, sampler.keep(
+                types.SimpleNamespace(status_code=status), 0.001))
+        self.assertFalse(TraceSampler(0, keep_errors=False).keep(
+            types.SimpleNamespace(status_code=500), 0.001))
+
+    def test_slow_threshold(self):
+        """Sampled out requests are kept once as slow as the threshold."""
+        sampler = TraceSampler(0, keep_errors=False, slow_threshold=1)
+        response = types.SimpleNamespace(status_code=200)
+        self.assertFalse(sampler.keep(response, 0.5))
+        self.assertTrue(sampler.keep(response, 1))
+        self.assertTrue(sampler.keep(response, 2))
+        self.assertFalse(sampler.keep(response, None))
+        self.assertFalse(TraceSampler(0).keep(response, 100))
+
+    def test_get_trace_sampler(self):
+        """No sampler is used unless a rate or cap is configured."""
+        config = types.SimpleNamespace(
+            trace_sample_rate=None, trace_route_sample_rates={},
+            trace_max_spans_per_second=None, trace_keep_errors=True,
+            trace_slow_threshold=None)
+        self.assertIsNone(get_trace_sampler(config))
+        config.trace_route_sample_rates = {'items': 0}
+        sampler = get_trace_sampler(config)
+        self.assertEqual(1.0, sampler.rate)
+        self.assertEqual({'items': 0.0}, sampler.route_rates)
+
+
+@override_settings(WF_TRACE_SAMPLE_RATE=0)
+class MiddlewareSamplingTest(SimpleTestCase):
+    """Tests of the spans of sampled requests."""
+
+    def setUp(self):
+        """Forget the spans of earlier tests."""
+        self.tracer = settings.OPENTRACING_TRACING.tracer
+        self.tracer.reset()
+
+    def get_spans(self, *paths):
+        """Request paths, and get the names of the finished spans."""
+        client = Client()
+        for path in paths:
+            client.get(path)
+        return [span.operation_name
+                for span in self.tracer.finished_spans()]
+
+    def test_sampled_out(self):
+        """Successful requests sampled out get no span, failed ones do."""
+        self.assertEqual(['status', 'fail'], self.get_spans(
+            '/items/', '/status/201/', '/status/404/', '/fail/'))
+        span, _ = self.tracer.finished_spans()
+        self.assertEqual('404', span.tags['http.status_code'])
+
+    @override_settings(WF_TRACE_KEEP_ERRORS=False)
+    def test_errors_not_kept(self):
+        """Failed requests are dropped too when errors are not kept."""
+        self.assertEqual([], self.get_spans('/status/404/', '/fail/'))
+
+    @override_settings(WF_TRACE_ROUTE_SAMPLE_RATES={'items': 1})
+    def test_route_rates(self):
+        """Routes with a rate of their own are sampled by it."""
+        self.assertEqual(['items'], self.get_spans(
+            '/items/', '/status/201/'))
+
+    @override_settings(WF_TRACE_SAMPLE_RATE=1,
+                       WF_TRACE_MAX_SPANS_PER_SECOND=1)
+    def test_max_spans_per_second(self):
+        """Sampled requests over the cap get no span."""
+        with mock.patch('time.monotonic', return_value=1000.0):
+            self.assertEqual(['items'], self.get_spans(
+                '/items/', '/items/', '/items/'))
+
+    @override_settings(WF_TRACE_KEEP_ERRORS=False, WF_TRACE_SLOW_THRESHOLD=1)
+    def test_slow_threshold(self):
+        """Sampled out requests slower than the threshold are kept."""
+        self.assertEqual([], self.get_spans('/items/'))
+        with override_settings(WF_WALL_CLOCK=slow_clock()):
+            self.assertEqual(['items'], self.get_spans('/items/'))
+
+    @override_settings(WF_WALL_CLOCK=slow_clock())
+    def test_late_span_start_time(self):
+        """Spans of requests kept once they failed start with the request."""
+        start = time.time()
+        self.get_spans('/fail/')
+        span, = self.tracer.finished_spans()
+        self.assertLess(span.start_time, start - 1)
+        self.assertGreaterEqual(span.finish_time - span.start_time, 2)
+        self.assertEqual('500', span.tags['http.status_code'])
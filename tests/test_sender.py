@@ -0,0 +1,189 @@
+"""Tests of the queued sender with a fake wrapped sender."""
+import threading
+import time
+import unittest
+
+from wavefront_django_sdk.sender import DISTRIBUTIONS, METRICS, \
+    QueuedSender, SPANS
+
+
+class FakeSender:
+    """Wavefront client recording what it is sent."""
+
+    def __init__(self, failures=0, delay=0):
+        """Construct Fake Sender.
+
+        :param failures: Number of sends failing before sends succeed.
+        :param delay: Seconds every send takes.
+        """
+        self.failures = failures
+        self.delay = delay
+        self.attempts = []
+        self.sent = []
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def _send(self, *args):
+        """Record a send, failing or sleeping as configured."""
+        with self.lock:
+            self.attempts.append(time.monotonic())
+            if self.failures:
+                self.failures -= 1
+                raise IOError('proxy unreachable')
+        if self.delay:
+            time.sleep(self.delay)
+        self.sent.append(args)
+
+    def send_metric(self, name, value, timestamp, source, tags):
+        """Record a metric."""
+        self._send('metric', name, value, timestamp, source, tags)
+
+    def send_delta_counter(self, name, value, source, tags, timestamp=None):
+        """Record a delta counter."""
+        self._send('delta', name, value, timestamp, source, tags)
+
+    # pylint: disable=too-many-arguments
+    def send_span(self, name, start_millis, duration_millis, source,
+                  trace_id, span_id, parents, follows_from, tags,
+                  span_logs):
+        """Record a span."""
+        self._send('span', name)
+
+    # pylint: disable=too-many-arguments
+    def send_distribution(self, name, centroids, histogram_granularities,
+                          timestamp, source, tags):
+        """Record a distribution."""
+        self._send('distribution', name)
+
+    def close(self):
+        """Mark the sender closed."""
+        self.closed = True
+
+
+def send_span(sender, name):
+    """Send a span with dummy ids."""
+    sender.send_span(name, 0, 1, 'test', 'trace', 'span', None, None, [],
+                     None)
+
+
+def wait_until(condition, timeout=5.0):
+    """Wait for a condition to hold, or fail after a timeout."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out waiting')
+        time.sleep(0.01)
+
+
+class QueuedSenderTest(unittest.TestCase):
+    """Tests of queueing, dropping, retrying and closing."""
+
+    def create(self, fake, **kwargs):
+        """Create a queued sender closed at the end of the test."""
+        kwargs.setdefault('flush_interval', 60)
+        sender = QueuedSender(fake, **kwargs)
+        self.addCleanup(sender.close, 0.1)
+        return sender
+
+    def test_metrics_are_coalesced(self):
+        """Deltas of a series add up, other points keep the latest value."""
+        fake = FakeSender()
+        sender = self.create(fake)
+        tags = {'route': 'items'}
+        for value in (1, 2, 3):
+            sender.send_delta_counter('requests', value, 'test', tags)
+            sender.send_metric('inflight', value, 100 + value, 'test', tags)
+        sender.send_delta_counter('requests', 5, 'test', {'route': 'other'})
+        self.assertEqual(3, sender.get_queue_size())
+        sender.flush_now()
+        wait_until(lambda: len(fake.sent) == 3)
+        self.assertEqual(0, sender.get_queue_size())
+        self.assertEqual([
+            ('delta', 'requests', 6, None, 'test', tags),
+            ('metric', 'inflight', 3, 103, 'test', tags),
+            ('delta', 'requests', 5, None, 'test', {'route': 'other'}),
+        ], fake.sent)
+
+    def test_full_queue_drops_and_counts(self):
+        """Entries not fitting in the queue are dropped per kind."""
+        fake = FakeSender()
+        sender = self.create(fake, max_queue_size=3)
+        for index in range(4):
+            sender.send_metric('m{}'.format(index), 1, 1, 'test', None)
+        sender.send_metric('m0', 2, 2, 'test', None)
+        send_span(sender, 'span')
+        sender.send_distribution('latency', [], [], 1, 'test', None)
+        self.assertEqual(3, sender.get_queue_size())
+        self.assertEqual(1, sender.get_dropped_count(METRICS))
+        self.assertEqual(1, sender.get_dropped_count(SPANS))
+        self.assertEqual(1, sender.get_dropped_count(DISTRIBUTIONS))
+        sender.flush_now()
+        wait_until(lambda: len(fake.sent) == 3)
+        self.assertEqual([('metric', 'm0', 2, 2, 'test', None),
+                          ('metric', 'm1', 1, 1, 'test', None),
+                          ('metric', 'm2', 1, 1, 'test', None)], fake.sent)
+
+    def test_failures_back_off_and_retry(self):
+        """Failed sends are retried with growing backoff, then delivered."""
+        fake = FakeSender(failures=4)
+        sender = self.create(fake, flush_interval=0.01,
+                             initial_backoff=0.05, max_backoff=0.1)
+        with self.assertLogs('wavefront_django_sdk.sender') as logs:
+            sender.send_delta_counter('requests', 1, 'test', None)
+            send_span(sender, 'span')
+            wait_until(lambda: len(fake.sent) == 2)
+        self.assertEqual(1, len(logs.output))
+        self.assertEqual(0, sender.backoff)
+        self.assertEqual(4, sender.get_failure_count())
+        self.assertEqual(6, len(fake.attempts))
+        gaps = [later - earlier for earlier, later in
+                zip(fake.attempts, fake.attempts[1:5])]
+        self.assertGreaterEqual(gaps[0], 0.05)
+        for gap in gaps[1:]:
+            self.assertGreaterEqual(gap, 0.1)
+        self.assertEqual({'delta', 'span'}, {sent[0] for sent in fake.sent})
+
+    def test_requeued_deltas_add_to_newer_ones(self):
+        """A delta failing to send is added to one queued meanwhile."""
+        fake = FakeSender(failures=1)
+        sender = self.create(fake)
+        sender.send_delta_counter('requests', 2, 'test', None)
+        with self.assertLogs('wavefront_django_sdk.sender'):
+            sender.flush_now()
+            wait_until(lambda: sender.errors == 1 and
+                       sender.get_queue_size() == 1)
+        sender.send_delta_counter('requests', 3, 'test', None)
+        sender.flush_now()
+        wait_until(lambda: fake.sent)
+        self.assertEqual([('delta', 'requests', 5, None, 'test', None)],
+                         fake.sent)
+
+    def test_flush_now_does_not_wait(self):
+        """Flushing only wakes the sender thread, which sends meanwhile."""
+        fake = FakeSender(delay=0.1)
+        sender = self.create(fake)
+        for index in range(3):
+            send_span(sender, 'span{}'.format(index))
+        start = time.monotonic()
+        sender.flush_now()
+        self.assertLess(time.monotonic() - start, 0.05)
+        self.assertLess(len(fake.sent), 3)
+        wait_until(lambda: len(fake.sent) == 3)
+        self.assertEqual(0, sender.get_queue_size())
+
+    def test_close_stops_at_deadline(self):
+        """Closing sends until the deadline and drops the rest."""
+        fake = FakeSender(delay=0.02)
+        sender = QueuedSender(fake, flush_interval=60)
+        for index in range(100):
+            send_span(sender, 'span{}'.format(index))
+        start = time.monotonic()
+        sender.close(timeout_secs=0.2)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertTrue(fake.closed)
+        self.assertLess(len(fake.sent), 100)
+        self.assertEqual(100, len(fake.sent) +
+                         sender.get_dropped_count(SPANS))
+        self.assertEqual(0, sender.get_queue_size())
+        send_span(sender, 'late')
+        self.assertEqual(('span', 'late'), fake.sent[-1])
@@ -0,0 +1,112 @@
+"""Tests of the live latency sketches and their windows."""
+import random
+import unittest
+from unittest import mock
+
+from wavefront_django_sdk.slo import LatencySketch, LatencyTracker
+
+
+class LatencySketchTest(unittest.TestCase):
+    """Tests of the accuracy of the latency sketch."""
+
+    def setUp(self):
+        """Sort a log-normal sample of latencies in nanoseconds."""
+        rand = random.Random(42)
+        self.values = sorted(rand.lognormvariate(15, 1)
+                             for _ in range(50000))
+
+    def get_exact(self, quantile):
+        """Get the exact value at a quantile of the sample."""
+        return self.values[int(quantile * (len(self.values) - 1))]
+
+    def test_quantiles_within_relative_accuracy(self):
+        """Every quantile is within the relative accuracy of the sample."""
+        sketch = LatencySketch(relative_accuracy=0.01)
+        for value in self.values:
+            sketch.add(value)
+        self.assertEqual(len(self.values), sketch.count)
+        for quantile in (0, 0.01, 0.25, 0.5, 0.9, 0.99, 0.999, 1):
+            exact = self.get_exact(quantile)
+            self.assertLessEqual(
+                abs(sketch.get_quantile(quantile) - exact) / exact, 0.01,
+                quantile)
+
+    def test_collapse_keeps_high_quantiles(self):
+        """Merging the lowest buckets bounds memory, not high quantiles."""
+        sketch = LatencySketch(relative_accuracy=0.01, max_buckets=200)
+        for value in self.values:
+            sketch.add(value)
+        self.assertLessEqual(len(sketch.buckets), 200)
+        for quantile in (0.5, 0.9, 0.99):
+            exact = self.get_exact(quantile)
+            self.assertLessEqual(
+                abs(sketch.get_quantile(quantile) - exact) / exact, 0.01,
+                quantile)
+
+    def test_merge_and_zeros(self):
+        """Merged sketches count zeros and values of both."""
+        sketch = LatencySketch()
+        self.assertIsNone(sketch.get_quantile(0.5))
+        other = LatencySketch()
+        for _ in range(3):
+            sketch.add(0)
+            other.add(1000)
+        sketch.merge(other)
+        self.assertEqual(6, sketch.count)
+        self.assertEqual(0, sketch.get_quantile(0.4))
+        self.assertAlmostEqual(1000, sketch.get_quantile(0.6), delta=10)
+
+
+class WindowRotationTest(unittest.TestCase):
+    """Tests of queries covering the current and the previous window."""
+
+    def setUp(self):
+        """Replace the clock of the tracker with a manual one."""
+        self.now = 1000.0
+        patcher = mock.patch('wavefront_django_sdk.slo.time')
+        clock = patcher.start()
+        self.addCleanup(patcher.stop)
+        clock.monotonic.side_effect = lambda: self.now
+        clock.time.side_effect = lambda: self.now
+        self.tracker = LatencyTracker(slo=0.5, window=60)
+        self.route = self.tracker.get_route('items', 'GET')
+
+    def get_count(self):
+        """Get the count of requests the route queries cover."""
+        return self.route.get_sketch().count
+
+    def test_previous_window_is_kept_for_one_window(self):
+        """Requests drop out of queries after two windows."""
+        for _ in range(5):
+            self.route.record(1000000)
+        self.now += 30
+        self.route.record(2000000)
+        self.assertEqual(6, self.get_count())
+        self.now += 40
+        self.route.record(3000000)
+        self.assertEqual(7, self.get_count())
+        self.now += 60
+        self.assertEqual(1, self.get_count())
+        self.assertAlmostEqual(
+            0.003, self.tracker.get_percentile('items', 'GET', 50),
+            delta=0.0001)
+
+    def test_idle_windows_are_skipped(self):
+        """After more than two idle windows nothing recent is left."""
+        self.route.record(1000000)
+        self.now += 150
+        self.assertEqual(0, self.get_count())
+        self.assertIsNone(self.tracker.get_percentile('items', 'GET', 99))
+        self.route.record(1000000)
+        self.now += 50
+        self.assertEqual(1, self.get_count())
+
+    def test_over_slo_and_exemplars(self):
+        """Requests over the SLO are counted and kept as exemplars."""
+        self.assertFalse(self.route.record(100000000, '/items/'))
+        self.assertTrue(self.route.record(600000000, '/items/', 'trace'))
+        self.now += 200
+        self.assertEqual(1, self.route.over_slo)
+        exemplar, = self.tracker.get_exemplars()
+        self.assertEqual(('items', 'GET', '/items/', 0.6, 'trace'),
+                         exemplar[1:])
@@ -0,0 +1,133 @@
+"""Tests of the Celery task and management command instrumentation."""
+import io
+import types
+import unittest
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from wavefront_django_sdk import tasks
+
+from .utils import get_metrics
+
+try:
+    import celery
+except ImportError:
+    celery = None
+
+
+def get_count(name):
+    """Get the count of a counter summed over its tags, 0 if missing."""
+    return sum(counter.get_count()
+               for counter in get_metrics('counters', name))
+
+
+class CommandTest(unittest.TestCase):
+    """Tests of management commands run with call_command."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Instrument the commands of the test process."""
+        super().setUpClass()
+        tasks.instrument_commands()
+
+    def setUp(self):
+        """Forget the spans of earlier tests."""
+        self.tracer = settings.OPENTRACING_TRACING.tracer
+        self.tracer.reset()
+
+    def test_success(self):
+        """A command run is counted, timed and traced."""
+        before = get_count('command.check.success.cumulative')
+        call_command('check', stdout=io.StringIO())
+        self.assertEqual(before + 1,
+                         get_count('command.check.success.cumulative'))
+        self.assertEqual(1, len(get_metrics(
+            'histograms', 'command.check.success.latency')))
+        span, = self.tracer.finished_spans()
+        self.assertEqual('check', span.operation_name)
+        self.assertEqual('django.core.management.commands.check',
+                         span.tags['django.resource.module'])
+        self.assertNotIn('error', span.tags)
+
+    def test_failure(self):
+        """A failing command is counted as error and its span marked."""
+        before = get_count('command.check.errors')
+        with self.assertRaises(CommandError):
+            call_command('check', tags=['no-such-tag'],
+                         stdout=io.StringIO())
+        self.assertEqual(before + 1, get_count('command.check.errors'))
+        span, = self.tracer.finished_spans()
+        self.assertEqual('true', span.tags['error'])
+        self.assertEqual('failure', span.tags['task.outcome'])
+
+
+class CelerySignalsTest(unittest.TestCase):
+    """Tests of runs whose postrun never comes."""
+
+    def test_revoked_run_is_recorded(self):
+        """A revoked run is recorded as such and forgotten."""
+        task = types.SimpleNamespace(name='tests.revoked')
+        tasks._task_prerun(task_id='revoked-id', task=task)
+        tasks._task_revoked(request=types.SimpleNamespace(id='revoked-id'))
+        self.assertNotIn('revoked-id', tasks._celery_runs)
+        self.assertEqual(1, get_count('task.tests.revoked.revoked.cumulative'))
+        tasks._task_revoked(request=types.SimpleNamespace(id='revoked-id'))
+        self.assertEqual(1, get_count('task.tests.revoked.revoked.cumulative'))
+
+    def test_pool_process_forgets_runs_of_parent(self):
+        """A new pool process starts without the runs of its parent."""
+        task = types.SimpleNamespace(name='tests.inherited')
+        tasks._task_prerun(task_id='inherited-id', task=task)
+        tasks._worker_process_init()
+        self.assertEqual({}, tasks._celery_runs)
+
+
+@unittest.skipUnless(celery, 'Celery is not installed')
+class CeleryEagerTest(unittest.TestCase):
+    """Tests of Celery tasks run eagerly."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Create an eager Celery app with two tasks."""
+        super().setUpClass()
+        tasks.instrument_celery()
+        app = celery.Celery('tests', set_as_current=False)
+        app.conf.task_always_eager = True
+
+        @app.task(name='tests.add')
+        def add(x, y):
+            return x + y
+
+        @app.task(name='tests.fail')
+        def fail():
+            raise ValueError('failed')
+
+        cls.add = add
+        cls.fail = fail
+
+    def setUp(self):
+        """Forget the spans of earlier tests."""
+        self.tracer = settings.OPENTRACING_TRACING.tracer
+        self.tracer.reset()
+
+    def test_success(self):
+        """A task run is counted and traced."""
+        before = get_count('task.tests.add.success.cumulative')
+        self.assertEqual(3, self.add.delay(1, 2).get())
+        self.assertEqual(before + 1,
+                         get_count('task.tests.add.success.cumulative'))
+        span, = self.tracer.finished_spans()
+        self.assertEqual('tests.add', span.operation_name)
+        self.assertEqual('consumer', span.tags['span.kind'])
+        self.assertEqual({}, tasks._celery_runs)
+
+    def test_failure(self):
+        """A failing task is counted as error and its span marked."""
+        before = get_count('task.tests.fail.errors')
+        self.assertTrue(self.fail.delay().failed())
+        self.assertEqual(before + 1, get_count('task.tests.fail.errors'))
+        span, = self.tracer.finished_spans()
+        self.assertEqual('true', span.tags['error'])
+        self.assertEqual('ValueError', span.logs[0].key_values['error.kind'])
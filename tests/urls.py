@@ -0,0 +1,58 @@
+"""URLs of the views the tests request."""
+import time
+
+from django.db import connection
+from django.http import HttpResponse
+from django.urls import include, path
+
+
+# pylint: disable=unused-argument
+def items(request):
+    """Respond after a short wait, so requests overlap."""
+    time.sleep(0.001)
+    return HttpResponse('items')
+
+
+# pylint: disable=unused-argument
+async def async_items(request):
+    """Respond from the event loop."""
+    return HttpResponse('items')
+
+
+# pylint: disable=unused-argument
+def fail(request):
+    """Respond with a server error."""
+    return HttpResponse('fail', status=500)
+
+
+# pylint: disable=unused-argument
+def status(request, code):
+    """Respond with a status code of the path."""
+    return HttpResponse('status', status=code)
+
+
+# pylint: disable=unused-argument
+def queries(request):
+    """Run an N+1 pattern of queries, and one query slower than 50ms."""
+    connection.ensure_connection()
+    connection.connection.create_function('wf_sleep', 1, time.sleep)
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE TABLE IF NOT EXISTS item (id int, name text)")
+        for item_id in range(5):
+            cursor.execute("SELECT * FROM item WHERE id = %s", [item_id])
+        cursor.execute("SELECT wf_sleep(0.06)")
+    return HttpResponse('queries')
+
+
+api_patterns = [
+    path('items/', items, name='items'),
+]
+
+urlpatterns = [
+    path('items/', items, name='items'),
+    path('async/items/', async_items, name='async_items'),
+    path('fail/', fail, name='fail'),
+    path('status/<int:code>/', status, name='status'),
+    path('queries/', queries, name='queries'),
+    path('api/', include((api_patterns, 'api'))),
+]
@@ -0,0 +1,21 @@
+"""Helpers reading the metrics the tests record."""
+from wavefront_django_sdk.registry import run_pre_report_hooks
+from wavefront_django_sdk.runtime import get_runtime
+
+
+def get_registry():
+    """Get the registry shared by the middleware and the tasks."""
+    return get_runtime().get_registry()
+
+
+def get_metrics(kind, name):
+    """Get the metrics of a registry with a name, rolled up as reported.
+
+    :param kind: 'counters', 'gauges', 'histograms' or 'meters'.
+    :param name: Name of the metrics, without prefix and tags.
+    :return: List of the metrics of that name, one per set of tags.
+    """
+    registry = get_registry()
+    run_pre_report_hooks(registry)
+    return [metric for key, metric in getattr(registry, '_' + kind).items()
+            if key.split('-tags=')[0] == name]
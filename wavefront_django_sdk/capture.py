@@ -0,0 +1,312 @@
+"""
+Capture and Replay of Reported Data.
+
+A CaptureClient stands in for the Wavefront client of the reporters and
+appends every metric, distribution, span and event they send to a file,
+one compact JSON array per line: the capture time in seconds, the client
+method and its arguments. A captured file can be replayed into any other
+client, e.g. a QueuedSender or a WavefrontProxyClient, as fast as possible
+or at a set pace, to load test the reporting pipeline on one machine. With
+replay_through_reporter, captured metrics are registered into the registry
+of a WavefrontReporter again, which reads and reports them like the
+registry of the middleware.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+from wavefront_pyformance.delta import DeltaCounter, delta_counter
+from wavefront_pyformance.wavefront_histogram import wavefront_histogram
+
+from .constants import REPORTER_PREFIX
+
+SEND_METHODS = ('send_metric', 'send_delta_counter', 'send_distribution',
+                'send_span', 'send_event')
+
+
+class CaptureClient:
+    """Wavefront client appending everything sent to a capture file.
+
+    Thread safe, and buffered until flushed by the reporters. The path may
+    contain {pid}, so every worker of a pre-fork server writes its own file.
+    Entries sent once closed reopen the file, as other reporters sharing
+    the client may still flush while shutting down.
+    """
+
+    def __init__(self, path):
+        """Construct Capture Client.
+
+        :param path: Path of the capture file, appended to if it exists.
+        """
+        self.path = path.format(pid=os.getpid())
+        self.count = 0
+        self._file = self._open()
+        self._lock = threading.Lock()
+
+    def send_metric(self, name, value, timestamp, source, tags):
+        """Capture a metric point."""
+        self._write('send_metric', (name, value, timestamp, source, tags))
+
+    def send_delta_counter(self, name, value, source, tags, timestamp=None):
+        """Capture a delta counter."""
+        self._write('send_delta_counter',
+                    (name, value, source, tags, timestamp))
+
+    # pylint: disable=too-many-arguments
+    def send_distribution(self, name, centroids, histogram_granularities,
+                          timestamp, source, tags):
+        """Capture a distribution."""
+        self._write('send_distribution',
+                    (name, centroids, sorted(histogram_granularities),
+                     timestamp, source, tags))
+
+    # pylint: disable=too-many-arguments
+    def send_span(self, name, start_millis, duration_millis, source, trace_id,
+                  span_id, parents, follows_from, tags, span_logs):
+        """Capture a span."""
+        self._write('send_span',
+                    (name, start_millis, duration_millis, source,
+                     str(trace_id), str(span_id),
+                     [str(parent) for parent in parents or ()],
+                     [str(follows) for follows in follows_from or ()],
+                     tags, [(log.timestamp, log.fields)
+                            for log in span_logs or ()]))
+
+    # pylint: disable=too-many-arguments
+    def send_event(self, name, start_time, end_time, source, tags,
+                   annotations):
+        """Capture an event."""
+        self._write('send_event',
+                    (name, start_time, end_time, source, tags, annotations))
+
+    @staticmethod
+    def get_failure_count():
+        """Get number of failed sends, always 0."""
+        return 0
+
+    def flush_now(self):
+        """Write what is buffered to the capture file."""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        """Flush and close the capture file."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _open(self):
+        """Open the capture file for appending."""
+        # pylint: disable=consider-using-with
+        return open(self.path, 'a', encoding='utf-8')
+
+    def _write(self, method, args):
+        """Append an entry to the capture file."""
+        line = json.dumps((round(time.time(), 3), method) + args,
+                          separators=(',', ':'), default=str)
+        with self._lock:
+            if self._file is None:
+                self._file = self._open()
+            self._file.write(line + '\n')
+            self.count += 1
+
+
+def read_capture(path):
+    """Read the entries of a capture file.
+
+    :param path: Path of the capture file.
+    :return: Generator of (capture time, client method, arguments).
+    """
+    # pylint: disable=import-outside-toplevel
+    from wavefront_sdk.entities.tracing.span_log import SpanLog
+
+    with open(path, encoding='utf-8') as capture:
+        for line in capture:
+            if not line.strip():
+                continue
+            timestamp, method, *args = json.loads(line)
+            if method not in SEND_METHODS:
+                raise ValueError("Unknown capture entry: {}".format(method))
+            if method == 'send_distribution':
+                args[1] = [tuple(centroid) for centroid in args[1]]
+                args[2] = set(args[2])
+            elif method == 'send_span':
+                args[4] = uuid.UUID(args[4])
+                args[5] = uuid.UUID(args[5])
+                args[6] = [uuid.UUID(parent) for parent in args[6]]
+                args[7] = [uuid.UUID(follows) for follows in args[7]]
+                args[8] = [tuple(tag) for tag in args[8]]
+                args[9] = [SpanLog(log_time, fields)
+                           for log_time, fields in args[9]]
+            yield timestamp, method, args
+
+
+class RegistryClient:
+    """Wavefront client registering captured metrics into a registry.
+
+    Reverses what a WavefrontReporter sends: counters ending in .count are
+    set to their captured value, delta counters are added to, gauges
+    ending in .value are set and the centroids of distributions are added
+    to a WavefrontHistogram. Other metrics become gauges of their full
+    name. Spans and events have no metrics, they are sent to the wrapped
+    client as is.
+    """
+
+    def __init__(self, registry, client=None, prefix=REPORTER_PREFIX):
+        """Construct Registry Client.
+
+        :param registry: TaggedRegistry to register the metrics into.
+        :param client: Wavefront client to send spans and events to, or
+            None to drop them.
+        :param prefix: Prefix of the captured metric names, stripped as
+            the reporter adds its own.
+        """
+        self.registry = registry
+        self.client = client
+        self.prefix = prefix
+
+    # pylint: disable=unused-argument
+    def send_metric(self, name, value, timestamp, source, tags):
+        """Set the counter or gauge of a captured metric point."""
+        name, _, value_key = self._strip(name).rpartition('.')
+        if value_key == 'count':
+            counter = self.registry.counter(name, tags=tags)
+            counter.inc(value - counter.get_count())
+        elif value_key == 'value':
+            self.registry.gauge(name, tags=tags).set_value(value)
+        else:
+            self.registry.gauge(name + '.' + value_key,
+                                tags=tags).set_value(value)
+
+    # pylint: disable=unused-argument
+    def send_delta_counter(self, name, value, source, tags, timestamp=None):
+        """Add a captured delta to its delta counter."""
+        name = name.lstrip(DeltaCounter.DELTA_PREFIX +
+                           DeltaCounter.ALT_DELTA_PREFIX)
+        name = self._strip(name).rpartition('.')[0]
+        delta_counter(self.registry, name, tags=tags).inc(value)
+
+    # pylint: disable=too-many-arguments, unused-argument
+    def send_distribution(self, name, centroids, histogram_granularities,
+                          timestamp, source, tags):
+        """Add the centroids of a captured distribution to its histogram."""
+        histogram = wavefront_histogram(self.registry, self._strip(name),
+                                        tags=tags)
+        for mean, count in centroids:
+            for _ in range(int(count)):
+                histogram.add(mean)
+
+    def send_span(self, *args):
+        """Send a captured span to the wrapped client."""
+        if self.client is not None:
+            self.client.send_span(*args)
+
+    def send_event(self, *args):
+        """Send a captured event to the wrapped client."""
+        if self.client is not None:
+            self.client.send_event(*args)
+
+    def _strip(self, name):
+        """Remove the captured prefix from a metric name."""
+        return name[len(self.prefix):] if name.startswith(self.prefix) \
+            else name
+
+
+def _paced(entries, rate=None, speed=None, clock=time.monotonic,
+           sleep=time.sleep):
+    """Yield entries of a capture once they are due.
+
+    :param entries: Iterable of (capture time, method, arguments).
+    :param rate: Entries per second, None for as fast as possible.
+    :param speed: Multiple of the pace the entries were captured at.
+    :param clock: Monotonic clock in seconds.
+    :param sleep: Function sleeping for seconds.
+    """
+    if rate is not None and rate <= 0 or speed is not None and speed <= 0:
+        raise ValueError("rate and speed must be positive")
+    start = clock()
+    first = None
+    for count, entry in enumerate(entries):
+        if rate is not None:
+            due = count / rate
+        elif speed is not None:
+            if first is None:
+                first = entry[0]
+            due = (entry[0] - first) / speed
+        else:
+            due = None
+        if due is not None:
+            delay = start + due - clock()
+            if delay > 0:
+                sleep(delay)
+        yield entry
+
+
+# pylint: disable=too-many-arguments
+def replay(path, client, rate=None, speed=None, clock=time.monotonic,
+           sleep=time.sleep):
+    """Send the entries of a capture file to a client.
+
+    :param path: Path of the capture file.
+    :param client: Wavefront client to send to.
+    :param rate: Entries per second, None for as fast as possible.
+    :param speed: Multiple of the pace the entries were captured at, e.g.
+        2 to replay twice as fast, ignored if rate is set.
+    :param clock: Monotonic clock in seconds pacing the replay.
+    :param sleep: Function sleeping for seconds.
+    :return: Number of entries sent.
+    """
+    count = 0
+    for _, method, args in _paced(read_capture(path), rate, speed, clock,
+                                  sleep):
+        getattr(client, method)(*args)
+        count += 1
+    return count
+
+
+# pylint: disable=too-many-arguments
+def replay_through_reporter(path, reporter, rate=None, speed=None,
+                            report_interval=None, clock=time.monotonic,
+                            sleep=time.sleep):
+    """Register the entries of a capture file and report them.
+
+    Metrics go into the registry of the reporter, which reports them to
+    its client every report_interval seconds of capture time and once at
+    the end, with the current minute of the histograms. So the registry,
+    delta counters, histograms and the reporter handle the captured
+    volume.
+
+    :param path: Path of the capture file.
+    :param reporter: WavefrontReporter with a registry and a client.
+    :param rate: Entries per second, None for as fast as possible.
+    :param speed: Multiple of the pace the entries were captured at.
+    :param report_interval: Seconds of capture time between reports,
+        defaults to the reporting interval of the reporter.
+    :param clock: Monotonic clock in seconds pacing the replay.
+    :param sleep: Function sleeping for seconds.
+    :return: Tuple of number of entries replayed and reports made.
+    """
+    if report_interval is None:
+        report_interval = reporter.reporting_interval
+    client = RegistryClient(reporter.registry, reporter.wavefront_client)
+    count = reports = 0
+    next_report = None
+    for timestamp, method, args in _paced(read_capture(path), rate, speed,
+                                          clock, sleep):
+        if next_report is None:
+            next_report = timestamp + report_interval
+        elif timestamp >= next_report:
+            reporter.report_now()
+            reports += 1
+            next_report = timestamp + report_interval
+        getattr(client, method)(*args)
+        count += 1
+    # Like WavefrontReporter.stop(), including the current minute of the
+    # histograms, without closing the client.
+    # pylint: disable=protected-access
+    reporter._report(flush_current_hist=True)
+    return count, reports + 1
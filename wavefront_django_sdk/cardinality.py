@@ -0,0 +1,226 @@
+"""
+Metric Cardinality Guard.
+
+Every distinct route, HTTP method and status code combination creates new
+counters and histograms in the TaggedRegistry. The limiter caps the number
+of distinct values of each dimension, folds overflowing values into
+catch-all buckets and optionally expires series which have been idle for
+too long, so the registry can't grow without bound.
+"""
+import threading
+import time
+
+from wavefront_pyformance.delta import DeltaCounter
+
+from .constants import OTHER_BUCKET, UNKNOWN_ENTITY_NAME
+from .resolver import ViewNames
+
+OTHER_VIEW_NAMES = ViewNames(OTHER_BUCKET, None, None)
+
+HTTP_METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'CONNECT',
+                'OPTIONS', 'TRACE', 'PATCH')
+
+
+class _Dimension:
+    """Capped set of the distinct values of a metric dimension."""
+
+    def __init__(self, max_values, pinned=()):
+        self.max_values = max_values
+        self.pinned = frozenset(pinned)
+        self.values = set(self.pinned)
+        self.folded = 0
+        self._lock = threading.Lock()
+
+    def admit(self, value):
+        """Admit a value unless the dimension is full.
+
+        :return: True if the value may be used as is.
+        """
+        if value in self.values:
+            return True
+        with self._lock:
+            if value in self.values:
+                return True
+            if len(self.values) < self.max_values:
+                self.values.add(value)
+                return True
+            self.folded += 1
+            return False
+
+    def retain(self, live_values):
+        """Release the values no live series uses anymore."""
+        with self._lock:
+            self.values = set(self.pinned) | (self.values & live_values)
+
+
+def get_status_class(status_code):
+    """Get the class of a status code, e.g. 2xx.
+
+    :param status_code: HTTP status code.
+    :return: Status class, or UNKNOWN for invalid status codes.
+    """
+    if 100 <= status_code <= 599:
+        return '{}xx'.format(status_code // 100)
+    return UNKNOWN_ENTITY_NAME
+
+
+# pylint: disable=too-many-instance-attributes
+class CardinalityLimiter:
+    """Cap the distinct routes, methods and status codes of metrics.
+
+    Routes over the cap are reported as OTHER, methods over the cap or not
+    defined by HTTP as OTHER, and status codes over the cap as their class,
+    e.g. 5xx. Series are keyed by the folded route key, i.e.
+    (entity name, method, status, module name, func name).
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, max_routes=1000, max_methods=len(HTTP_METHODS),
+                 max_status_codes=30, series_ttl=None):
+        """Construct Cardinality Limiter.
+
+        :param max_routes: Max distinct routes.
+        :param max_methods: Max distinct methods, including standard ones.
+        :param max_status_codes: Max distinct status codes.
+        :param series_ttl: Seconds after which idle series are removed from
+            the registry, None to keep them forever.
+        """
+        if max_routes <= 0 or max_methods <= 0 or max_status_codes <= 0:
+            raise ValueError("cardinality caps must be positive")
+        self.routes = _Dimension(max_routes + 1,
+                                 pinned=(UNKNOWN_ENTITY_NAME,))
+        self.methods = _Dimension(max(max_methods, len(HTTP_METHODS)),
+                                  pinned=HTTP_METHODS)
+        self.status_codes = _Dimension(max_status_codes)
+        self.series_ttl = series_ttl
+        self.expired = 0
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def fold_route(self, view_names, method):
+        """Fold the route and method of a request over their caps.
+
+        :param view_names: ViewNames of the request.
+        :param method: HTTP method of the request.
+        :return: Tuple of folded ViewNames and method.
+        """
+        if not self.routes.admit(view_names.entity_name):
+            view_names = OTHER_VIEW_NAMES
+        if not self.methods.admit(method):
+            method = OTHER_BUCKET
+        return view_names, method
+
+    def fold_status(self, status_code):
+        """Fold a status code over its cap into its class.
+
+        :param status_code: HTTP status code of the response.
+        :return: Folded status as str.
+        """
+        if 100 <= status_code <= 599 and self.status_codes.admit(status_code):
+            return str(status_code)
+        return get_status_class(status_code)
+
+    def get_folded_count(self):
+        """Get number of requests which had a dimension folded."""
+        return (self.routes.folded + self.methods.folded +
+                self.status_codes.folded)
+
+    def get_series_count(self):
+        """Get number of tracked series."""
+        return len(self._series)
+
+    def track(self, key, route_metrics):
+        """Track a series, so it can be counted and expired once idle.
+
+        :param key: Folded route key.
+        :param route_metrics: RouteMetrics of the series.
+        """
+        with self._lock:
+            self._series[key] = route_metrics
+
+    def touch(self, route_metrics, now=None):
+        """Mark a series used, unless it was expired meanwhile.
+
+        Checked under the lock expire holds, so a series is never expired
+        between being touched and being recorded into.
+
+        :param route_metrics: RouteMetrics of the series.
+        :param now: time.monotonic() value, defaults to now.
+        :return: False if the series was expired and its handles must be
+            resolved again.
+        """
+        with self._lock:
+            if route_metrics.expired:
+                return False
+            route_metrics.last_used = now or time.monotonic()
+            return True
+
+    def expire(self, registry, on_expire=None, now=None):
+        """Remove series idle for longer than the TTL from the registry.
+
+        Metrics shared with live series, delta counters not reported yet
+        and inflight gauges of running requests are kept. Expired
+        RouteMetrics are marked as such, so handles looked up just before
+        are resolved again instead of recording into removed metrics.
+
+        :param registry: TaggedRegistry holding the metrics.
+        :param on_expire: Callable called with the key of every expired
+            series, e.g. to drop cached handles.
+        :param now: time.monotonic() value, defaults to now.
+        :return: Number of expired series.
+        """
+        if not self.series_ttl:
+            return 0
+        deadline = (now or time.monotonic()) - self.series_ttl
+        with self._lock:
+            idle = [key for key, route_metrics in self._series.items()
+                    if route_metrics.last_used < deadline and
+                    self._is_settled(route_metrics)]
+            if not idle:
+                return 0
+            dead = set()
+            for key in idle:
+                route_metrics = self._series.pop(key)
+                route_metrics.expired = True
+                dead.update(route_metrics.get_metrics())
+                if on_expire is not None:
+                    on_expire(key)
+            for route_metrics in self._series.values():
+                dead.difference_update(route_metrics.get_metrics())
+            self._remove_metrics(registry, dead)
+            self.expired += len(idle)
+            live_keys = list(self._series)
+        self.routes.retain({key[0] for key in live_keys})
+        self.methods.retain({key[1] for key in live_keys})
+        self.status_codes.retain({int(key[2]) for key in live_keys
+                                  if key[2] and key[2].isdigit()})
+        return len(idle)
+
+    @staticmethod
+    def _is_settled(route_metrics):
+        """Check no request is running and no delta is left to report."""
+        if route_metrics.inflight is not None and \
+                route_metrics.inflight.get_value():
+            return False
+        if route_metrics.responses is not None and \
+                route_metrics.responses.count:
+            return False
+        return not any(counter.get_count() for counter in
+                       route_metrics.get_counters()
+                       if isinstance(counter, DeltaCounter))
+
+    @staticmethod
+    def _remove_metrics(registry, dead):
+        """Remove metrics from the registry.
+
+        :param registry: TaggedRegistry holding the metrics.
+        :param dead: Set of metric objects to remove.
+        """
+        if not dead:
+            return
+        # pylint: disable=protected-access
+        for metrics in (registry._counters, registry._histograms,
+                        registry._gauges):
+            for name in [name for name, metric in metrics.items()
+                         if metric in dead]:
+                del metrics[name]
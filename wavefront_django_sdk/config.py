@@ -0,0 +1,260 @@
+"""
+Wavefront Django Configuration.
+
+All settings are read once into a WavefrontConfig snapshot when the
+middleware is constructed, so serving a request only reads plain
+attributes instead of going through the LazySettings proxy and os.environ.
+"""
+import json
+import os
+import re
+from collections import namedtuple
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from django_opentracing import DjangoTracing
+
+from wavefront_pyformance.wavefront_reporter import WavefrontReporter
+
+from wavefront_sdk.common import ApplicationTags
+
+from .timing import cpu_clock_ns, wall_clock_ns
+from .tracing import HTTP_URL_MODES
+
+
+class ConfigError(AttributeError):
+    """Settings not correctly configured, with every problem found."""
+
+    def __init__(self, errors):
+        """Construct Config Error.
+
+        :param errors: List of error messages.
+        """
+        super().__init__(' '.join(errors))
+        self.errors = errors
+
+
+def get_conf(key):
+    """Get configuration from settings or env.
+
+    :param key: Key of the configuration.
+    :return: Value of the configuration.
+    """
+    if hasattr(settings, key):
+        return getattr(settings, key)
+    if key in os.environ:
+        return os.environ[key]
+    return None
+
+
+def parse_bool(value):
+    """Parse a bool, accepting strings such as 'true' or '0' from env."""
+    if isinstance(value, str):
+        lowered = value.strip().lower()
+        if lowered in ('1', 'true', 'yes', 'on'):
+            return True
+        if lowered in ('', '0', 'false', 'no', 'off'):
+            return False
+        raise ValueError(value)
+    return bool(value)
+
+
+def parse_positive_int(value):
+    """Parse an int greater than 0."""
+    value = int(value)
+    if value <= 0:
+        raise ValueError(value)
+    return value
+
+
+def parse_positive_float(value):
+    """Parse a float greater than 0."""
+    value = float(value)
+    if value <= 0:
+        raise ValueError(value)
+    return value
+
+
+def parse_non_negative_float(value):
+    """Parse a float greater than or equal to 0."""
+    value = float(value)
+    if value < 0:
+        raise ValueError(value)
+    return value
+
+
+def parse_rate(value):
+    """Parse a float in [0, 1]."""
+    value = float(value)
+    if not 0 <= value <= 1:
+        raise ValueError(value)
+    return value
+
+
+def parse_rates(value):
+    """Parse a dict of name to rate, accepting JSON from env."""
+    if isinstance(value, str):
+        value = json.loads(value)
+    return {str(name): parse_rate(rate) for name, rate in value.items()}
+
+
+def parse_durations(value):
+    """Parse a dict of name to seconds, accepting JSON from env."""
+    if isinstance(value, str):
+        value = json.loads(value)
+    return {str(name): parse_positive_float(duration)
+            for name, duration in value.items()}
+
+
+def parse_list(value):
+    """Parse a tuple, accepting comma separated values from env."""
+    if isinstance(value, str):
+        value = [item.strip() for item in value.split(',') if item.strip()]
+    return tuple(value)
+
+
+def parse_path_rules(value):
+    """Parse path prefixes and ^regular expressions, checking the latter.
+
+    Accepts a JSON list, or comma separated values from env.
+    """
+    if isinstance(value, str) and value.lstrip().startswith('['):
+        value = json.loads(value)
+    rules = parse_list(value)
+    for rule in rules:
+        if rule.startswith('^'):
+            try:
+                re.compile(rule)
+            except re.error as e:
+                raise ValueError(rule) from e
+    return rules
+
+
+def parse_http_url(value):
+    """Parse the mode of the http.url span tag."""
+    if value not in HTTP_URL_MODES:
+        raise ValueError(value)
+    return value
+
+
+def parse_clock(value):
+    """Parse a clock returning integer nanoseconds, or its dotted path."""
+    if isinstance(value, str):
+        try:
+            value = import_string(value)
+        except ImportError as e:
+            raise ValueError(value) from e
+    if not isinstance(value(), int):
+        raise TypeError(value)
+    return value
+
+
+def _instance_of(cls):
+    def parse(value):
+        if not isinstance(value, cls):
+            raise TypeError(value)
+        return value
+    return parse
+
+
+# (field, setting, parser, default), a parser of None keeps the value as is.
+SETTINGS = (
+    ('reporter', 'WF_REPORTER', None, None),
+    ('application_tags', 'APPLICATION_TAGS', _instance_of(ApplicationTags),
+     None),
+    ('tracing', 'OPENTRACING_TRACING', _instance_of(DjangoTracing), None),
+    ('trace_all', 'OPENTRACING_TRACE_ALL', parse_bool, True),
+    ('traced_attributes', 'OPENTRACING_TRACED_ATTRIBUTES', parse_list, ()),
+    ('debug', 'WF_DEBUG', parse_bool, False),
+    ('debug_registry', 'DEBUG_REGISTRY', None, None),
+    ('disable_reporting', 'WF_DISABLE_REPORTING', parse_bool, False),
+    ('enable_internal_report', 'ENABLE_INTERNAL_REPORT', parse_bool, True),
+    ('metric_cache_size', 'WF_METRIC_CACHE_SIZE', parse_positive_int, 1000),
+    ('buffered_recording', 'WF_BUFFERED_RECORDING', parse_bool, False),
+    ('record_buffer_size', 'WF_RECORD_BUFFER_SIZE', parse_positive_int,
+     1000),
+    ('collector_socket', 'WF_COLLECTOR_SOCKET', str, None),
+    ('collector_interval', 'WF_COLLECTOR_INTERVAL', parse_positive_int, 10),
+    ('trace_sample_rate', 'WF_TRACE_SAMPLE_RATE', parse_rate, None),
+    ('trace_route_sample_rates', 'WF_TRACE_ROUTE_SAMPLE_RATES', parse_rates,
+     None),
+    ('trace_max_spans_per_second', 'WF_TRACE_MAX_SPANS_PER_SECOND',
+     parse_positive_float, None),
+    ('trace_keep_errors', 'WF_TRACE_KEEP_ERRORS', parse_bool, True),
+    ('trace_slow_threshold', 'WF_TRACE_SLOW_THRESHOLD', parse_positive_float,
+     None),
+    ('trace_http_url', 'WF_TRACE_HTTP_URL', parse_http_url, None),
+    ('max_routes', 'WF_MAX_ROUTES', parse_positive_int, 1000),
+    ('max_methods', 'WF_MAX_METHODS', parse_positive_int, 9),
+    ('max_status_codes', 'WF_MAX_STATUS_CODES', parse_positive_int, 30),
+    ('metric_series_ttl', 'WF_METRIC_SERIES_TTL', parse_positive_float,
+     None),
+    ('wall_clock', 'WF_WALL_CLOCK', parse_clock, wall_clock_ns),
+    ('cpu_clock', 'WF_CPU_CLOCK', parse_clock, cpu_clock_ns),
+    ('timing_phases', 'WF_TIMING_PHASES', parse_bool, False),
+    ('db_instrumentation', 'WF_DB_INSTRUMENTATION', parse_bool, False),
+    ('db_slow_query_threshold', 'WF_DB_SLOW_QUERY_THRESHOLD',
+     parse_non_negative_float, 0.1),
+    ('latency_tracking', 'WF_LATENCY_TRACKING', parse_bool, False),
+    ('latency_slo', 'WF_LATENCY_SLO', parse_positive_float, None),
+    ('route_latency_slos', 'WF_ROUTE_LATENCY_SLOS', parse_durations, None),
+    ('latency_window', 'WF_LATENCY_WINDOW', parse_positive_float, 60),
+    ('slow_exemplars', 'WF_SLOW_EXEMPLARS', parse_positive_int, 100),
+    ('reporting_queue', 'WF_REPORTING_QUEUE', parse_bool, False),
+    ('reporting_queue_size', 'WF_REPORTING_QUEUE_SIZE', parse_positive_int,
+     50000),
+    ('reporting_batch_size', 'WF_REPORTING_BATCH_SIZE', parse_positive_int,
+     1000),
+    ('reporting_max_backoff', 'WF_REPORTING_MAX_BACKOFF',
+     parse_positive_float, 60),
+    ('shutdown_timeout', 'WF_SHUTDOWN_TIMEOUT', parse_positive_float, 5),
+    ('lazy_start', 'WF_LAZY_START', parse_bool, True),
+    ('included_paths', 'WF_INCLUDED_PATHS', parse_path_rules, ()),
+    ('excluded_paths', 'WF_EXCLUDED_PATHS', parse_path_rules, ()),
+    ('included_methods', 'WF_INCLUDED_METHODS', parse_list, ()),
+    ('excluded_methods', 'WF_EXCLUDED_METHODS', parse_list, ()),
+    ('included_routes', 'WF_INCLUDED_ROUTES', parse_list, ()),
+    ('excluded_routes', 'WF_EXCLUDED_ROUTES', parse_list, ()),
+    ('payload_sizes', 'WF_PAYLOAD_SIZES', parse_bool, False),
+    ('streaming_responses', 'WF_STREAMING_RESPONSES', parse_bool, True),
+    ('capture_file', 'WF_CAPTURE_FILE', str, None),
+)
+
+SETTING_NAMES = frozenset(setting for _, setting, _, _ in SETTINGS)
+
+WavefrontConfig = namedtuple('WavefrontConfig',
+                             [field for field, _, _, _ in SETTINGS])
+
+
+def load_config():
+    """Read and validate all settings of the middleware.
+
+    :return: WavefrontConfig.
+    :raise ConfigError: If any setting is not correctly configured, listing
+        all of them.
+    """
+    values = {}
+    errors = []
+    for field, setting, parse, default in SETTINGS:
+        value = get_conf(setting)
+        if value is None:
+            value = default
+        elif parse is not None:
+            try:
+                value = parse(value)
+            except (TypeError, ValueError):
+                errors.append("{} not correctly configured!".format(setting))
+        values[field] = value
+    if not values['application_tags'] and \
+            'APPLICATION_TAGS not correctly configured!' not in errors:
+        errors.append("APPLICATION_TAGS not correctly configured!")
+    if not values['tracing'] and \
+            'OPENTRACING_TRACING not correctly configured!' not in errors:
+        errors.append("OPENTRACING_TRACING not correctly configured!")
+    if not values['reporter'] or (not isinstance(
+            values['reporter'], WavefrontReporter) and not values['debug']):
+        errors.insert(0, "WF_REPORTER not correctly configured!")
+    if errors:
+        raise ConfigError(errors)
+    return WavefrontConfig(**values)
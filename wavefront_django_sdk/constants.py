@@ -31,3 +31,7 @@ SERVICE_TAG_KEY = "service"
 COMPONENT_TAG_KEY = "component"
 
 HEART_BEAT_INTERVAL = 10
+
+UNKNOWN_ENTITY_NAME = 'UNKNOWN'
+
+OTHER_BUCKET = 'OTHER'
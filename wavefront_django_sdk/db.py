@@ -0,0 +1,206 @@
+"""
+Database Query Instrumentation.
+
+Times every query a request runs through an execute wrapper installed on
+each database connection, so the middleware can record query count, DB
+time and query latency per route, and trace slow queries as child spans of
+the request span.
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+from functools import lru_cache
+
+from opentracing.ext import tags
+
+from .constants import DJANGO_COMPONENT
+from .timing import ContextVar, NANOS_PER_SECOND
+
+DB_METRICS = ('db_queries', 'db_duplicates', 'db_time_ns', 'db_query_ns')
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%s|%\(\w+\)s|\?')
+_IN_LIST = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_VALUES_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'
+                          r'(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))+')
+_SPACE = re.compile(r'\s+')
+
+LOGGER = logging.getLogger(__name__)
+
+
+def normalize_sql(sql):
+    """Normalize a query so all executions of a statement look the same.
+
+    Literals and placeholders become ?, IN lists and multi-row VALUES
+    collapse into one item and whitespace is squeezed.
+
+    :param sql: SQL of the query.
+    :return: Normalized SQL.
+    """
+    sql = _STRING.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('IN (?)', sql)
+    sql = _VALUES_LIST.sub('(?)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+@lru_cache(maxsize=1024)
+def get_sql_fingerprint(sql):
+    """Get the normalized SQL of a query and a short hash of it.
+
+    Django issues the same SQL for every execution of a queryset, so the
+    result is cached by the raw SQL.
+
+    :param sql: SQL of the query.
+    :return: Tuple of normalized SQL and its fingerprint.
+    """
+    normalized = normalize_sql(sql)
+    fingerprint = hashlib.blake2b(normalized.encode('utf-8'),
+                                  digest_size=8).hexdigest()
+    return normalized, fingerprint
+
+
+# pylint: disable=too-many-instance-attributes
+class QueryStats:
+    """Queries run while serving a single request."""
+
+    __slots__ = ('clock', 'slow_threshold_ns', 'tracer', 'span', 'count',
+                 'total_ns', 'latencies', 'fingerprints')
+
+    def __init__(self, clock, slow_threshold_ns=None):
+        """Construct Query Stats.
+
+        :param clock: Wall clock in integer nanoseconds.
+        :param slow_threshold_ns: Trace queries at least this slow, None
+            to trace none.
+        """
+        self.clock = clock
+        self.slow_threshold_ns = slow_threshold_ns
+        self.tracer = None
+        self.span = None
+        self.count = 0
+        self.total_ns = 0
+        self.latencies = []
+        self.fingerprints = {}
+
+    @property
+    def duplicates(self):
+        """Get number of queries repeating an earlier statement, e.g. N+1."""
+        return self.count - len(self.fingerprints)
+
+    def add(self, fingerprint, duration_ns):
+        """Count a query.
+
+        :param fingerprint: Fingerprint of the query.
+        :param duration_ns: Duration of the query in nanoseconds.
+        """
+        self.count += 1
+        self.total_ns += duration_ns
+        self.latencies.append(duration_ns)
+        self.fingerprints[fingerprint] = \
+            self.fingerprints.get(fingerprint, 0) + 1
+
+    def get_values(self):
+        """Get the per request values, in the order of DB_METRICS[:3]."""
+        return self.count, self.duplicates, self.total_ns
+
+
+_current_stats = ContextVar('wf_query_stats', default=None)
+_install_lock = threading.Lock()
+
+
+def set_current_query_stats(stats):
+    """Set the QueryStats of the request served in this context.
+
+    :param stats: QueryStats, or None once the request is done.
+    """
+    _current_stats.set(stats)
+
+
+# pylint: disable=too-many-arguments
+def instrument_query(execute, sql, params, many, context):
+    """Execute wrapper timing queries of the current request.
+
+    :param execute: Next execute function of the connection.
+    :param sql: SQL of the query.
+    :param params: Parameters of the query.
+    :param many: Whether this is executemany.
+    :param context: Dict holding the connection and cursor.
+    """
+    stats = _current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = stats.clock()
+    error = None
+    try:
+        return execute(sql, params, many, context)
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        duration = stats.clock() - start
+        normalized, fingerprint = get_sql_fingerprint(sql)
+        stats.add(fingerprint, duration)
+        if stats.span is not None and stats.slow_threshold_ns is not None \
+                and duration >= stats.slow_threshold_ns:
+            _trace_query(stats, context['connection'], normalized,
+                         fingerprint, duration, error)
+
+
+# pylint: disable=too-many-arguments
+def _trace_query(stats, connection, normalized, fingerprint, duration,
+                 error):
+    """Report a slow query as child span of the request span."""
+    finish_time = time.time()
+    span = stats.tracer.start_span(
+        operation_name='django.db.' + normalized.split(' ', 1)[0].lower(),
+        child_of=stats.span,
+        start_time=finish_time - duration / NANOS_PER_SECOND,
+        tags={
+            tags.COMPONENT: DJANGO_COMPONENT,
+            tags.SPAN_KIND: tags.SPAN_KIND_RPC_CLIENT,
+            tags.DATABASE_TYPE: connection.vendor,
+            tags.DATABASE_INSTANCE: connection.alias,
+            tags.DATABASE_STATEMENT: normalized,
+            'db.fingerprint': fingerprint,
+        })
+    if error is not None:
+        span.set_tag(tags.ERROR, 'true')
+        span.log_kv({'event': 'error', 'error.kind': type(error).__name__})
+    span.finish(finish_time=finish_time)
+
+
+def _add_wrapper(connection, **kwargs):  # pylint: disable=unused-argument
+    """Install the wrapper on a connection, once."""
+    if instrument_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, instrument_query)
+
+
+def install_query_instrumentation():
+    """Time the queries of every database connection.
+
+    Installs the wrapper on connections open in this thread and on every
+    connection created afterwards. The wrapper does nothing outside of a
+    request the middleware instruments. Execute wrappers were added in
+    Django 2.0, queries are not timed before.
+
+    :return: True if installed, False if Django has no execute wrappers.
+    """
+    # pylint: disable=import-outside-toplevel
+    from django.db import connections
+    from django.db.backends.base.base import BaseDatabaseWrapper
+    from django.db.backends.signals import connection_created
+    if not hasattr(BaseDatabaseWrapper, 'execute_wrapper'):
+        LOGGER.warning("WF_DB_INSTRUMENTATION requires Django 2.0 or later, "
+                       "queries are not timed.")
+        return False
+    with _install_lock:
+        connection_created.connect(_add_wrapper, weak=False,
+                                   dispatch_uid='wavefront_django_sdk.db')
+        for connection in connections.all():
+            _add_wrapper(connection)
+    return True
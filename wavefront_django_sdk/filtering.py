@@ -0,0 +1,159 @@
+"""
+Request Filtering.
+
+Decides which requests get metrics and spans from include and exclude
+rules for paths, methods and routes, compiled once, so requests such as
+health checks or static files can skip the middleware at the cost of a
+few C-level string comparisons.
+"""
+import re
+
+
+class PathMatcher:
+    """Match a path against prefixes and regular expressions at once.
+
+    Rules starting with ^ are regular expressions matched at the start of
+    the path, all of them combined into one pattern. Other rules are path
+    prefixes, checked together by a single str.startswith call.
+    """
+
+    __slots__ = ('prefixes', 'pattern')
+
+    def __init__(self, rules=()):
+        """Construct Path Matcher.
+
+        :param rules: Path prefixes and ^regular expressions.
+        """
+        prefixes = sorted(rule for rule in rules if not rule.startswith('^'))
+        # Prefixes of other prefixes already cover them.
+        self.prefixes = tuple(
+            prefix for i, prefix in enumerate(prefixes)
+            if not any(prefix.startswith(shorter)
+                       for shorter in prefixes[:i]))
+        patterns = [rule for rule in rules if rule.startswith('^')]
+        self.pattern = re.compile('|'.join(
+            '(?:{})'.format(pattern) for pattern in patterns)) \
+            if patterns else None
+
+    def __bool__(self):
+        """Check whether there is any rule."""
+        return bool(self.prefixes) or self.pattern is not None
+
+    def match(self, path):
+        """Check whether a path matches any rule.
+
+        :param path: Path of the request, without the script prefix.
+        """
+        if self.prefixes and path.startswith(self.prefixes):
+            return True
+        return self.pattern is not None and \
+            self.pattern.match(path) is not None
+
+
+class RouteMatcher:
+    """Match a route against URL names and namespaces.
+
+    Rules are URL names as passed to reverse(), e.g. 'health' or
+    'api:health', or namespaces ending with a colon, e.g. 'admin:'.
+    """
+
+    __slots__ = ('names', 'namespaces')
+
+    def __init__(self, rules=()):
+        """Construct Route Matcher.
+
+        :param rules: URL names and namespaces.
+        """
+        self.names = frozenset(rule for rule in rules
+                               if not rule.endswith(':'))
+        self.namespaces = tuple(rule for rule in rules if rule.endswith(':'))
+
+    def __bool__(self):
+        """Check whether there is any rule."""
+        return bool(self.names) or bool(self.namespaces)
+
+    def match(self, resolver_match):
+        """Check whether the route of a request matches any rule.
+
+        :param resolver_match: ResolverMatch of the request, or None.
+        """
+        if resolver_match is None:
+            return False
+        view_name = resolver_match.view_name
+        return view_name in self.names or \
+            resolver_match.url_name in self.names or \
+            bool(self.namespaces) and view_name.startswith(self.namespaces)
+
+
+class RequestFilter:
+    """Include and exclude rules deciding which requests are skipped.
+
+    A request is skipped if it matches an exclude rule, or if there are
+    include rules of a kind and it matches none of them. Paths and methods
+    are checked before the view is resolved, routes once it is.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, included_paths=(), excluded_paths=(),
+                 included_methods=(), excluded_methods=(),
+                 included_routes=(), excluded_routes=()):
+        """Construct Request Filter.
+
+        :param included_paths: Path prefixes and ^regular expressions of
+            the only requests to keep.
+        :param excluded_paths: Path prefixes and ^regular expressions of
+            requests to skip.
+        :param included_methods: HTTP methods of the only requests to keep.
+        :param excluded_methods: HTTP methods of requests to skip.
+        :param included_routes: URL names and namespaces of the only
+            requests to keep.
+        :param excluded_routes: URL names and namespaces of requests to
+            skip.
+        """
+        # Matchers without rules are None, so checks stay cheap.
+        self.included_paths = PathMatcher(included_paths) or None
+        self.excluded_paths = PathMatcher(excluded_paths) or None
+        self.included_methods = frozenset(
+            method.upper() for method in included_methods) or None
+        self.excluded_methods = frozenset(
+            method.upper() for method in excluded_methods)
+        self.included_routes = RouteMatcher(included_routes) or None
+        self.excluded_routes = RouteMatcher(excluded_routes) or None
+
+    def __bool__(self):
+        """Check whether there is any rule."""
+        return self.included_paths is not None or \
+            self.excluded_paths is not None or \
+            self.included_methods is not None or \
+            bool(self.excluded_methods) or \
+            self.included_routes is not None or \
+            self.excluded_routes is not None
+
+    def skip_request(self, path, method):
+        """Check whether to skip a request by its path and method.
+
+        :param path: Path of the request, without the script prefix.
+        :param method: HTTP method of the request.
+        :return: True if the request gets no metrics and no span.
+        """
+        if method in self.excluded_methods or \
+                self.included_methods is not None and \
+                method not in self.included_methods:
+            return True
+        if self.excluded_paths is not None and \
+                self.excluded_paths.match(path):
+            return True
+        return self.included_paths is not None and \
+            not self.included_paths.match(path)
+
+    def skip_route(self, resolver_match):
+        """Check whether to skip a request by its resolved route.
+
+        :param resolver_match: ResolverMatch of the request, or None.
+        :return: True if the request gets no metrics and no span.
+        """
+        if self.excluded_routes is not None and \
+                self.excluded_routes.match(resolver_match):
+            return True
+        return self.included_routes is not None and \
+            not self.included_routes.match(resolver_match)
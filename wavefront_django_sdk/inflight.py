@@ -0,0 +1,72 @@
+"""Thread-Safe Inflight Gauge."""
+import threading
+import weakref
+
+from pyformance.meters import Gauge
+
+
+# pylint: disable=too-few-public-methods
+class ThreadMarker:
+    """Object kept alive by the thread-local storage of a thread.
+
+    Python clears the thread-local storage of a thread when it ends, so a
+    weak reference to a marker tells whether the thread ended, also for
+    threads started outside Python, e.g. by uWSGI or mod_wsgi, whose
+    threading._DummyThread is always alive.
+    """
+
+    __slots__ = ('__weakref__',)
+
+
+class InflightGauge(Gauge):
+    """Gauge of inflight requests striped across threads.
+
+    Every thread adds to its own counter, which no other thread writes, so
+    concurrent updates are never lost and request threads never contend on
+    a lock. The reporter sums the per-thread counters when it reads the
+    value, folding the counters of finished threads into a base value.
+
+    Finished threads are told apart by their ThreadMarker.
+    """
+
+    def __init__(self):
+        """Construct Inflight Gauge."""
+        super().__init__()
+        self._local = threading.local()
+        # (weak reference to the marker of a thread, counter of the thread)
+        self._cells = []
+        self._retired = 0
+        self._lock = threading.Lock()
+
+    def add(self, val):
+        """Add to the number of inflight requests of the current thread.
+
+        :param val: Value to add, 1 on request and -1 on response.
+        """
+        try:
+            cell = self._local.cell
+        except AttributeError:
+            cell = self._new_cell()
+        cell[0] += val
+
+    def get_value(self):
+        """Get the number of inflight requests across all threads."""
+        with self._lock:
+            live_cells = []
+            for marker, cell in self._cells:
+                if marker() is not None:
+                    live_cells.append((marker, cell))
+                else:
+                    self._retired += cell[0]
+            self._cells = live_cells
+            return self._retired + sum(cell[0] for _, cell in live_cells)
+
+    def _new_cell(self):
+        """Register a counter for the current thread."""
+        cell = [0]
+        marker = ThreadMarker()
+        with self._lock:
+            self._cells.append((weakref.ref(marker), cell))
+        self._local.marker = marker
+        self._local.cell = cell
+        return cell
@@ -7,10 +7,20 @@ import opentracing
 
 
 # pylint: disable=protected-access
-def inject_as_headers(tracer, span, request):
-    """Inject tracing context into header."""
+def get_trace_headers(tracer, span):
+    """Get the tracing context of a span as HTTP headers.
+
+    :param tracer: DjangoTracing.
+    :param span: Span to propagate.
+    :return: Dict of header name to value.
+    """
     text_carrier = {}
     tracer._tracer.inject(span.context, opentracing.Format.TEXT_MAP,
                           text_carrier)
-    for (key, val) in text_carrier.items():
+    return text_carrier
+
+
+def inject_as_headers(tracer, span, request):
+    """Inject tracing context into header."""
+    for (key, val) in get_trace_headers(tracer, span).items():
         request.add_header(key, val)
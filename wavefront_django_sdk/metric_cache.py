@@ -0,0 +1,136 @@
+"""Per-Route Metric Handle Cache."""
+import threading
+from collections import OrderedDict
+
+
+# pylint: disable=too-few-public-methods, too-many-arguments
+# pylint: disable=too-many-instance-attributes
+class RouteMetrics:
+    """Pre-resolved metric handles of a single route."""
+
+    __slots__ = ('inflight', 'responses', 'latency', 'cpu_ns',
+                 'total_time', 'phases', 'db', 'payload', 'live_latency',
+                 'over_slo_counters', 'last_used', 'expired')
+
+    def __init__(self, inflight=None, responses=None, latency=None,
+                 cpu_ns=None, total_time=None, phases=(), db=(), payload=(),
+                 live_latency=None, over_slo_counters=()):
+        """Construct Route Metrics.
+
+        :param inflight: Inflight gauge of the route.
+        :param responses: RollupCounter of the responses of the route.
+        :param latency: Latency histogram of the route.
+        :param cpu_ns: CPU time histogram of the route.
+        :param total_time: Total time counter of the route.
+        :param phases: Histograms of the request phases, in the order of
+            timing.PHASES, empty if phases are not timed.
+        :param db: Histograms of the queries, in the order of
+            db.DB_METRICS, empty if queries are not instrumented.
+        :param payload: Histograms of the payload sizes, in the order of
+            payload.PAYLOAD_METRICS, empty if sizes are not measured.
+        :param live_latency: RouteLatency of the route, None if latency is
+            not tracked.
+        :param over_slo_counters: Counters incremented on requests slower
+            than the latency SLO of the route.
+        """
+        self.inflight = inflight
+        self.responses = responses
+        self.latency = latency
+        self.cpu_ns = cpu_ns
+        self.total_time = total_time
+        self.phases = tuple(phases)
+        self.db = tuple(db)
+        self.payload = tuple(payload)
+        self.live_latency = live_latency
+        self.over_slo_counters = tuple(over_slo_counters)
+        self.last_used = 0
+        self.expired = False
+
+    def get_metrics(self):
+        """Get all metrics of the route."""
+        return [metric for metric in
+                (self.inflight, self.latency, self.cpu_ns, self.total_time)
+                if metric is not None] + \
+            list(self.get_counters()) + \
+            list(self.phases) + list(self.db) + list(self.payload) + \
+            list(self.over_slo_counters)
+
+    def get_counters(self):
+        """Get the registry counters the responses are rolled up into."""
+        return self.responses.targets if self.responses is not None else ()
+
+
+class RouteMetricsCache:
+    """Bounded LRU cache of route metric handles."""
+
+    def __init__(self, max_size=1000):
+        """Construct Route Metrics Cache.
+
+        :param max_size: Max number of routes to keep handles for.
+        """
+        if max_size <= 0:
+            raise ValueError("max_size must be positive")
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Get number of cached routes."""
+        return len(self._entries)
+
+    def get(self, key):
+        """Get cached handles of a route.
+
+        :param key: Route key, e.g. (url_name, method, status, module, func).
+        :return: Cached handles or None on miss.
+        """
+        with self._lock:
+            handles = self._entries.get(key)
+            if handles is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return handles
+
+    def put(self, key, handles):
+        """Cache handles of a route, evicting the least recently used one.
+
+        Evicting only drops the handles, the metrics themselves stay in the
+        registry and are looked up again on the next miss.
+
+        :param key: Route key.
+        :param handles: Route handles.
+        :return: The cached handles.
+        """
+        with self._lock:
+            self._entries[key] = handles
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return handles
+
+    def pop(self, key):
+        """Drop cached handles of a route.
+
+        :param key: Route key.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop all cached handles."""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        """Get cache statistics.
+
+        :return: Dict of hits, misses, evictions and size.
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': len(self._entries)}
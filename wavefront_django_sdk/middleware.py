@@ -5,35 +5,73 @@ Wavefront Django Middleware.
 """
 import logging
 import math
-import os
 import time
-from timeit import default_timer
+import warnings
+import weakref
 
-from django.conf import settings
-from django.urls import resolve
 from django.utils.deprecation import MiddlewareMixin
 
-from django_opentracing import DjangoTracing
+try:
+    from django.core.signals import setting_changed
+except ImportError:
+    from django.test.signals import setting_changed
+
 from django_opentracing.tracing import initialize_global_tracer
 
+try:
+    from opentracing.scope_managers.contextvars import \
+        ContextVarsScopeManager
+except ImportError:
+    ContextVarsScopeManager = None
+
 from wavefront_pyformance.delta import delta_counter
-from wavefront_pyformance.tagged_registry import TaggedRegistry
 from wavefront_pyformance.wavefront_histogram import wavefront_histogram
-from wavefront_pyformance.wavefront_reporter import WavefrontReporter
 
-from wavefront_sdk.common import ApplicationTags, HeartbeaterService
-from wavefront_sdk.common.constants import SDK_METRIC_PREFIX
-from wavefront_sdk.common.metrics.registry import WavefrontSdkMetricsRegistry
-from wavefront_sdk.common.utils import get_sem_ver
-
-from .constants import DJANGO_COMPONENT, NULL_TAG_VAL, \
-    REPORTER_PREFIX, REQUEST_PREFIX, RESPONSE_PREFIX, WAVEFRONT_PROVIDED_SOURCE
+from .cardinality import CardinalityLimiter
+from .config import ConfigError, SETTING_NAMES, get_conf, load_config, \
+    parse_list
+from .constants import NULL_TAG_VAL, REPORTER_PREFIX, REQUEST_PREFIX, \
+    RESPONSE_PREFIX, WAVEFRONT_PROVIDED_SOURCE
+from .db import DB_METRICS, QueryStats, install_query_instrumentation, \
+    set_current_query_stats
+from .filtering import RequestFilter
+from .inflight import InflightGauge
+from .metric_cache import RouteMetrics, RouteMetricsCache
+from .payload import PAYLOAD_METRICS, follow_stream, get_request_size, \
+    get_response_size
+from .recorder import BufferedRecorder, DirectRecorder
+from .registry import add_pre_report_hook
+from .resolver import get_view_names
+from .rollup import CounterRollup
+from .runtime import get_runtime
+from .timing import NANOS_PER_SECOND, PHASES, RequestPhases, \
+    instrument_templates, set_current_phases
+
+# Middleware instances reloaded by the one settings receiver.
+_middlewares = weakref.WeakSet()
+
+
+def _warn_deprecated(name, replacement):
+    """Warn that a method of the middleware is deprecated."""
+    warnings.warn('WavefrontMiddleware.{} is deprecated, use {} instead.'
+                  .format(name, replacement), DeprecationWarning,
+                  stacklevel=3)
+
+
+def _reload_config(setting, **kwargs):
+    """Reload the settings of every live middleware, e.g. in tests."""
+    for middleware in list(_middlewares):
+        middleware.reload_config(setting, **kwargs)
 
 
 # pylint: disable=invalid-name, protected-access, too-many-instance-attributes
 class WavefrontMiddleware(MiddlewareMixin):
     """Wavefront Django Middleware."""
 
+    sync_capable = True
+    async_capable = True
+
+    # pylint: disable=too-many-branches, too-many-statements
     def __init__(self, get_response=None):
         """Construct Wavefront Django Middleware.
 
@@ -44,69 +82,147 @@ class WavefrontMiddleware(MiddlewareMixin):
         self.logger = logging.getLogger(__name__)
         self.MIDDLEWARE_ENABLED = False
         try:
-            self.reporter = self.get_conf('WF_REPORTER')
-            self.application_tags = self.get_conf('APPLICATION_TAGS')
-            self.tracing = self.get_conf('OPENTRACING_TRACING')
-            self.is_debug = self.get_conf('WF_DEBUG') or False
-            self._sdk_metrics_registry = None
-            if not self.reporter or (not isinstance(
-                    self.reporter, WavefrontReporter) and not self.is_debug):
-                raise AttributeError(
-                    "WF_REPORTER not correctly configured!")
-            if not isinstance(self.application_tags, ApplicationTags):
-                raise AttributeError(
-                    "APPLICATION_TAGS not correctly configured!")
-            if not isinstance(self.tracing, DjangoTracing):
-                raise AttributeError(
-                    "OPENTRACING_TRACING not correctly configured!")
+            self.config = config = load_config()
+            self.reporter = config.reporter
+            self.application_tags = config.application_tags
+            self.tracing = config.tracing
+            self.is_debug = config.debug
             self.APPLICATION = self.application_tags.application \
                 or NULL_TAG_VAL
             self.CLUSTER = self.application_tags.cluster or NULL_TAG_VAL
             self.SERVICE = self.application_tags.service or NULL_TAG_VAL
             self.SHARD = self.application_tags.shard or NULL_TAG_VAL
             self.reporter.prefix = REPORTER_PREFIX
-            self.reg = None
-            if self.is_debug:
-                self.reg = self.get_conf('DEBUG_REGISTRY')
-            self.reg = self.reg or TaggedRegistry()
+            # Every middleware instance of the process shares one registry.
+            self.runtime = get_runtime()
+            self.reg = self.runtime.get_registry(
+                config.debug_registry if self.is_debug else None)
             self.reporter.registry = self.reg
-            if not self.get_conf('WF_DISABLE_REPORTING'):
-                self.reporter.start()
-                self.heartbeaterService = HeartbeaterService(
-                    wavefront_client=self.reporter.wavefront_client,
-                    application_tags=self.application_tags,
-                    components=DJANGO_COMPONENT,
-                    source=self.reporter.source)
-            self.tracing._trace_all = getattr(settings,
-                                              'OPENTRACING_TRACE_ALL', True)
+            self.metric_cache = RouteMetricsCache(config.metric_cache_size)
+            self._total_inflight_gauge = None
+            self._skipped_counter = None
+            self.cardinality = self.get_cardinality_limiter()
+            if config.buffered_recording:
+                self.recorder = BufferedRecorder(self.reg,
+                                                 config.record_buffer_size)
+            else:
+                self.recorder = DirectRecorder()
+            # Rolls up responses after the recorder merged its buffers.
+            self.rollup = CounterRollup(self.reg)
+            if self.cardinality.series_ttl:
+                # Registered after the responses are rolled up.
+                add_pre_report_hook(self.reg, self.expire_series)
+            # Reporting starts on the first request of every process.
+            self.runtime.prepare(config, self.tracing)
+            if not config.lazy_start:
+                self.runtime.start()
+            self.wall_clock = config.wall_clock
+            self.cpu_clock = config.cpu_clock
+            self.timing_phases = config.timing_phases
+            if self.timing_phases:
+                instrument_templates()
+            self.db_instrumentation = config.db_instrumentation
+            self.db_slow_query_threshold_ns = int(
+                config.db_slow_query_threshold * NANOS_PER_SECOND)
+            if self.db_instrumentation:
+                self.db_instrumentation = install_query_instrumentation()
+            self.payload_sizes = config.payload_sizes
+            self.streaming_responses = config.streaming_responses
+            self.latency_tracker = self.get_latency_tracker()
+            if self.latency_tracker:
+                # pylint: disable=import-outside-toplevel
+                from .slo import set_latency_tracker
+                set_latency_tracker(self.latency_tracker)
+            self.apply_config(config)
+            if getattr(self, 'async_mode', False):
+                self._enable_async_mode()
             initialize_global_tracer(self.tracing)
+            _middlewares.add(self)
+            setting_changed.connect(
+                _reload_config, dispatch_uid='wavefront_django_sdk.middleware')
             self.MIDDLEWARE_ENABLED = True
-            # Report internal metrics with prefix ~sdk.python.django.sender
-            if self.get_conf('ENABLE_INTERNAL_REPORT') is not False:
-                self._sdk_metrics_registry = WavefrontSdkMetricsRegistry(
-                    wf_metric_sender=self.reporter.wavefront_client,
-                    source=self.reporter.source,
-                    tags=dict(self.application_tags.get_as_list()),
-                    prefix='{}.django'.format(SDK_METRIC_PREFIX))
-            self._sdk_metrics_registry.new_gauge(
-                'version',
-                lambda: get_sem_ver('wavefront-django-sdk-python'))
+            self.runtime.add_gauge('metric_cache.hits',
+                                   lambda: self.metric_cache.hits)
+            self.runtime.add_gauge('metric_cache.misses',
+                                   lambda: self.metric_cache.misses)
+            self.runtime.add_gauge('metric_cache.evictions',
+                                   lambda: self.metric_cache.evictions)
+            self.runtime.add_gauge('cardinality.folded',
+                                   self.cardinality.get_folded_count)
+            self.runtime.add_gauge('cardinality.series',
+                                   self.cardinality.get_series_count)
+            self.runtime.add_gauge('cardinality.expired',
+                                   lambda: self.cardinality.expired)
         except AttributeError as e:
             self.logger.warning(e)
         finally:
             if not self.MIDDLEWARE_ENABLED:
                 self.logger.warning("Wavefront Django Middleware not enabled!")
 
-    def __del__(self):
-        """Destruct Wavefront Django Middleware."""
-        if self._sdk_metrics_registry:
-            self._sdk_metrics_registry.close(timeout_secs=1)
-        if self.reporter:
-            self.reporter.stop()
-        if self.heartbeaterService:
-            self.heartbeaterService.close()
+    def __call__(self, request):
+        """Start timing phases and queries before other middleware runs.
 
-    # pylint: disable=unused-argument
+        :param request: incoming HTTP request.
+        """
+        if self.MIDDLEWARE_ENABLED:
+            if not self.runtime.started:
+                self.runtime.start(background=True)
+            if self.request_filter is not None and \
+                    self.request_filter.skip_request(request.path_info,
+                                                     request.method):
+                return self._skip_request(request)
+            if self.timing_phases:
+                request.wf_phases = RequestPhases(self.wall_clock,
+                                                  self.wall_clock())
+            if self.db_instrumentation:
+                request.wf_query_stats = QueryStats(
+                    self.wall_clock, self.db_slow_query_threshold_ns)
+                set_current_query_stats(request.wf_query_stats)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        """Process the request natively on the event loop.
+
+        The Wavefront hooks never block on I/O, so unlike MiddlewareMixin
+        they are called directly instead of through sync_to_async. Reporting
+        is started and skipped requests are passed on by __call__, before
+        MiddlewareMixin dispatches here.
+
+        :param request: incoming HTTP request.
+        """
+        response = await self.get_response(request)
+        return self.process_response(request, response)
+
+    def _enable_async_mode(self):
+        """Run process_view on the event loop when serving via ASGI.
+
+        Django wraps every sync process_view in sync_to_async when the
+        handler is async, so swap in a coroutine for this instance.
+        """
+        self._sync_process_view = self.process_view
+        self.process_view = self._async_process_view
+        self._sync_process_template_response = \
+            self.process_template_response
+        self.process_template_response = \
+            self._async_process_template_response
+        scope_manager = getattr(self.tracing.tracer, 'scope_manager', None)
+        if ContextVarsScopeManager is not None and not isinstance(
+                scope_manager, ContextVarsScopeManager):
+            self.logger.warning(
+                "Tracer does not use ContextVarsScopeManager, active spans "
+                "may leak between concurrent async requests.")
+
+    async def _async_process_view(self, request, view_func, view_args,
+                                  view_kwargs):
+        """Async version of process_view swapped in for ASGI requests."""
+        return self._sync_process_view(request, view_func, view_args,
+                                       view_kwargs)
+
+    async def _async_process_template_response(self, request, response):
+        """Async version of process_template_response for ASGI requests."""
+        return self._sync_process_template_response(request, response)
+
+    # pylint: disable=unused-argument, method-hidden
     def process_view(self, request, view_func, view_args, view_kwargs):
         """
         Process the view before Django calls.
@@ -116,39 +232,56 @@ class WavefrontMiddleware(MiddlewareMixin):
         :param view_args: list of positional arguments passed to the view.
         :param view_kwargs: dictionary of keyword arguments passed to the view.
         """
-        if not self.MIDDLEWARE_ENABLED:
+        if not self.MIDDLEWARE_ENABLED or getattr(request, 'wf_skip', False):
             return
-        request.wf_start_timestamp = default_timer()
-        request.wf_cpu_nanos = time.clock()
-
-        entity_name = self.get_entity_name(request)
-        func_name = resolve(request.path_info).func.__name__
-        module_name = resolve(request.path_info).func.__module__
-        self.update_gauge(
-            registry=self.reg,
-            key=self.get_metric_name(entity_name, request) + ".inflight",
-            tags=self.get_tags_map(module_name=module_name,
-                                   func_name=func_name),
-            val=1
-        )
-        self.update_gauge(
-            registry=self.reg,
-            key="total_requests.inflight",
-            tags=self.get_tags_map(
-                cluster=self.CLUSTER,
-                service=self.SERVICE,
-                shard=self.SHARD),
-            val=1
-        )
+        if self.request_filter is not None and \
+                self.request_filter.skip_route(request.resolver_match):
+            request.wf_skip = True
+            self._skipped_counter.inc()
+            return
+        request.wf_start_ns = start_ns = self.wall_clock()
+        request.wf_cpu_ns = self.cpu_clock()
+        phases = getattr(request, 'wf_phases', None)
+        if phases is not None:
+            phases.view_start = start_ns
+            set_current_phases(phases)
+
+        view_names, method = self.cardinality.fold_route(
+            get_view_names(request), request.method)
+        request.wf_view_names = view_names
+        request.wf_method = method
+        route_metrics = self.get_route_metrics(view_names, method)
+        route_metrics.inflight.add(1)
+        self.get_total_inflight_gauge().add(1)
         if self.tracing:
             if not self.tracing._trace_all:
                 return
-            if hasattr(settings, 'OPENTRACING_TRACED_ATTRIBUTES'):
-                traced_attributes = getattr(settings,
-                                            'OPENTRACING_TRACED_ATTRIBUTES')
-            else:
-                traced_attributes = []
-            self.tracing._apply_tracing(request, view_func, traced_attributes)
+            if self.sampler and not self.sampler.sample(
+                    view_names.entity_name):
+                # Sampled out, kept to trace it later if it fails or is slow.
+                request.wf_view_func = view_func
+                return
+            scope = self.tracing._apply_tracing(request, view_func,
+                                                self.traced_attributes)
+            query_stats = getattr(request, 'wf_query_stats', None)
+            if query_stats is not None:
+                query_stats.tracer = self.tracing.tracer
+                query_stats.span = scope.span
+
+    # pylint: disable=method-hidden
+    def process_template_response(self, request, response):
+        """
+        Mark the end of the view and time the rendering of the response.
+
+        :param request: incoming HTTP request.
+        :param response: outgoing template response, not rendered yet.
+        """
+        phases = getattr(request, 'wf_phases', None)
+        if phases is not None:
+            phases.mark_render_start()
+            response.add_post_render_callback(
+                lambda rendered: phases.mark_render_end())
+        return response
 
     # pylint: disable=too-many-locals
     def process_response(self, request, response):
@@ -160,33 +293,263 @@ class WavefrontMiddleware(MiddlewareMixin):
         """
         if not self.MIDDLEWARE_ENABLED:
             return response
-        entity_name = self.get_entity_name(request)
-        func_name = resolve(request.path_info).func.__name__
-        module_name = resolve(request.path_info).func.__module__
-
+        if getattr(request, 'wf_skip', False) or \
+                self.request_filter is not None and \
+                not hasattr(request, 'wf_view_names') and \
+                self._skip_unresolved(request):
+            if getattr(request, 'wf_query_stats', None) is not None:
+                set_current_query_stats(None)
+            return response
+        duration_ns = cpu_ns = phase_durations = None
+        if hasattr(request, 'wf_start_ns'):
+            duration_ns = self.wall_clock() - request.wf_start_ns
+            cpu_ns = self.cpu_clock() - request.wf_cpu_ns
+            phases = getattr(request, 'wf_phases', None)
+            if phases is not None:
+                set_current_phases(None)
+                phase_durations = phases.get_durations()
+
+        query_stats = getattr(request, 'wf_query_stats', None)
+        if query_stats is not None:
+            set_current_query_stats(None)
+            if query_stats.span is not None:
+                query_stats.span.set_tag('db.query_count', query_stats.count)
+                query_stats.span.set_tag('db.duplicate_queries',
+                                         query_stats.duplicates)
+
+        # Streaming responses are recorded once their last byte is sent.
+        streaming = self.streaming_responses and response.streaming
+        span = open_span = None
         if self.tracing:
+            view_func = getattr(request, 'wf_view_func', None)
+            if view_func is not None:
+                duration = duration_ns / NANOS_PER_SECOND
+                if self.sampler.keep(response, duration):
+                    self.tracing._apply_tracing(
+                        request, view_func, self.traced_attributes,
+                        start_time=time.time() - duration)
+            if self.latency_tracker:
+                span = self.tracing.get_span(request)
+            if streaming:
+                open_span = self._keep_span_open(request)
             self.tracing._finish_tracing(request, response=response)
 
-        self.update_gauge(
-            registry=self.reg,
-            key=self.get_metric_name(entity_name, request) + ".inflight",
-            tags=self.get_tags_map(
-                module_name=module_name,
-                func_name=func_name),
-            val=-1
-        )
-        self.update_gauge(
-            registry=self.reg,
-            key="total_requests.inflight",
-            tags=self.get_tags_map(
-                cluster=self.CLUSTER,
-                service=self.SERVICE,
-                shard=self.SHARD),
-            val=-1
-        )
+        # Inflight gauges were only incremented if process_view was called.
+        view_names = getattr(request, 'wf_view_names', None)
+        if view_names is not None:
+            method = request.wf_method
+            self.get_route_metrics(view_names, method).inflight.add(-1)
+            self.get_total_inflight_gauge().add(-1)
+        else:
+            view_names, method = self.cardinality.fold_route(
+                get_view_names(request), request.method)
+
+        # django.server.response.style._id_.make.summary.GET.200.latency.m
+        # django.server.response.style._id_.make.summary.GET.200.cpu_ns.m
+        # django.server.response.style._id_.make.summary.GET.200.total_time.count
+        route_metrics = self.get_route_metrics(view_names, method, response)
+        request_bytes = get_request_size(request) \
+            if self.payload_sizes else None
+        if streaming:
+            self._follow_stream(request, response, route_metrics, cpu_ns,
+                                phase_durations, query_stats, request_bytes,
+                                span, open_span, (view_names, method))
+            return response
+        self._record_response(
+            request, route_metrics, duration_ns, cpu_ns, phase_durations,
+            query_stats, None if request_bytes is None else
+            (request_bytes, get_response_size(response)), span)
+        return response
+
+    # pylint: disable=too-many-arguments
+    def _record_response(self, request, route_metrics, duration_ns, cpu_ns,
+                         phase_durations, query_stats, sizes, span):
+        """Record a response into the metrics of its route.
+
+        :param request: incoming HTTP request.
+        :param route_metrics: RouteMetrics of the response.
+        :param duration_ns: Wall time of the request in nanoseconds, None if
+            unknown.
+        :param cpu_ns: CPU time of the request in nanoseconds.
+        :param phase_durations: Tuple of nanoseconds per phase, or None.
+        :param query_stats: QueryStats of the request, or None.
+        :param sizes: Tuple of bytes per payload metric, or None.
+        :param span: Span of the request, or None if not traced.
+        """
+        self.recorder.record(route_metrics, duration_ns, cpu_ns,
+                             phase_durations, query_stats, sizes)
+        if route_metrics.live_latency is not None and \
+                duration_ns is not None:
+            self.record_live_latency(request, route_metrics, duration_ns,
+                                     span)
+
+    # pylint: disable=too-many-arguments
+    def _follow_stream(self, request, response, route_metrics, cpu_ns,
+                       phase_durations, query_stats, request_bytes, span,
+                       open_span, route):
+        """Record a streaming response once the server closed it.
+
+        Its latency is the time to the last byte, and its response size the
+        bytes streamed. CPU time and phases cover the view only.
+
+        :param request: incoming HTTP request.
+        :param response: outgoing streaming response.
+        :param route_metrics: RouteMetrics of the response.
+        :param cpu_ns: CPU time of the request in nanoseconds.
+        :param phase_durations: Tuple of nanoseconds per phase, or None.
+        :param query_stats: QueryStats of the request, or None.
+        :param request_bytes: Size of the request body, None if payload
+            sizes are not measured.
+        :param span: Span of the request, or None if not traced.
+        :param open_span: Span of the request left open, finished on close.
+        :param route: Tuple of folded ViewNames and method, to resolve the
+            handles again if the series expired while streaming.
+        """
+        start_ns = getattr(request, 'wf_start_ns', None)
+
+        def on_close(end_ns, size):
+            duration_ns = None
+            if start_ns is not None:
+                duration_ns = (end_ns or self.wall_clock()) - start_ns
+            handles = route_metrics
+            if handles.expired:
+                handles = self.get_route_metrics(*route, response)
+            self._record_response(
+                request, handles, duration_ns, cpu_ns, phase_durations,
+                query_stats, None if request_bytes is None else
+                (request_bytes, size), span)
+            if open_span is not None:
+                open_span.finish()
+
+        follow_stream(response, self.wall_clock, on_close)
+
+    def _keep_span_open(self, request):
+        """Keep the span of a request open when its scope is closed.
+
+        :param request: incoming HTTP request.
+        :return: Span to finish later, or None if its scope can't keep it
+            open and finishes it right away.
+        """
+        scope = self.tracing._current_scopes.get(request)
+        # Scopes of the opentracing scope managers finish their span on
+        # close unless told otherwise.
+        if scope is None or not hasattr(scope, '_finish_on_close'):
+            return None
+        scope._finish_on_close = False
+        return scope.span
+
+    @staticmethod
+    def record_live_latency(request, route_metrics, duration_ns, span):
+        """Record a response into the live latency sketch of its route.
+
+        :param request: incoming HTTP request.
+        :param route_metrics: RouteMetrics of the response.
+        :param duration_ns: Wall time of the request in nanoseconds.
+        :param span: Span of the request, or None if not traced.
+        """
+        trace_id = getattr(span.context, 'trace_id', None) \
+            if span is not None else None
+        if route_metrics.live_latency.record(
+                duration_ns, request.path,
+                None if trace_id is None else str(trace_id)):
+            for counter in route_metrics.over_slo_counters:
+                counter.inc()
 
-        response_metric_key = self.get_metric_name(entity_name, request,
-                                                   response)
+    def _skip_request(self, request):
+        """Pass a request skipped by its path or method down the chain.
+
+        :param request: incoming HTTP request.
+        :return: Response, or coroutine of the response under ASGI.
+        """
+        request.wf_skip = True
+        self._skipped_counter.inc()
+        return self.get_response(request)
+
+    def _skip_unresolved(self, request):
+        """Check route rules of a request process_view never saw, e.g. 404.
+
+        :param request: incoming HTTP request.
+        :return: True if the request is skipped.
+        """
+        if not self.request_filter.skip_route(
+                getattr(request, 'resolver_match', None)):
+            return False
+        self._skipped_counter.inc()
+        return True
+
+    def get_route_metrics(self, view_names, method, response=None):
+        """Get cached metric handles of a route, resolving them on a miss.
+
+        :param view_names: ViewNames of the request, folded by the
+            cardinality limiter.
+        :param method: HTTP method, folded by the cardinality limiter.
+        :param response: Response obj, None for the request metrics.
+        :return: RouteMetrics of the route.
+        """
+        entity_name, module_name, func_name = view_names
+        status = self.cardinality.fold_status(response.status_code) \
+            if response else None
+        key = (entity_name, method, status, module_name, func_name)
+        route_metrics = self.metric_cache.get(key)
+        if route_metrics is None:
+            if response:
+                route_metrics = self._build_response_metrics(
+                    entity_name, method, status, response, module_name,
+                    func_name)
+            else:
+                route_metrics = RouteMetrics(inflight=self.reg.gauge(
+                    key='.'.join((REQUEST_PREFIX, entity_name, method,
+                                  'inflight')),
+                    gauge=InflightGauge(),
+                    tags=self.get_tags_map(module_name=module_name,
+                                           func_name=func_name)))
+            self.metric_cache.put(key, route_metrics)
+            self.cardinality.track(key, route_metrics)
+        if self.cardinality.series_ttl and \
+                not self.cardinality.touch(route_metrics):
+            # Expired since it was looked up, its metrics are gone.
+            return self.get_route_metrics(view_names, method, response)
+        return route_metrics
+
+    def expire_series(self):
+        """Remove metric series idle for longer than WF_METRIC_SERIES_TTL."""
+        self.cardinality.expire(self.reg, on_expire=self._forget_series)
+
+    def _forget_series(self, key):
+        """Drop cached handles and rollup counter of an expired series.
+
+        :param key: Folded route key.
+        """
+        self.metric_cache.pop(key)
+        self.rollup.pop(key)
+
+    def get_total_inflight_gauge(self):
+        """Get gauge of total inflight requests."""
+        if self._total_inflight_gauge is None:
+            self._total_inflight_gauge = self.reg.gauge(
+                key="total_requests.inflight",
+                gauge=InflightGauge(),
+                tags=self.get_tags_map(
+                    cluster=self.CLUSTER,
+                    service=self.SERVICE,
+                    shard=self.SHARD))
+        return self._total_inflight_gauge
+
+    # pylint: disable=too-many-arguments, too-many-locals
+    def _build_response_metrics(self, entity_name, method, status, response,
+                                module_name, func_name):
+        """Resolve metric handles of a route response from the registry.
+
+        :param entity_name: Entity Name.
+        :param method: HTTP method.
+        :param status: Status code or status class.
+        :param response: Response obj.
+        :param module_name: Name of Django module.
+        :param func_name: Name of Django func.
+        :return: RouteMetrics of the route response.
+        """
+        response_metric_key = '.'.join((RESPONSE_PREFIX, entity_name, method,
+                                        status))
 
         complete_tags_map = self.get_tags_map(
             cluster=self.CLUSTER,
@@ -246,28 +609,31 @@ class WavefrontMiddleware(MiddlewareMixin):
         overall_aggregated_per_application_map = self.get_tags_map(
             source=WAVEFRONT_PROVIDED_SOURCE)
 
+        counters = []
+        error_counters = []
+
         # django.server.response.style._id_.make.GET.200.cumulative.count
         # django.server.response.style._id_.make.GET.200.aggregated_per_shard.count
         # django.server.response.style._id_.make.GET.200.aggregated_per_service.count
         # django.server.response.style._id_.make.GET.200.aggregated_per_cluster.count
         # django.server.response.style._id_.make.GET.200.aggregated_per_application.count
         # django.server.response.style._id_.make.GET.errors
-        self.reg.counter(response_metric_key + ".cumulative",
-                         tags=complete_tags_map).inc()
+        counters.append(self.reg.counter(response_metric_key + ".cumulative",
+                                         tags=complete_tags_map))
         if self.application_tags.shard:
-            delta_counter(
+            counters.append(delta_counter(
                 self.reg, response_metric_key + ".aggregated_per_shard",
-                tags=aggregated_per_shard_map).inc()
-        delta_counter(
+                tags=aggregated_per_shard_map))
+        counters.append(delta_counter(
             self.reg, response_metric_key + ".aggregated_per_service",
-            tags=aggregated_per_service_map).inc()
+            tags=aggregated_per_service_map))
         if self.application_tags.cluster:
-            delta_counter(
+            counters.append(delta_counter(
                 self.reg, response_metric_key + ".aggregated_per_cluster",
-                tags=aggregated_per_cluster_map).inc()
-        delta_counter(
+                tags=aggregated_per_cluster_map))
+        counters.append(delta_counter(
             self.reg, response_metric_key + ".aggregated_per_application",
-            tags=aggregated_per_application_map).inc()
+            tags=aggregated_per_application_map))
 
         # django.server.response.errors.aggregated_per_source.count
         # django.server.response.errors.aggregated_per_shard.count
@@ -275,58 +641,98 @@ class WavefrontMiddleware(MiddlewareMixin):
         # django.server.response.errors.aggregated_per_cluster.count
         # django.server.response.errors.aggregated_per_application.count
         if self.is_error_status_code(response):
-            self.reg.counter(
-                self.get_metric_name_without_status(entity_name, request),
-                tags=complete_tags_map).inc()
-            self.reg.counter("response.errors", tags=complete_tags_map).inc()
-            self.reg.counter("response.errors.aggregated_per_source",
-                             tags=overall_aggregated_per_source_map).inc()
+            error_counters.append(self.reg.counter(
+                '.'.join((REQUEST_PREFIX, entity_name, method)),
+                tags=complete_tags_map))
+            error_counters.append(self.reg.counter(
+                "response.errors", tags=complete_tags_map))
+            error_counters.append(self.reg.counter(
+                "response.errors.aggregated_per_source",
+                tags=overall_aggregated_per_source_map))
             if self.application_tags.shard:
-                delta_counter(self.reg, "response.errors.aggregated_per_shard",
-                              tags=overall_aggregated_per_shard_map).inc()
-            delta_counter(self.reg, "response.errors.aggregated_per_service",
-                          tags=overall_aggregated_per_service_map).inc()
+                error_counters.append(delta_counter(
+                    self.reg, "response.errors.aggregated_per_shard",
+                    tags=overall_aggregated_per_shard_map))
+            error_counters.append(delta_counter(
+                self.reg, "response.errors.aggregated_per_service",
+                tags=overall_aggregated_per_service_map))
             if self.application_tags.cluster:
-                delta_counter(self.reg,
-                              "response.errors.aggregated_per_cluster",
-                              tags=overall_aggregated_per_cluster_map).inc()
-            delta_counter(self.reg,
-                          "response.errors.aggregated_per_application",
-                          tags=overall_aggregated_per_application_map).inc()
+                error_counters.append(delta_counter(
+                    self.reg, "response.errors.aggregated_per_cluster",
+                    tags=overall_aggregated_per_cluster_map))
+            error_counters.append(delta_counter(
+                self.reg, "response.errors.aggregated_per_application",
+                tags=overall_aggregated_per_application_map))
 
         # django.server.response.completed.aggregated_per_source.count
         # django.server.response.completed.aggregated_per_shard.count
         # django.server.response.completed.aggregated_per_service.count
         # django.server.response.completed.aggregated_per_cluster.count
         # django.server.response.completed.aggregated_per_application.count
-        self.reg.counter("response.completed.aggregated_per_source",
-                         tags=overall_aggregated_per_source_map).inc()
+        counters.append(self.reg.counter(
+            "response.completed.aggregated_per_source",
+            tags=overall_aggregated_per_source_map))
         if self.SHARD is not NULL_TAG_VAL:
-            delta_counter(
+            counters.append(delta_counter(
                 self.reg, "response.completed.aggregated_per_shard",
-                tags=overall_aggregated_per_shard_map).inc()
-            self.reg.counter("response.completed.aggregated_per_service",
-                             tags=overall_aggregated_per_service_map).inc()
+                tags=overall_aggregated_per_shard_map))
+            counters.append(self.reg.counter(
+                "response.completed.aggregated_per_service",
+                tags=overall_aggregated_per_service_map))
         if self.CLUSTER is not NULL_TAG_VAL:
-            delta_counter(
+            counters.append(delta_counter(
                 self.reg, "response.completed.aggregated_per_cluster",
-                tags=overall_aggregated_per_cluster_map).inc()
-            self.reg.counter("response.completed.aggregated_per_application",
-                             tags=overall_aggregated_per_application_map).inc()
-
-        # django.server.response.style._id_.make.summary.GET.200.latency.m
-        # django.server.response.style._id_.make.summary.GET.200.cpu_ns.m
-        # django.server.response.style._id_.make.summary.GET.200.total_time.count
-        if hasattr(request, 'wf_start_timestamp'):
-            timestamp_duration = default_timer() - request.wf_start_timestamp
-            cpu_nanos_duration = time.clock() - request.wf_cpu_nanos
-            wavefront_histogram(self.reg, response_metric_key + ".latency",
-                                tags=complete_tags_map).add(timestamp_duration)
-            wavefront_histogram(self.reg, response_metric_key + ".cpu_ns",
-                                tags=complete_tags_map).add(cpu_nanos_duration)
-            self.reg.counter(response_metric_key + ".total_time",
-                             tags=complete_tags_map).inc(timestamp_duration)
-        return response
+                tags=overall_aggregated_per_cluster_map))
+            counters.append(self.reg.counter(
+                "response.completed.aggregated_per_application",
+                tags=overall_aggregated_per_application_map))
+
+        live_latency = None
+        over_slo_counters = []
+        if self.latency_tracker:
+            live_latency = self.latency_tracker.get_route(entity_name, method)
+            if live_latency.slo_ns is not None:
+                # django.request.style._id_.make.GET.over_slo.count
+                # django.requests.over_slo.count
+                over_slo_counters.append(self.reg.counter(
+                    '.'.join((REQUEST_PREFIX, entity_name, method,
+                              'over_slo')),
+                    tags=complete_tags_map))
+                over_slo_counters.append(self.reg.counter(
+                    'requests.over_slo',
+                    tags=overall_aggregated_per_source_map))
+
+        # Every response is counted once, and added to all of its counters
+        # before the registry is reported.
+        return RouteMetrics(
+            responses=self.rollup.counter(
+                (entity_name, method, status, module_name, func_name),
+                counters + error_counters),
+            latency=wavefront_histogram(
+                self.reg, response_metric_key + ".latency",
+                tags=complete_tags_map),
+            cpu_ns=wavefront_histogram(
+                self.reg, response_metric_key + ".cpu_ns",
+                tags=complete_tags_map),
+            total_time=self.reg.counter(response_metric_key + ".total_time",
+                                        tags=complete_tags_map),
+            phases=tuple(
+                wavefront_histogram(
+                    self.reg, '{}.{}_ns'.format(response_metric_key, phase),
+                    tags=complete_tags_map)
+                for phase in PHASES) if self.timing_phases else (),
+            db=tuple(
+                wavefront_histogram(
+                    self.reg, '{}.{}'.format(response_metric_key, name),
+                    tags=complete_tags_map)
+                for name in DB_METRICS) if self.db_instrumentation else (),
+            payload=tuple(
+                wavefront_histogram(
+                    self.reg, '{}.{}'.format(response_metric_key, name),
+                    tags=complete_tags_map)
+                for name in PAYLOAD_METRICS) if self.payload_sizes else (),
+            live_latency=live_latency,
+            over_slo_counters=over_slo_counters)
 
     # pylint: disable=too-many-arguments
     def get_tags_map(self, cluster=None, service=None, shard=None,
@@ -363,45 +769,39 @@ class WavefrontMiddleware(MiddlewareMixin):
         :param request: Http request.
         :return: Entity name.
         """
-        resolver_match = request.resolver_match
-        if resolver_match:
-            entity_name = resolver_match.url_name
-            if not entity_name:
-                entity_name = resolver_match.view_name
-            entity_name = entity_name.replace('-', '_').replace('/', '.'). \
-                replace('{', '_').replace('}', '_')
-        else:
-            entity_name = 'UNKNOWN'
-        return entity_name.lstrip('.').rstrip('.')
+        return get_view_names(request).entity_name
 
     @staticmethod
     def get_metric_name(entity_name, request, response=None):
         """Get metric name.
 
+        Deprecated, the names of the metrics of a route are resolved once
+        and cached with its RouteMetrics.
+
         :param entity_name: Entity Name.
         :param request: Http request.
         :param response: Response obj.
         :return: Metric name.
         """
-        metric_name = [entity_name, request.method]
+        _warn_deprecated('get_metric_name', 'get_route_metrics')
         if response:
-            metric_name.insert(0, RESPONSE_PREFIX)
-            metric_name.append(str(response.status_code))
-        else:
-            metric_name.insert(0, REQUEST_PREFIX)
-        return '.'.join(metric_name)
+            return '.'.join((RESPONSE_PREFIX, entity_name, request.method,
+                             str(response.status_code)))
+        return '.'.join((REQUEST_PREFIX, entity_name, request.method))
 
     @staticmethod
     def get_metric_name_without_status(entity_name, request):
         """Get metric name w/o response.
 
+        Deprecated, see get_metric_name.
+
         :param entity_name: Entity Name.
         :param request: Http request.
         :return: Metric name
         """
-        metric_name = [entity_name, request.method]
-        metric_name.insert(0, REQUEST_PREFIX)
-        return '.'.join(metric_name)
+        _warn_deprecated('get_metric_name_without_status',
+                         'get_route_metrics')
+        return '.'.join((REQUEST_PREFIX, entity_name, request.method))
 
     @staticmethod
     def is_error_status_code(response):
@@ -416,17 +816,112 @@ class WavefrontMiddleware(MiddlewareMixin):
     def update_gauge(registry, key, tags, val):
         """Update gauge value.
 
+        Deprecated, inflight gauges are InflightGauge, which are added to
+        without a lookup in the registry.
+
         :param registry: TaggedRegistry from pyformance.
         :param key: Key of the gauge.
         :param tags: Tags of the gauge.
         :param val: Value of the gauge.
         """
-        gauge = registry.gauge(key=key, tags=tags)
+        _warn_deprecated('update_gauge', 'InflightGauge.add')
+        gauge = registry.gauge(key=key, gauge=InflightGauge(), tags=tags)
+        if isinstance(gauge, InflightGauge):
+            gauge.add(val)
+            return
         cur_val = gauge.get_value()
         if math.isnan(cur_val):
             cur_val = 0
         gauge.set_value(cur_val + val)
 
+    def apply_config(self, config):
+        """Apply the settings which can change while serving requests.
+
+        Reporting, recording and cardinality settings only apply when the
+        middleware is constructed.
+
+        :param config: WavefrontConfig.
+        """
+        self.config = config
+        self.traced_attributes = config.traced_attributes
+        self.tracing._trace_all = config.trace_all
+        self.sampler = self.get_sampler()
+        request_filter = RequestFilter(
+            included_paths=config.included_paths,
+            excluded_paths=config.excluded_paths,
+            included_methods=config.included_methods,
+            excluded_methods=config.excluded_methods,
+            included_routes=config.included_routes,
+            excluded_routes=config.excluded_routes)
+        if request_filter and self._skipped_counter is None:
+            # django.requests.skipped.count
+            self._skipped_counter = self.reg.counter(
+                'requests.skipped', tags=self.get_tags_map(
+                    cluster=self.CLUSTER, service=self.SERVICE,
+                    shard=self.SHARD))
+        self.request_filter = request_filter if request_filter else None
+        if config.trace_http_url and hasattr(self.tracing, 'http_url'):
+            self.tracing.http_url = config.trace_http_url
+
+    def reload_config(self, setting, **kwargs):
+        """Reload the settings when one of them changed, e.g. in tests.
+
+        :param setting: Name of the changed setting.
+        """
+        if setting not in SETTING_NAMES or not self.MIDDLEWARE_ENABLED:
+            return
+        try:
+            self.apply_config(load_config())
+        except ConfigError as e:
+            self.logger.warning(e)
+
+    def get_sampler(self):
+        """Get the trace sampler configured in settings or env.
+
+        :return: TraceSampler, or None to trace every request.
+        """
+        # pylint: disable=import-outside-toplevel
+        from .sampling import get_trace_sampler
+        return get_trace_sampler(self.config)
+
+    def get_latency_tracker(self):
+        """Get the live latency tracker configured in settings or env.
+
+        :return: LatencyTracker, or None if latency is not tracked.
+        """
+        config = self.config
+        if not config.latency_tracking and config.latency_slo is None and \
+                not config.route_latency_slos:
+            return None
+        # pylint: disable=import-outside-toplevel
+        from .slo import LatencyTracker
+        return LatencyTracker(
+            slo=config.latency_slo,
+            route_slos=config.route_latency_slos,
+            window=config.latency_window,
+            max_exemplars=config.slow_exemplars)
+
+    def get_cardinality_limiter(self):
+        """Get the cardinality limiter configured in settings or env.
+
+        :return: CardinalityLimiter.
+        """
+        return CardinalityLimiter(
+            max_routes=self.config.max_routes,
+            max_methods=self.config.max_methods,
+            max_status_codes=self.config.max_status_codes,
+            series_ttl=self.config.metric_series_ttl)
+
+    @staticmethod
+    def get_traced_attributes():
+        """Get request attributes to set as span tags.
+
+        Deprecated, the middleware reads them once into its config.
+        """
+        _warn_deprecated('get_traced_attributes', 'config.traced_attributes')
+        return list(parse_list(get_conf('OPENTRACING_TRACED_ATTRIBUTES')
+                               or ()))
+
     @staticmethod
     def get_conf(key):
         """Get configuration from settings or env.
@@ -434,8 +929,4 @@ class WavefrontMiddleware(MiddlewareMixin):
         :param key: Key of the configuration.
         :return: Value of the configuration.
         """
-        if hasattr(settings, key):
-            return settings.__getattr__(key)
-        if key in os.environ:
-            return os.environ[key]
-        return None
+        return get_conf(key)
@@ -0,0 +1,316 @@
+"""
+Multi-Process Metrics Aggregation.
+
+Pre-fork servers run one WavefrontMiddleware per worker. Instead of every
+worker reporting on its own, workers forward their metrics to a single
+MetricsCollector per host over a unix socket, which merges and reports
+them with one WavefrontReporter and one HeartbeaterService.
+"""
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+
+from pyformance.reporters.reporter import Reporter
+
+from wavefront_pyformance.delta import DeltaCounter, delta_counter
+from wavefront_pyformance.wavefront_histogram import WavefrontHistogram
+
+from wavefront_sdk.common import HeartbeaterService
+from wavefront_sdk.entities.histogram.histogram_impl import Distribution
+
+from .constants import DJANGO_COMPONENT, REPORTER_PREFIX
+from .registry import run_pre_report_hooks
+
+LOGGER = logging.getLogger(__name__)
+
+# Max distributions a worker keeps while the collector is unreachable.
+MAX_PENDING_DISTRIBUTIONS = 10000
+
+
+# pylint: disable=protected-access
+class MetricsForwarder(Reporter):
+    """Periodically forward the metrics of a worker to the collector."""
+
+    def __init__(self, socket_path, registry=None, reporting_interval=10):
+        """Construct Metrics Forwarder.
+
+        :param socket_path: Unix socket the collector listens on.
+        :param registry: TaggedRegistry of the worker.
+        :param reporting_interval: Seconds between two forwards.
+        """
+        super().__init__(registry=registry,
+                         reporting_interval=reporting_interval)
+        self.socket_path = socket_path
+        self._sock = None
+        self._sent_counts = {}
+        self._pending_distributions = {}
+        self._lock = threading.Lock()
+
+    def report_now(self, registry=None, timestamp=None):
+        """Forward metrics changed since the last forward."""
+        self._forward(registry or self.registry, flush_current_hist=False)
+
+    def stop(self):
+        """Forward the remaining metrics and stop forwarding."""
+        super().stop()
+        self._forward(self.registry, flush_current_hist=True)
+        self._close_socket()
+
+    def _forward(self, registry, flush_current_hist):
+        """Send counter increments, gauge values and distributions."""
+        with self._lock:
+            run_pre_report_hooks(registry)
+            counters, delta_counters = self._collect_counters(registry)
+            self._collect_distributions(registry, flush_current_hist)
+            message = {
+                'pid': os.getpid(),
+                'counters': counters,
+                'delta_counters': delta_counters,
+                'gauges': {key: gauge.get_value() for key, gauge in
+                           list(registry._gauges.items())},
+                'histograms': {
+                    key: [[dist.timestamp, dist.centroids]
+                          for dist in dists]
+                    for key, dists in self._pending_distributions.items()},
+            }
+            if not self._send(message):
+                return
+            for key, count in counters.items():
+                self._sent_counts[key] = self._sent_counts.get(key, 0) + count
+            for key, count in delta_counters.items():
+                registry._counters[key].dec(count)
+            self._pending_distributions.clear()
+
+    def _collect_counters(self, registry):
+        """Get increments of counters since the last successful forward."""
+        counters = {}
+        delta_counters = {}
+        for key, counter in list(registry._counters.items()):
+            count = counter.get_count()
+            if isinstance(counter, DeltaCounter):
+                if count:
+                    delta_counters[key] = count
+                continue
+            sent = self._sent_counts.get(key, 0)
+            if count < sent:
+                # The counter was expired and registered again.
+                sent = self._sent_counts[key] = 0
+            inc = count - sent
+            if inc:
+                counters[key] = inc
+        for key in set(self._sent_counts) - set(registry._counters):
+            del self._sent_counts[key]
+        return counters, delta_counters
+
+    def _collect_distributions(self, registry, flush_current_hist):
+        """Move finished minute distributions into the pending ones."""
+        pending = sum(len(dists) for dists in
+                      self._pending_distributions.values())
+        for key, histogram in list(registry._histograms.items()):
+            if not isinstance(histogram, WavefrontHistogram):
+                continue
+            dists = histogram.get_distribution()
+            if flush_current_hist:
+                dists.extend(histogram.get_current_minute_distribution())
+            if pending + len(dists) > MAX_PENDING_DISTRIBUTIONS:
+                LOGGER.warning("Dropping histogram distributions of %s, "
+                               "collector unreachable.", key)
+                continue
+            pending += len(dists)
+            if dists:
+                self._pending_distributions.setdefault(key, []).extend(dists)
+
+    def _send(self, message):
+        """Send a message to the collector, reconnecting if needed."""
+        data = (json.dumps(message) + '\n').encode('utf-8')
+        for _ in range(2):
+            try:
+                if self._sock is None:
+                    self._sock = socket.socket(socket.AF_UNIX,
+                                               socket.SOCK_STREAM)
+                    self._sock.connect(self.socket_path)
+                self._sock.sendall(data)
+                return True
+            except OSError as e:
+                LOGGER.debug("Can not forward metrics to %s: %s",
+                             self.socket_path, e)
+                self._close_socket()
+        return False
+
+    def _close_socket(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+class CollectorHistogram(WavefrontHistogram):
+    """Histogram merging the minute distributions forwarded by workers."""
+
+    def __init__(self):
+        """Construct Collector Histogram."""
+        super().__init__()
+        self._distributions = {}
+        self._dist_lock = threading.Lock()
+
+    def add_distribution(self, timestamp, centroids):
+        """Merge a forwarded minute distribution.
+
+        :param timestamp: Start of the minute in milliseconds.
+        :param centroids: List of (mean, count).
+        """
+        with self._dist_lock:
+            self._distributions.setdefault(timestamp, []).extend(
+                tuple(centroid) for centroid in centroids)
+
+    def get_distribution(self):
+        """Get and clear merged distributions, one per minute."""
+        with self._dist_lock:
+            distributions = [Distribution(timestamp, centroids) for
+                             timestamp, centroids in
+                             sorted(self._distributions.items())]
+            self._distributions.clear()
+        return distributions
+
+    def get_current_minute_distribution(self):
+        """Get nothing, workers only forward finished distributions."""
+        return []
+
+
+# pylint: disable=too-few-public-methods
+class _WorkerGauge:
+    """Gauge summing the last value forwarded by each live worker."""
+
+    def __init__(self):
+        self.values = {}
+
+    def __call__(self):
+        return sum(self.values.values())
+
+
+# pylint: disable=too-many-instance-attributes
+class MetricsCollector:
+    """Merge metrics forwarded by the workers of a host and report them.
+
+    Run one collector per host, e.g. in the gunicorn master process, and
+    point the workers at its socket with WF_COLLECTOR_SOCKET.
+    """
+
+    def __init__(self, socket_path, reporter, application_tags=None,
+                 registry=None):
+        """Construct Metrics Collector.
+
+        :param socket_path: Unix socket to listen on.
+        :param reporter: WavefrontReporter used to report merged metrics.
+        :param application_tags: ApplicationTags, enables the heartbeat.
+        :param registry: TaggedRegistry to merge into, defaults to the
+            reporter registry.
+        """
+        self.socket_path = socket_path
+        self.reporter = reporter
+        self.application_tags = application_tags
+        self.registry = registry or reporter.registry
+        self.reporter.registry = self.registry
+        self.reporter.prefix = REPORTER_PREFIX
+        self.heartbeater_service = None
+        self._worker_gauges = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._server_thread = None
+
+    def start(self, start_reporter=True):
+        """Listen for workers and start reporting.
+
+        :param start_reporter: Start the reporter and heartbeat as well.
+        """
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        collector = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            """Merge every message a worker sends."""
+
+            def handle(self):
+                pid = None
+                try:
+                    for line in self.rfile:
+                        try:
+                            message = json.loads(line.decode('utf-8'))
+                        except ValueError:
+                            LOGGER.warning("Skipping malformed message.")
+                            continue
+                        pid = message.get('pid')
+                        collector.merge(message)
+                finally:
+                    if pid is not None:
+                        collector.remove_worker(pid)
+
+        self._server = socketserver.ThreadingUnixStreamServer(
+            self.socket_path, Handler)
+        self._server.daemon_threads = True
+        self._server_thread = threading.Thread(
+            target=self._server.serve_forever,
+            name='wavefront-django-collector', daemon=True)
+        self._server_thread.start()
+        if start_reporter:
+            self.reporter.start()
+            if self.application_tags is not None:
+                self.heartbeater_service = HeartbeaterService(
+                    wavefront_client=self.reporter.wavefront_client,
+                    application_tags=self.application_tags,
+                    components=DJANGO_COMPONENT,
+                    source=self.reporter.source)
+
+    def stop(self):
+        """Stop listening and flush the merged metrics."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        if self.heartbeater_service is not None:
+            self.heartbeater_service.close()
+            self.heartbeater_service = None
+        if self.reporter.wavefront_client is not None:
+            self.reporter.stop()
+
+    def merge(self, message):
+        """Merge a message forwarded by a worker.
+
+        :param message: Dict of pid, counters, delta_counters, gauges and
+            histograms keyed by encoded metric keys.
+        """
+        registry = self.registry
+        with self._lock:
+            for key, inc in message.get('counters', {}).items():
+                registry.counter(key).inc(inc)
+            for key, inc in message.get('delta_counters', {}).items():
+                delta_counter(registry, key).inc(inc)
+            for key, value in message.get('gauges', {}).items():
+                gauge = self._worker_gauges.get(key)
+                if gauge is None:
+                    gauge = self._worker_gauges[key] = _WorkerGauge()
+                    registry.gauge(key, gauge)
+                gauge.values[message['pid']] = value
+            for key, dists in message.get('histograms', {}).items():
+                histogram = registry._histograms.get(key)
+                if histogram is None:
+                    histogram = CollectorHistogram()
+                    registry.add(key, histogram)
+                elif not isinstance(histogram, CollectorHistogram):
+                    LOGGER.warning("Can not merge histogram %s.", key)
+                    continue
+                for timestamp, centroids in dists:
+                    histogram.add_distribution(timestamp, centroids)
+
+    def remove_worker(self, pid):
+        """Drop the gauge values of a worker which disconnected.
+
+        :param pid: Process id of the worker.
+        """
+        with self._lock:
+            for gauge in self._worker_gauges.values():
+                gauge.values.pop(pid, None)
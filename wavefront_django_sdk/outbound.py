@@ -0,0 +1,219 @@
+"""
+Outbound HTTP Instrumentation.
+
+A pooled requests session which traces every call it makes as a client
+span of the active request span, propagates the tracing context as
+headers and records the latency per downstream host and status code into
+the registry shared with the middleware.
+"""
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+from opentracing.ext import tags
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from wavefront_pyformance.wavefront_histogram import wavefront_histogram
+
+from .config import get_conf, parse_bool
+from .constants import NULL_TAG_VAL, OTHER_BUCKET
+from .inject import get_trace_headers
+from .runtime import get_runtime
+from .timing import NANOS_PER_SECOND, wall_clock_ns
+
+CLIENT_PREFIX = 'client'
+CLIENT_COMPONENT = 'requests'
+ERROR_STATUS = 'error'
+
+_HOST_CHARS = re.compile(r'[^A-Za-z0-9_-]')
+
+
+# pylint: disable=too-many-instance-attributes
+class TracedSession(requests.Session):
+    """Requests session tracing and timing every outbound call.
+
+    Connections are kept alive and reused from a pool per host. Tracing,
+    registry and application tags default to the ones of the middleware,
+    looked up from settings on the first call.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, tracing=None, registry=None, application_tags=None,
+                 pool_connections=10, pool_size=10, pool_block=False,
+                 max_retries=0, max_hosts=100, trace_orphans=False):
+        """Construct Traced Session.
+
+        :param tracing: DjangoTracing, defaults to OPENTRACING_TRACING.
+        :param registry: TaggedRegistry, defaults to the registry shared by
+            the middleware and the task instrumentation.
+        :param application_tags: ApplicationTags, defaults to
+            APPLICATION_TAGS.
+        :param pool_connections: Number of hosts to keep a pool for.
+        :param pool_size: Max connections kept alive per host.
+        :param pool_block: Whether to wait for a free connection instead of
+            opening one more than pool_size.
+        :param max_retries: Retries of failed connections.
+        :param max_hosts: Max distinct hosts with metrics, others are
+            reported as OTHER.
+        :param trace_orphans: Whether to trace calls made without an active
+            span, e.g. of sampled out requests, as root spans.
+        """
+        super().__init__()
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_size, pool_block=pool_block,
+                              max_retries=max_retries)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+        self.tracing = tracing
+        self.registry = registry
+        self.application_tags = application_tags
+        self.max_hosts = max_hosts
+        self.trace_orphans = trace_orphans
+        self.clock = wall_clock_ns
+        self._histograms = {}
+        self._hosts = set()
+        self._lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        """Send a prepared request, tracing and timing it.
+
+        With stream=True the latency covers the call until the response
+        headers are received.
+
+        :param request: PreparedRequest.
+        :return: Response.
+        """
+        span = self._start_span(request)
+        start = self.clock()
+        response = None
+        try:
+            response = super().send(request, **kwargs)
+            return response
+        except Exception as e:
+            if span is not None:
+                span.set_tag(tags.ERROR, 'true')
+                span.log_kv({'event': 'error',
+                             'error.kind': type(e).__name__,
+                             'message': str(e)})
+            raise
+        finally:
+            duration = (self.clock() - start) / NANOS_PER_SECOND
+            status = str(response.status_code) if response is not None \
+                else ERROR_STATUS
+            if span is not None:
+                if response is not None:
+                    span.set_tag(tags.HTTP_STATUS_CODE, response.status_code)
+                    if response.status_code >= 400:
+                        span.set_tag(tags.ERROR, 'true')
+                span.finish()
+            histogram = self.get_latency_histogram(
+                urlsplit(request.url).hostname or NULL_TAG_VAL,
+                request.method, status)
+            if histogram is not None:
+                histogram.add(duration)
+
+    def _start_span(self, request):
+        """Start a client span of a request and inject its context.
+
+        :param request: PreparedRequest.
+        :return: Span, or None if the call is not traced.
+        """
+        tracing = self.get_tracing()
+        if tracing is None:
+            return None
+        parent = tracing.tracer.active_span
+        if parent is None and not self.trace_orphans:
+            return None
+        url = urlsplit(request.url)
+        span_tags = {
+            tags.COMPONENT: CLIENT_COMPONENT,
+            tags.SPAN_KIND: tags.SPAN_KIND_RPC_CLIENT,
+            tags.HTTP_METHOD: request.method,
+            tags.HTTP_URL: '{}://{}{}'.format(url.scheme, url.netloc,
+                                              url.path),
+        }
+        if url.hostname:
+            span_tags[tags.PEER_HOSTNAME] = url.hostname
+        if url.port:
+            span_tags[tags.PEER_PORT] = url.port
+        span = tracing.tracer.start_span(
+            operation_name='http.' + request.method.lower(),
+            child_of=parent, tags=span_tags, start_time=time.time())
+        request.headers.update(get_trace_headers(tracing, span))
+        return span
+
+    def get_latency_histogram(self, host, method, status):
+        """Get the latency histogram of calls to a host.
+
+        :param host: Host name of the call.
+        :param method: HTTP method.
+        :param status: Status code, or 'error' if no response was received.
+        :return: WavefrontHistogram, or None without a registry.
+        """
+        histogram = self._histograms.get((host, method, status))
+        if histogram is not None:
+            return histogram
+        registry = self.get_registry()
+        if registry is None:
+            return None
+        with self._lock:
+            if host not in self._hosts:
+                if len(self._hosts) >= self.max_hosts:
+                    host = OTHER_BUCKET
+                else:
+                    self._hosts.add(host)
+            key = (host, method, status)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # django.client.api_example_com.GET.200.latency.m
+                histogram = wavefront_histogram(
+                    registry,
+                    '.'.join((CLIENT_PREFIX, _HOST_CHARS.sub('_', host),
+                              method, status, 'latency')),
+                    tags=self.get_tags_map(host))
+                self._histograms[key] = histogram
+        return histogram
+
+    def get_tags_map(self, host):
+        """Get tags of the metrics of a host.
+
+        :param host: Host name of the calls.
+        :return: Tags as dict.
+        """
+        tags_map = {'http.host': host}
+        application_tags = self.get_application_tags()
+        if application_tags is not None:
+            tags_map['application'] = application_tags.application \
+                or NULL_TAG_VAL
+            for name in ('cluster', 'service', 'shard'):
+                value = getattr(application_tags, name)
+                if value:
+                    tags_map[name] = value
+        return tags_map
+
+    def get_tracing(self):
+        """Get the tracing of the session, or OPENTRACING_TRACING."""
+        if self.tracing is None:
+            self.tracing = get_conf('OPENTRACING_TRACING')
+        return self.tracing
+
+    def get_registry(self):
+        """Get the registry of the session, or the one of the runtime.
+
+        The middleware and the task instrumentation report the registry of
+        the runtime, also in processes without middleware, e.g. workers.
+        """
+        if self.registry is None:
+            self.registry = get_runtime().get_registry(
+                get_conf('DEBUG_REGISTRY')
+                if parse_bool(get_conf('WF_DEBUG')) else None)
+        return self.registry
+
+    def get_application_tags(self):
+        """Get the application tags of the session, or APPLICATION_TAGS."""
+        if self.application_tags is None:
+            self.application_tags = get_conf('APPLICATION_TAGS')
+        return self.application_tags
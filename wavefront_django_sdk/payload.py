@@ -0,0 +1,149 @@
+"""
+Payload Sizes and Streaming Responses.
+
+Measures request and response bodies in bytes, and follows streaming
+responses until their last byte is sent, as StreamingHttpResponse and
+FileResponse are only iterated by the server after the middleware
+returned them.
+"""
+
+# Histograms of the payload sizes of a response, in bytes.
+PAYLOAD_METRICS = ('request_bytes', 'response_bytes')
+
+
+def get_request_size(request):
+    """Get the size of the body of a request without reading it.
+
+    :param request: incoming HTTP request.
+    :return: Bytes of the body, from Content-Length or the body already
+        read, 0 if unknown.
+    """
+    try:
+        return int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        body = getattr(request, '_body', None)
+        return len(body) if body is not None else 0
+
+
+def get_response_size(response):
+    """Get the size of the content of a response.
+
+    :param response: outgoing response.
+    :return: Bytes of the content, from Content-Length for a streaming
+        response, 0 if unknown.
+    """
+    if not getattr(response, 'streaming', False):
+        return len(response.content)
+    try:
+        return int(response.get('Content-Length') or 0)
+    except ValueError:
+        return 0
+
+
+class StreamedBytes:
+    """Count the bytes of a streaming response as the server sends them."""
+
+    __slots__ = ('_iterator', '_clock', 'size', 'end_ns')
+
+    def __init__(self, iterator, clock):
+        """Construct Streamed Bytes.
+
+        :param iterator: Iterator of the chunks of the response.
+        :param clock: Wall clock in integer nanoseconds.
+        """
+        self._iterator = iterator
+        self._clock = clock
+        self.size = 0
+        self.end_ns = None
+
+    def __iter__(self):
+        """Get the iterator of the chunks."""
+        return self
+
+    def __next__(self):
+        """Get the next chunk, noting the time once there is none left."""
+        try:
+            chunk = next(self._iterator)
+        except StopIteration:
+            self.end_ns = self._clock()
+            raise
+        self.size += len(chunk)
+        return chunk
+
+
+class AsyncStreamedBytes:
+    """Count the bytes of an async streaming response as they are sent."""
+
+    __slots__ = ('_iterator', '_clock', 'size', 'end_ns')
+
+    def __init__(self, iterator, clock):
+        """Construct Async Streamed Bytes.
+
+        :param iterator: Async iterator of the chunks of the response.
+        :param clock: Wall clock in integer nanoseconds.
+        """
+        self._iterator = iterator
+        self._clock = clock
+        self.size = 0
+        self.end_ns = None
+
+    def __aiter__(self):
+        """Get the async iterator of the chunks."""
+        return self
+
+    async def __anext__(self):
+        """Get the next chunk, noting the time once there is none left."""
+        try:
+            chunk = await self._iterator.__anext__()
+        except StopAsyncIteration:
+            self.end_ns = self._clock()
+            raise
+        self.size += len(chunk)
+        return chunk
+
+
+def follow_stream(response, clock, on_close):
+    """Call back once a streaming response is sent and closed.
+
+    The chunks are counted as the server iterates them, except for a
+    FileResponse the server may send with wsgi.file_wrapper, e.g. sendfile,
+    whose size is taken from its Content-Length instead so it is not
+    slowed down.
+
+    :param response: outgoing streaming response.
+    :param clock: Wall clock in integer nanoseconds.
+    :param on_close: Function called with the time the last byte was sent
+        in nanoseconds, or None if unknown, and the bytes sent, when the
+        server closes the response.
+    """
+    if getattr(response, 'file_to_stream', None) is not None:
+        streamed = None
+    elif getattr(response, 'is_async', False):
+        streamed = AsyncStreamedBytes(response.streaming_content, clock)
+        response.streaming_content = streamed
+    else:
+        streamed = StreamedBytes(response.streaming_content, clock)
+        response.streaming_content = streamed
+
+    def close():
+        if streamed is not None:
+            on_close(streamed.end_ns, streamed.size)
+        else:
+            on_close(None, get_response_size(response))
+
+    closers = getattr(response, '_resource_closers', None)
+    if closers is not None:
+        # Called by HttpResponseBase.close(), like the closers of the
+        # content.
+        closers.append(close)
+        return
+    # Django before 3.0 has no resource closers.
+    response_close = response.close
+
+    def close_response():
+        try:
+            close()
+        finally:
+            response_close()
+
+    response.close = close_response
@@ -0,0 +1,166 @@
+"""Response Metric Recorders."""
+import threading
+import weakref
+from collections import deque
+
+from .inflight import ThreadMarker
+from .registry import add_pre_report_hook
+from .timing import NANOS_PER_SECOND
+
+
+# pylint: disable=too-many-arguments
+def add_histograms(route_metrics, latency, cpu_ns, phases, queries, sizes):
+    """Add the durations and sizes of a response to the route histograms.
+
+    :param route_metrics: RouteMetrics of the response.
+    :param latency: Wall time of the request in nanoseconds, or None.
+    :param cpu_ns: CPU time of the request in nanoseconds.
+    :param phases: Tuple of nanoseconds per phase, or None.
+    :param queries: QueryStats of the request, or None.
+    :param sizes: Tuple of bytes per payload metric, or None.
+    """
+    if latency is not None:
+        route_metrics.latency.add(latency / NANOS_PER_SECOND)
+        route_metrics.cpu_ns.add(cpu_ns)
+    if phases is not None:
+        for histogram, duration in zip(route_metrics.phases, phases):
+            histogram.add(duration)
+    if queries is not None and route_metrics.db:
+        for histogram, value in zip(route_metrics.db, queries.get_values()):
+            histogram.add(value)
+        query_histogram = route_metrics.db[-1]
+        for duration in queries.latencies:
+            query_histogram.add(duration)
+    if sizes is not None:
+        for histogram, size in zip(route_metrics.payload, sizes):
+            histogram.add(size)
+
+
+class DirectRecorder:
+    """Record every response straight into the registry metrics."""
+
+    # pylint: disable=too-many-arguments
+    @staticmethod
+    def record(route_metrics, latency=None, cpu_ns=None, phases=None,
+               queries=None, sizes=None):
+        """Record a response of a route.
+
+        :param route_metrics: RouteMetrics of the response.
+        :param latency: Wall time of the request in nanoseconds, None if
+            unknown.
+        :param cpu_ns: CPU time of the request in nanoseconds.
+        :param phases: Tuple of nanoseconds per phase, None if not timed.
+        :param queries: QueryStats of the request, None if not collected.
+        :param sizes: Tuple of bytes per payload metric, None if not
+            measured.
+        """
+        route_metrics.responses.inc()
+        if latency is not None:
+            route_metrics.total_time.inc(latency / NANOS_PER_SECOND)
+        add_histograms(route_metrics, latency, cpu_ns, phases, queries,
+                       sizes)
+
+    def merge(self):
+        """Nothing to merge, responses are recorded immediately."""
+
+
+class BufferedRecorder:
+    """Buffer responses per thread and merge them before each report.
+
+    The request thread only appends a (route_metrics, latency, cpu_ns,
+    phases, queries, sizes) record to its own buffer. Buffers are folded into
+    the registry metrics right before the reporter reads the registry, or by
+    the request thread itself once its buffer is full.
+    """
+
+    def __init__(self, registry=None, max_buffer_size=1000):
+        """Construct Buffered Recorder.
+
+        :param registry: Registry to merge into before it is reported, and
+            once the recorder is garbage collected.
+        :param max_buffer_size: Max records a thread buffers before merging.
+        """
+        if max_buffer_size <= 0:
+            raise ValueError("max_buffer_size must be positive")
+        self.max_buffer_size = max_buffer_size
+        self._local = threading.local()
+        self._buffers = []
+        self._lock = threading.Lock()
+        if registry is not None:
+            add_pre_report_hook(registry, self.merge)
+            weakref.finalize(self, self._merge_buffers, self._buffers)
+
+    # pylint: disable=too-many-arguments
+    def record(self, route_metrics, latency=None, cpu_ns=None, phases=None,
+               queries=None, sizes=None):
+        """Buffer a response of a route.
+
+        :param route_metrics: RouteMetrics of the response.
+        :param latency: Wall time of the request in nanoseconds, None if
+            unknown.
+        :param cpu_ns: CPU time of the request in nanoseconds.
+        :param phases: Tuple of nanoseconds per phase, None if not timed.
+        :param queries: QueryStats of the request, None if not collected.
+        :param sizes: Tuple of bytes per payload metric, None if not
+            measured.
+        """
+        try:
+            buffer = self._local.buffer
+        except AttributeError:
+            buffer = self._new_buffer()
+        buffer.append((route_metrics, latency, cpu_ns, phases, queries,
+                       sizes))
+        if len(buffer) >= self.max_buffer_size:
+            self._merge_buffer(buffer)
+
+    def merge(self):
+        """Fold the buffers of all threads into the registry metrics."""
+        with self._lock:
+            live_buffers = []
+            for marker, buffer in self._buffers:
+                self._merge_buffer(buffer)
+                if marker() is not None:
+                    live_buffers.append((marker, buffer))
+            self._buffers[:] = live_buffers
+
+    @classmethod
+    def _merge_buffers(cls, buffers):
+        """Fold a list of (thread marker, buffer) into the registry."""
+        for _, buffer in buffers:
+            cls._merge_buffer(buffer)
+
+    @staticmethod
+    def _merge_buffer(buffer):
+        """Fold the records of a buffer into the registry metrics.
+
+        Responses of a route are counted once per merge.
+        """
+        counter_incs = {}
+        total_time_incs = {}
+        while True:
+            try:
+                route_metrics, latency, cpu_ns, phases, queries, sizes = \
+                    buffer.popleft()
+            except IndexError:
+                break
+            counter = route_metrics.responses
+            counter_incs[counter] = counter_incs.get(counter, 0) + 1
+            if latency is not None:
+                total_time_incs[route_metrics.total_time] = \
+                    total_time_incs.get(route_metrics.total_time, 0) + latency
+            add_histograms(route_metrics, latency, cpu_ns, phases, queries,
+                           sizes)
+        for counter, val in counter_incs.items():
+            counter.inc(val)
+        for counter, val in total_time_incs.items():
+            counter.inc(val / NANOS_PER_SECOND)
+
+    def _new_buffer(self):
+        """Register a buffer for the current thread."""
+        buffer = deque()
+        marker = ThreadMarker()
+        with self._lock:
+            self._buffers.append((weakref.ref(marker), buffer))
+        self._local.marker = marker
+        self._local.buffer = buffer
+        return buffer
@@ -0,0 +1,52 @@
+"""Registry Helpers."""
+import inspect
+import weakref
+
+
+def add_pre_report_hook(registry, hook):
+    """Call a hook every time the metrics of the registry are dumped.
+
+    WavefrontReporter reads the registry through dump_metrics() on every
+    flush, so the hook runs right before each report. Bound methods are
+    held weakly, so the hook goes away with its object, e.g. a middleware
+    replaced after the settings changed.
+
+    :param registry: TaggedRegistry from pyformance.
+    :param hook: Callable without arguments.
+    """
+    hooks = getattr(registry, '_wf_pre_report_hooks', None)
+    if hooks is None:
+        hooks = registry._wf_pre_report_hooks = []
+        dump_metrics = registry.dump_metrics
+
+        def dump_metrics_with_hooks():
+            run_pre_report_hooks(registry)
+            return dump_metrics()
+
+        registry.dump_metrics = dump_metrics_with_hooks
+    if inspect.ismethod(hook):
+        hooks.append(weakref.WeakMethod(hook))
+    else:
+        hooks.append(lambda: hook)
+
+
+def run_pre_report_hooks(registry):
+    """Run the pre-report hooks of a registry without dumping its metrics.
+
+    :param registry: TaggedRegistry from pyformance.
+    """
+    hooks = getattr(registry, '_wf_pre_report_hooks', None)
+    if not hooks:
+        return
+    dead = []
+    for ref in list(hooks):
+        hook = ref()
+        if hook is None:
+            dead.append(ref)
+        else:
+            hook()
+    for ref in dead:
+        try:
+            hooks.remove(ref)
+        except ValueError:
+            pass  # Removed by a concurrent run.
@@ -0,0 +1,58 @@
+"""Resolved View Names."""
+from collections import namedtuple
+
+from .constants import UNKNOWN_ENTITY_NAME
+
+
+ViewNames = namedtuple('ViewNames', ['entity_name', 'module_name',
+                                     'func_name'])
+
+UNKNOWN_VIEW_NAMES = ViewNames(UNKNOWN_ENTITY_NAME, None, None)
+
+# Derived names per (view function, view name), bounded by the URLconf.
+_view_names_cache = {}
+
+
+def get_view_names(request):
+    """Get entity, module and func names of the view serving the request.
+
+    Reuses the ResolverMatch Django stores on the request instead of walking
+    the URL resolver again, so unresolvable paths (e.g. 404) get
+    UNKNOWN_VIEW_NAMES.
+
+    :param request: Http request.
+    :return: ViewNames of the request.
+    """
+    resolver_match = getattr(request, 'resolver_match', None)
+    if resolver_match is None:
+        return UNKNOWN_VIEW_NAMES
+    key = (resolver_match.func, resolver_match.view_name)
+    view_names = _view_names_cache.get(key)
+    if view_names is None:
+        view_names = _derive_view_names(resolver_match)
+        _view_names_cache[key] = view_names
+    return view_names
+
+
+def get_entity_name(resolver_match):
+    """Get entity name from the resolver match.
+
+    :param resolver_match: ResolverMatch of the request.
+    :return: Entity name.
+    """
+    if not resolver_match:
+        return UNKNOWN_ENTITY_NAME
+    entity_name = resolver_match.url_name
+    if not entity_name:
+        entity_name = resolver_match.view_name
+    entity_name = entity_name.replace('-', '_').replace('/', '.'). \
+        replace('{', '_').replace('}', '_')
+    return entity_name.lstrip('.').rstrip('.')
+
+
+def _derive_view_names(resolver_match):
+    func = resolver_match.func
+    return ViewNames(
+        entity_name=get_entity_name(resolver_match),
+        module_name=getattr(func, '__module__', None),
+        func_name=getattr(func, '__name__', type(func).__name__))
@@ -0,0 +1,101 @@
+"""
+Hierarchical Response Counters.
+
+Every response of a route counts towards up to seventeen registry
+counters: the route itself aggregated per source, shard, service, cluster
+and application, and the overall completed and error responses at the
+same levels. A RollupCounter counts the responses of a route once, at
+the finest granularity, and adds them to all of those counters right
+before the registry is reported, so the reported metrics don't change.
+"""
+import threading
+import weakref
+
+from .registry import add_pre_report_hook
+
+
+class RollupCounter:
+    """Count the responses of a route for its derived counters."""
+
+    __slots__ = ('targets', 'count', '_lock')
+
+    def __init__(self, targets):
+        """Construct Rollup Counter.
+
+        :param targets: Registry counters every response is added to.
+        """
+        self.targets = tuple(targets)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def inc(self, val=1):
+        """Count responses.
+
+        :param val: Number of responses.
+        """
+        with self._lock:
+            self.count += val
+
+    def flush(self):
+        """Add the responses counted since the last flush to the targets."""
+        with self._lock:
+            count = self.count
+            self.count = 0
+        if count:
+            for target in self.targets:
+                target.inc(count)
+
+
+class CounterRollup:
+    """Rollup counters of a registry, flushed before every report."""
+
+    def __init__(self, registry=None):
+        """Construct Counter Rollup.
+
+        :param registry: Registry to flush into before it is reported, and
+            once the rollup is garbage collected.
+        """
+        self._counters = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            add_pre_report_hook(registry, self.flush)
+            weakref.finalize(self, self._flush_counters, self._counters)
+
+    def __len__(self):
+        """Get number of rollup counters."""
+        return len(self._counters)
+
+    def counter(self, key, targets):
+        """Get the rollup counter of a route, creating it if needed.
+
+        :param key: Route key, e.g. (url_name, method, status, module, func).
+        :param targets: Registry counters of the route, used on creation.
+        :return: RollupCounter.
+        """
+        counter = self._counters.get(key)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.get(key)
+                if counter is None:
+                    counter = self._counters[key] = RollupCounter(targets)
+        return counter
+
+    def pop(self, key):
+        """Drop the rollup counter of a route, flushing it first.
+
+        :param key: Route key.
+        """
+        with self._lock:
+            counter = self._counters.pop(key, None)
+        if counter is not None:
+            counter.flush()
+
+    def flush(self):
+        """Add the responses counted so far to the registry counters."""
+        self._flush_counters(self._counters)
+
+    @staticmethod
+    def _flush_counters(counters):
+        """Flush a dict of rollup counters."""
+        for counter in list(counters.values()):
+            counter.flush()
@@ -0,0 +1,463 @@
+"""
+Reporting Runtime.
+
+Owns the registry and the background reporting of a process, shared by
+every middleware instance. Reporting is started once per process, by
+default on its first request, so nothing runs before a pre-fork server
+forks its workers, and every worker starts its own threads. It is stopped
+deterministically: at exit, on SIGTERM or from the worker exit hooks of
+gunicorn and uWSGI, with a final flush of metrics, histograms and spans
+bounded in time.
+"""
+import atexit
+import functools
+import logging
+import os
+import signal
+import threading
+from queue import Empty
+
+from wavefront_pyformance.tagged_registry import TaggedRegistry
+
+from .constants import DJANGO_COMPONENT
+
+LOGGER = logging.getLogger(__name__)
+
+_runtime = None  # pylint: disable=invalid-name
+_runtime_lock = threading.Lock()
+
+
+def get_wavefront_span_reporter(tracer):
+    """Get the WavefrontSpanReporter of a Wavefront tracer.
+
+    :param tracer: OpenTracing tracer.
+    :return: WavefrontSpanReporter, or None for other tracers.
+    """
+    get_span_reporter = getattr(tracer, 'get_wavefront_span_reporter', None)
+    if get_span_reporter is None:
+        return None
+    return get_span_reporter(getattr(tracer, '_reporter', None))
+
+
+# pylint: disable=too-many-instance-attributes
+class ReporterRuntime:
+    """Background reporting of a process, started once and stopped once."""
+
+    def __init__(self):
+        """Construct Reporter Runtime."""
+        self.pid = os.getpid()
+        self.config = None
+        self.registry = None
+        self.reporter = None
+        self.tracer = None
+        self.forwarder = None
+        self.heartbeater_service = None
+        self.sdk_metrics_registry = None
+        self.queued_senders = []
+        self.gauges = {}
+        self.shutdown_timeout = 5.0
+        self.started = False
+        self.stopped = False
+        self.forked = False
+        self._reporting = False
+        # (reporter, attribute, client) of every client replaced.
+        self._wrapped = []
+        self._startup_thread = None
+        self._lock = threading.RLock()
+
+    def get_registry(self, registry=None):
+        """Get the registry shared by every middleware instance.
+
+        :param registry: Registry to use if none is set yet, e.g.
+            DEBUG_REGISTRY. Defaults to a new TaggedRegistry.
+        :return: TaggedRegistry.
+        """
+        with self._lock:
+            if self.registry is None:
+                self.registry = registry or TaggedRegistry()
+            return self.registry
+
+    def prepare(self, config, tracing):
+        """Set what to report, unless already set in this process.
+
+        Only installs the shutdown hooks, nothing is started yet.
+
+        :param config: WavefrontConfig.
+        :param tracing: DjangoTracing.
+        :return: True if set by this call.
+        """
+        with self._lock:
+            if self.config is not None:
+                return False
+            self.config = config
+            self.reporter = config.reporter
+            self.tracer = tracing.tracer
+            self.shutdown_timeout = config.shutdown_timeout
+            self._install_hooks()
+            return True
+
+    def add_gauge(self, name, supplier):
+        """Report an internal gauge once reporting is started.
+
+        :param name: Name of the gauge, the last one added wins, so a
+            middleware constructed again, e.g. by override_settings, reports
+            its own state.
+        :param supplier: Function returning the value of the gauge.
+        """
+        with self._lock:
+            added = name in self.gauges
+            self.gauges[name] = supplier
+            if self.sdk_metrics_registry is not None and not added:
+                self.sdk_metrics_registry.new_gauge(
+                    name, functools.partial(self._read_gauge, name))
+
+    def _read_gauge(self, name):
+        """Get the value of an internal gauge from its latest supplier."""
+        return self.gauges[name]()
+
+    def start(self, background=False):
+        """Start reporting, unless already started in this process.
+
+        :param background: Whether to start from a new thread, so the
+            caller, e.g. the first request, does not wait for the first
+            heartbeat to be sent.
+        :return: True if reporting was started by this call.
+        """
+        if self.pid != os.getpid():
+            # Forked without os.register_at_fork, i.e. before Python 3.7.
+            self.after_fork()
+        with self._lock:
+            if self.started or self.config is None:
+                return False
+            self.started = True
+            config = self.config
+            if config.capture_file and not config.collector_socket and \
+                    not config.disable_reporting:
+                # Before anything is reported, spans included.
+                self._capture_senders()
+            if not background:
+                self._start_reporting()
+                return True
+            self._startup_thread = threading.Thread(
+                target=self._start_reporting,
+                name='wavefront-django-startup')
+            self._startup_thread.daemon = True
+            self._startup_thread.start()
+            return True
+
+    def shutdown(self, timeout_secs=None):
+        """Flush and stop reporting, once, within a time limit.
+
+        Safe to call from any hook, only the first call in the process
+        which started reporting does anything.
+
+        :param timeout_secs: Max seconds to wait for the final flush,
+            defaults to WF_SHUTDOWN_TIMEOUT.
+        """
+        with self._lock:
+            if not self.started or self.stopped or \
+                    self.pid != os.getpid():
+                return
+            self.stopped = True
+        if timeout_secs is None:
+            timeout_secs = self.shutdown_timeout
+        thread = threading.Thread(target=self._stop_reporting,
+                                  name='wavefront-django-shutdown')
+        thread.daemon = True
+        thread.start()
+        thread.join(timeout_secs)
+        if thread.is_alive():
+            LOGGER.warning("Wavefront reporting not flushed within %ss, "
+                           "the rest is dropped.", timeout_secs)
+
+    # pylint: disable=broad-except, import-outside-toplevel
+    def _start_reporting(self):
+        """Start the background threads reporting the registry.
+
+        What only reporting needs is imported here, so importing and
+        constructing the middleware stays cheap.
+        """
+        from wavefront_sdk.common import HeartbeaterService
+        from wavefront_sdk.common.constants import SDK_METRIC_PREFIX
+        from wavefront_sdk.common.metrics.registry import \
+            WavefrontSdkMetricsRegistry
+        from wavefront_sdk.common.utils import get_sem_ver
+
+        config = self.config
+        try:
+            if self.forked:
+                self._restart_tracer_threads()
+            if config.collector_socket:
+                from .multiprocess import MetricsForwarder
+                self.forwarder = MetricsForwarder(
+                    config.collector_socket, self.get_registry(),
+                    config.collector_interval)
+                self.forwarder.start()
+            elif not config.disable_reporting:
+                if config.reporting_queue:
+                    self._queue_senders()
+                self.reporter.start()
+                self._reporting = True
+                self.heartbeater_service = HeartbeaterService(
+                    wavefront_client=self.reporter.wavefront_client,
+                    application_tags=config.application_tags,
+                    components=DJANGO_COMPONENT,
+                    source=self.reporter.source)
+            # Report internal metrics with prefix ~sdk.python.django.sender
+            if config.enable_internal_report and not self.forwarder:
+                sdk_metrics_registry = WavefrontSdkMetricsRegistry(
+                    wf_metric_sender=self.reporter.wavefront_client,
+                    source=self.reporter.source,
+                    tags=dict(config.application_tags.get_as_list()),
+                    prefix='{}.django'.format(SDK_METRIC_PREFIX))
+                sdk_metrics_registry.new_gauge(
+                    'version',
+                    lambda: get_sem_ver('wavefront-django-sdk-python'))
+                if self.queued_senders:
+                    self._register_sender_gauges(sdk_metrics_registry)
+                with self._lock:
+                    for name in self.gauges:
+                        sdk_metrics_registry.new_gauge(
+                            name, functools.partial(self._read_gauge, name))
+                    self.sdk_metrics_registry = sdk_metrics_registry
+        except Exception as e:
+            LOGGER.warning("Failed to start Wavefront reporting: %s", e)
+
+    # pylint: disable=protected-access
+    def _restart_tracer_threads(self):
+        """Restart the threads a Wavefront tracer started before a fork.
+
+        The tracer is usually created in settings, so a forked worker
+        inherits its span reporter, internal reporters and heartbeater
+        without the threads running them.
+        """
+        span_reporter = get_wavefront_span_reporter(self.tracer)
+        if span_reporter is not None and not span_reporter._stop and \
+                not span_reporter.sending_thread.is_alive():
+            span_reporter.sending_thread = threading.Thread(
+                target=span_reporter.run, name='wavefront_span_reporter')
+            span_reporter.sending_thread.daemon = True
+            span_reporter.sending_thread.start()
+        for name in ('wf_internal_reporter', 'wf_derived_reporter'):
+            tracer_reporter = getattr(self.tracer, name, None)
+            if tracer_reporter is not None:
+                tracer_reporter.start()
+        heartbeater = getattr(self.tracer, 'heartbeater_service', None)
+        if heartbeater is not None and not heartbeater._closed:
+            heartbeater._run()
+
+    def after_fork(self):
+        """Forget the reporting of the parent in a forked child.
+
+        Keeps the settings and the registry, the threads of the parent
+        don't run in the child, so reporting starts over.
+        """
+        self.pid = os.getpid()
+        self._lock = threading.RLock()
+        for reporter, attr, client in reversed(self._wrapped):
+            setattr(reporter, attr, client)
+        self._wrapped = []
+        self.queued_senders = []
+        self.forwarder = None
+        self.heartbeater_service = None
+        self.sdk_metrics_registry = None
+        self._startup_thread = None
+        self._reporting = False
+        self.started = False
+        self.stopped = False
+        self.forked = True
+
+    # pylint: disable=broad-except, protected-access
+    def _stop_reporting(self):
+        """Flush everything and stop the background threads.
+
+        Every step runs even if an earlier one failed. Buffered spans are
+        handed to their client before the reporter of the middleware stops,
+        as it closes the client they usually share.
+        """
+        if self._startup_thread is not None:
+            self._startup_thread.join()
+        span_reporter = get_wavefront_span_reporter(self.tracer)
+        steps = []
+        if self.forwarder is not None:
+            steps.append(self.forwarder.stop)
+        if span_reporter is not None:
+            steps.append(lambda: self._drain_spans(span_reporter))
+        if self.sdk_metrics_registry is not None:
+            steps.append(lambda: self.sdk_metrics_registry.close(
+                timeout_secs=1))
+        if self._reporting:
+            steps.append(self.reporter.stop)
+        for name in ('wf_derived_reporter', 'wf_internal_reporter'):
+            tracer_reporter = getattr(self.tracer, name, None)
+            if tracer_reporter is not None:
+                steps.append(tracer_reporter.stop)
+        for heartbeater in (self.heartbeater_service,
+                            getattr(self.tracer, 'heartbeater_service',
+                                    None)):
+            if heartbeater is not None:
+                steps.append(heartbeater.close)
+        for step in steps:
+            try:
+                step()
+            except Exception as e:
+                LOGGER.warning("Failed to stop Wavefront reporting: %s", e)
+
+    @staticmethod
+    def _drain_spans(span_reporter):
+        """Send the spans still buffered by a WavefrontSpanReporter."""
+        while True:
+            try:
+                span = span_reporter._span_buffer.get_nowait()
+            except Empty:
+                return
+            span_reporter.send(span)
+
+    # pylint: disable=import-outside-toplevel
+    def _queue_senders(self):
+        """Hand off metrics and spans to queued senders.
+
+        Wraps the client of WF_REPORTER, and the client of the span reporter
+        of a Wavefront tracer, so reporting never waits on the network.
+        """
+        from .sender import QueuedSender
+
+        config = self.config
+        clients = {}
+        reporters = [(self.reporter, 'wavefront_client')]
+        span_reporter = get_wavefront_span_reporter(self.tracer)
+        if span_reporter is not None:
+            reporters.append((span_reporter, 'sender'))
+        for reporter, attr in reporters:
+            client = getattr(reporter, attr)
+            if isinstance(client, QueuedSender):
+                continue
+            if id(client) not in clients:
+                clients[id(client)] = QueuedSender(
+                    client, max_queue_size=config.reporting_queue_size,
+                    batch_size=config.reporting_batch_size,
+                    max_backoff=config.reporting_max_backoff)
+                self.queued_senders.append(clients[id(client)])
+            setattr(reporter, attr, clients[id(client)])
+            self._wrapped.append((reporter, attr, client))
+
+    # pylint: disable=import-outside-toplevel
+    def _capture_senders(self):
+        """Capture metrics and spans to WF_CAPTURE_FILE instead.
+
+        Replaces the client of WF_REPORTER, and the clients of the span
+        reporter, the internal reporters and the heartbeater of a Wavefront
+        tracer, with a single CaptureClient.
+        """
+        from .capture import CaptureClient
+
+        try:
+            capture_client = CaptureClient(self.config.capture_file)
+        except OSError as e:
+            LOGGER.warning("Failed to open WF_CAPTURE_FILE: %s", e)
+            return
+        reporters = [(self.reporter, 'wavefront_client')]
+        span_reporter = get_wavefront_span_reporter(self.tracer)
+        if span_reporter is not None:
+            reporters.append((span_reporter, 'sender'))
+        for name in ('wf_internal_reporter', 'wf_derived_reporter'):
+            tracer_reporter = getattr(self.tracer, name, None)
+            if tracer_reporter is not None:
+                reporters.append((tracer_reporter, 'wavefront_client'))
+        heartbeater = getattr(self.tracer, 'heartbeater_service', None)
+        if heartbeater is not None:
+            reporters.append((heartbeater, 'wavefront_client'))
+        for reporter, attr in reporters:
+            self._wrapped.append((reporter, attr, getattr(reporter, attr)))
+            setattr(reporter, attr, capture_client)
+        LOGGER.info("Capturing Wavefront metrics and spans to %s.",
+                    capture_client.path)
+
+    # pylint: disable=import-outside-toplevel
+    def _register_sender_gauges(self, sdk_metrics_registry):
+        """Report queue size, errors and drops of the queued senders."""
+        from .sender import KINDS
+
+        senders = self.queued_senders
+        sdk_metrics_registry.new_gauge(
+            'reporting.queue.size',
+            lambda: sum(sender.get_queue_size() for sender in senders))
+        sdk_metrics_registry.new_gauge(
+            'reporting.errors',
+            lambda: sum(sender.errors for sender in senders))
+        for kind in KINDS:
+            sdk_metrics_registry.new_gauge(
+                'reporting.{}.dropped'.format(kind),
+                lambda kind=kind: sum(sender.get_dropped_count(kind)
+                                      for sender in senders))
+
+    def _install_hooks(self):
+        """Shut down at exit, on SIGTERM and on uWSGI worker exit."""
+        atexit.register(self.shutdown)
+        try:
+            import uwsgi  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            uwsgi = None
+        if uwsgi is not None:
+            previous = getattr(uwsgi, 'atexit', None)
+
+            def uwsgi_atexit():
+                self.shutdown()
+                if previous is not None:
+                    previous()
+            uwsgi.atexit = uwsgi_atexit
+        # Servers installing their own SIGTERM handler shut down through
+        # their exit hooks instead.
+        if threading.current_thread() is threading.main_thread() and \
+                signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+            signal.signal(signal.SIGTERM, self._handle_sigterm)
+
+    def _handle_sigterm(self, signum, frame):  # pylint: disable=W0613
+        """Shut down, then terminate as SIGTERM would have."""
+        self.shutdown()
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+
+def get_runtime():
+    """Get the ReporterRuntime of the current process."""
+    global _runtime  # pylint: disable=global-statement
+    with _runtime_lock:
+        if _runtime is None:
+            _runtime = ReporterRuntime()
+        return _runtime
+
+
+def _after_fork_in_child():
+    """Reset the runtime inherited by a forked child in place.
+
+    Middleware constructed before the fork keeps using it, and starts
+    reporting in the child on its first request.
+    """
+    global _runtime_lock  # pylint: disable=global-statement, invalid-name
+    _runtime_lock = threading.Lock()
+    if _runtime is not None:
+        _runtime.after_fork()
+
+
+def shutdown(timeout_secs=None):
+    """Flush and stop the reporting of the current process.
+
+    :param timeout_secs: Max seconds to wait for the final flush,
+        defaults to WF_SHUTDOWN_TIMEOUT.
+    """
+    if _runtime is not None:
+        _runtime.shutdown(timeout_secs)
+
+
+def worker_exit(server, worker):  # pylint: disable=unused-argument
+    """Gunicorn worker_exit hook flushing the reporting of the worker.
+
+    Use in gunicorn.conf.py as
+    ``from wavefront_django_sdk.runtime import worker_exit``.
+    """
+    shutdown()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,108 @@
+"""Trace Sampling."""
+import random
+import threading
+import time
+
+
+# pylint: disable=too-few-public-methods
+class TokenBucket:
+    """Token bucket capping the number of spans per second."""
+
+    def __init__(self, rate, capacity=None):
+        """Construct Token Bucket.
+
+        :param rate: Tokens added per second.
+        :param capacity: Max tokens, defaults to one second worth of tokens.
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self):
+        """Take a token if one is available.
+
+        :return: True if a token was taken.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class TraceSampler:
+    """Head-based trace sampler.
+
+    Decides in process_view whether a request is traced, before any span
+    work happens. Requests sampled out can still be kept once they complete
+    if they failed or were slow.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, rate=1.0, route_rates=None, max_spans_per_second=None,
+                 keep_errors=True, slow_threshold=None):
+        """Construct Trace Sampler.
+
+        :param rate: Probability in [0, 1] to trace a request.
+        :param route_rates: Dict of entity name to rate, overriding rate.
+        :param max_spans_per_second: Cap of head-sampled spans per second.
+        :param keep_errors: Trace sampled out requests with error responses.
+        :param slow_threshold: Trace sampled out requests slower than this
+            many seconds.
+        """
+        self.rate = float(rate)
+        self.route_rates = {name: float(route_rate) for name, route_rate in
+                            (route_rates or {}).items()}
+        self.bucket = TokenBucket(max_spans_per_second) \
+            if max_spans_per_second else None
+        self.keep_errors = keep_errors
+        self.slow_threshold = slow_threshold
+
+    def sample(self, entity_name):
+        """Decide whether to trace a request before it is served.
+
+        :param entity_name: Entity name of the route.
+        :return: True if the request should be traced.
+        """
+        rate = self.route_rates.get(entity_name, self.rate)
+        sampled = rate >= 1 or (rate > 0 and random.random() < rate)
+        if sampled and self.bucket is not None:
+            sampled = self.bucket.consume()
+        return sampled
+
+    def keep(self, response, duration):
+        """Decide whether to trace a sampled out request after it completed.
+
+        :param response: Response obj.
+        :param duration: Wall time of the request in seconds, or None.
+        :return: True if the request should be traced anyway.
+        """
+        if self.keep_errors and 400 <= response.status_code <= 599:
+            return True
+        return self.slow_threshold is not None and duration is not None \
+            and duration >= self.slow_threshold
+
+
+def get_trace_sampler(config):
+    """Get the trace sampler configured in settings or env.
+
+    :param config: WavefrontConfig.
+    :return: TraceSampler, or None to trace everything.
+    """
+    if config.trace_sample_rate is None and \
+            not config.trace_route_sample_rates and \
+            not config.trace_max_spans_per_second:
+        return None
+    return TraceSampler(
+        rate=config.trace_sample_rate
+        if config.trace_sample_rate is not None else 1.0,
+        route_rates=config.trace_route_sample_rates,
+        max_spans_per_second=config.trace_max_spans_per_second,
+        keep_errors=config.trace_keep_errors,
+        slow_threshold=config.trace_slow_threshold)
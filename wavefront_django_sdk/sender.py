@@ -0,0 +1,311 @@
+"""
+Queued Wavefront Sender.
+
+Hands everything the metrics and span reporters send off to a bounded
+queue drained by a background thread, so no reporter ever waits on the
+network and a slow or unreachable proxy costs dropped data instead of
+memory or blocked threads.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+METRICS = 'metrics'
+DISTRIBUTIONS = 'distributions'
+SPANS = 'spans'
+EVENTS = 'events'
+KINDS = (METRICS, DISTRIBUTIONS, SPANS, EVENTS)
+
+LOGGER = logging.getLogger(__name__)
+
+
+# pylint: disable=too-many-instance-attributes
+class QueuedSender:
+    """Wavefront sender queueing data for a wrapped sender.
+
+    Metrics sent again while still queued are coalesced, delta counters
+    by adding them up and other metrics by keeping the latest value, so a
+    backlog never holds more than one point per series. Everything else is
+    queued as is. Data which does not fit in the queue is dropped and
+    counted. Failed batches are retried with exponential backoff. Once
+    closed, data is sent straight to the wrapped sender, as other reporters
+    sharing it may still flush while shutting down.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, sender, max_queue_size=50000, batch_size=1000,
+                 flush_interval=1.0, initial_backoff=0.1, max_backoff=60.0):
+        """Construct Queued Sender.
+
+        :param sender: Wavefront client to send with, e.g.
+            WavefrontProxyClient.
+        :param max_queue_size: Max points, distributions, spans and events
+            queued.
+        :param batch_size: Max entries sent before the wrapped sender is
+            flushed and the queue is locked again.
+        :param flush_interval: Seconds between flushes of the queue.
+        :param initial_backoff: Seconds to wait after the first failure.
+        :param max_backoff: Max seconds to wait between retries.
+        """
+        if max_queue_size <= 0 or batch_size <= 0:
+            raise ValueError("max_queue_size and batch_size must be "
+                             "positive")
+        self.sender = sender
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.backoff = 0
+        self.errors = 0
+        self.dropped = dict.fromkeys(KINDS, 0)
+        self._metrics = OrderedDict()
+        self._entries = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closing = threading.Event()
+        self._closed = False
+        self._deadline = None
+        self._thread = threading.Thread(target=self._run,
+                                        name='wavefront-django-sender')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def send_metric(self, name, value, timestamp, source, tags):
+        """Queue a metric point, replacing a queued point of its series."""
+        if timestamp is None:
+            timestamp = int(time.time())
+        self._put_metric(False, name, value, timestamp, source, tags)
+
+    def send_delta_counter(self, name, value, source, tags, timestamp=None):
+        """Queue a delta counter, adding to a queued delta of its series."""
+        self._put_metric(True, name, value, timestamp, source, tags)
+
+    # pylint: disable=too-many-arguments
+    def send_distribution(self, name, centroids, histogram_granularities,
+                          timestamp, source, tags):
+        """Queue a distribution."""
+        self._put(DISTRIBUTIONS, 'send_distribution',
+                  (name, centroids, set(histogram_granularities), timestamp,
+                   source, tags))
+
+    # pylint: disable=too-many-arguments
+    def send_span(self, name, start_millis, duration_millis, source, trace_id,
+                  span_id, parents, follows_from, tags, span_logs):
+        """Queue a span."""
+        self._put(SPANS, 'send_span',
+                  (name, start_millis, duration_millis, source, trace_id,
+                   span_id, parents, follows_from, tags, span_logs))
+
+    # pylint: disable=too-many-arguments
+    def send_event(self, name, start_time, end_time, source, tags,
+                   annotations):
+        """Queue an event."""
+        self._put(EVENTS, 'send_event',
+                  (name, start_time, end_time, source, tags, annotations))
+
+    def get_queue_size(self):
+        """Get number of queued entries."""
+        return len(self._metrics) + len(self._entries)
+
+    def get_dropped_count(self, kind):
+        """Get number of entries of a kind dropped so far.
+
+        :param kind: One of KINDS.
+        """
+        return self.dropped[kind]
+
+    def get_failure_count(self):
+        """Get number of failed sends, of this and the wrapped sender."""
+        failure_count = getattr(self.sender, 'get_failure_count', None)
+        return self.errors + (failure_count() if failure_count else 0)
+
+    def flush_now(self):
+        """Wake the sender thread to send all queued entries now.
+
+        Returns right away, reporters calling it after every report never
+        wait on the network. Only close() sends in the calling thread.
+        """
+        self._wakeup.set()
+
+    def close(self, timeout_secs=5.0):
+        """Send what is queued within a time limit and close the sender.
+
+        :param timeout_secs: Max seconds to spend sending, entries still
+            queued afterwards are dropped.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._deadline = time.monotonic() + timeout_secs
+        self._closing.set()
+        self._wakeup.set()
+        self._thread.join(timeout_secs + 1)
+        if self._thread.is_alive():
+            LOGGER.warning("Sender thread still sending after %ss.",
+                           timeout_secs)
+        with self._lock:
+            self.dropped[METRICS] += len(self._metrics)
+            for kind, _, _ in self._entries:
+                self.dropped[kind] += 1
+            self._metrics.clear()
+            self._entries.clear()
+        self.sender.close()
+
+    def _put_metric(self, is_delta, name, value, timestamp, source, tags):
+        """Queue a metric point, coalescing it with a queued one."""
+        if self._closed:
+            self._send_closed(
+                METRICS, 'send_delta_counter' if is_delta else 'send_metric',
+                (name, value, source, tags, timestamp) if is_delta
+                else (name, value, timestamp, source, tags))
+            return
+        key = (is_delta, name, source,
+               tuple(sorted(tags.items())) if tags else ())
+        with self._lock:
+            pending = self._metrics.get(key)
+            if pending is not None:
+                pending[0] = pending[0] + value if is_delta else value
+                pending[1] = timestamp
+                return
+            if self.get_queue_size() >= self.max_queue_size:
+                self.dropped[METRICS] += 1
+                return
+            self._metrics[key] = [value, timestamp, tags]
+        if len(self._metrics) >= self.batch_size:
+            self._wakeup.set()
+
+    def _put(self, kind, method, args):
+        """Queue an entry to send with a method of the wrapped sender."""
+        if self._closed:
+            self._send_closed(kind, method, args)
+            return
+        with self._lock:
+            if self.get_queue_size() >= self.max_queue_size:
+                self.dropped[kind] += 1
+                return
+            self._entries.append((kind, method, args))
+        if len(self._entries) >= self.batch_size:
+            self._wakeup.set()
+
+    # pylint: disable=broad-except
+    def _send_closed(self, kind, method, args):
+        """Send an entry straight to the wrapped sender once closed."""
+        try:
+            getattr(self.sender, method)(*args)
+        except Exception:
+            self.errors += 1
+            self.dropped[kind] += 1
+
+    def _run(self):
+        """Flush the queue periodically, backing off after failures.
+
+        Once closing, flushes one last time until the close deadline.
+        """
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            closing = self._closing.is_set()
+            if self._flush():
+                self.backoff = 0
+            elif not closing:
+                self.backoff = min(self.max_backoff,
+                                   self.backoff * 2 or self.initial_backoff)
+                self._closing.wait(self.backoff)
+            if closing:
+                return
+
+    def _is_past_deadline(self):
+        """Check whether the time to close the sender is up."""
+        return self._deadline is not None and \
+            time.monotonic() >= self._deadline
+
+    def _flush(self):
+        """Send queued entries batch by batch.
+
+        :return: False if sending failed.
+        """
+        while not self._is_past_deadline():
+            batch = self._take_batch()
+            if not batch:
+                return True
+            if not self._send_batch(batch):
+                return False
+        return True
+
+    def _take_batch(self):
+        """Dequeue up to batch_size entries, metrics first."""
+        batch = []
+        with self._lock:
+            while self._metrics and len(batch) < self.batch_size:
+                key, (value, timestamp, tags) = \
+                    self._metrics.popitem(last=False)
+                batch.append((METRICS, key, (value, timestamp, tags)))
+            while self._entries and len(batch) < self.batch_size:
+                batch.append(self._entries.popleft())
+        return batch
+
+    # pylint: disable=broad-except
+    def _send_batch(self, batch):
+        """Send a batch, requeueing the unsent rest if sending fails.
+
+        :return: False if sending failed.
+        """
+        for index, (kind, method, args) in enumerate(batch):
+            if self._is_past_deadline():
+                self._requeue(batch[index:])
+                return True
+            try:
+                if kind == METRICS:
+                    is_delta, name, source, _ = method
+                    value, timestamp, tags = args
+                    if is_delta:
+                        self.sender.send_delta_counter(name, value, source,
+                                                       tags, timestamp)
+                    else:
+                        self.sender.send_metric(name, value, timestamp,
+                                                source, tags)
+                else:
+                    getattr(self.sender, method)(*args)
+            except Exception as e:
+                self.errors += 1
+                if not self.backoff:
+                    LOGGER.warning("Failed to send to Wavefront, retrying "
+                                   "with backoff: %s", e)
+                self._requeue(batch[index:])
+                return False
+        flush_now = getattr(self.sender, 'flush_now', None)
+        if flush_now is not None:
+            try:
+                flush_now()
+            except Exception as e:
+                self.errors += 1
+                LOGGER.warning("Failed to flush to Wavefront: %s", e)
+                return False
+        return True
+
+    def _requeue(self, batch):
+        """Put unsent entries back at the front of the queue.
+
+        Newer points queued meanwhile win over requeued ones, and entries
+        which no longer fit are dropped.
+        """
+        with self._lock:
+            for kind, method, args in reversed(batch):
+                if kind == METRICS:
+                    pending = self._metrics.get(method)
+                    if pending is not None:
+                        if method[0]:
+                            pending[0] += args[0]
+                        continue
+                    if self.get_queue_size() >= self.max_queue_size:
+                        self.dropped[METRICS] += 1
+                        continue
+                    self._metrics[method] = list(args)
+                    self._metrics.move_to_end(method, last=False)
+                elif self.get_queue_size() >= self.max_queue_size:
+                    self.dropped[kind] += 1
+                else:
+                    self._entries.appendleft((kind, method, args))
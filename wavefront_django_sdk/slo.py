@@ -0,0 +1,276 @@
+"""
+Live Latency Tracking.
+
+Keeps a bounded, streaming latency sketch per route which can be queried
+for percentiles while serving requests, counts requests over the latency
+SLO of their route and remembers the most recent slow requests.
+"""
+import math
+import threading
+import time
+from collections import deque, namedtuple
+
+from .timing import NANOS_PER_SECOND
+
+Exemplar = namedtuple('Exemplar', ['timestamp', 'entity_name', 'method',
+                                   'path', 'duration', 'trace_id'])
+
+_latency_tracker = None  # pylint: disable=invalid-name
+
+
+class LatencySketch:
+    """Streaming quantile sketch of latencies with bounded memory.
+
+    Values fall into logarithmic buckets, so every quantile is accurate to
+    within relative_accuracy of the real value. Once there are more than
+    max_buckets, the lowest buckets are merged, which only affects the
+    accuracy of the lowest quantiles.
+    """
+
+    __slots__ = ('gamma', 'log_gamma', 'max_buckets', 'buckets', 'zeros',
+                 'count')
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        """Construct Latency Sketch.
+
+        :param relative_accuracy: Max relative error of quantiles.
+        :param max_buckets: Max number of buckets kept.
+        """
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, value):
+        """Add a value.
+
+        :param value: Non-negative value, e.g. nanoseconds.
+        """
+        self.count += 1
+        if value <= 0:
+            self.zeros += 1
+            return
+        index = math.ceil(math.log(value) / self.log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def merge(self, other):
+        """Add all values of another sketch of the same accuracy.
+
+        :param other: LatencySketch.
+        """
+        self.count += other.count
+        self.zeros += other.zeros
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def get_quantile(self, quantile):
+        """Get the value at a quantile.
+
+        :param quantile: Quantile in [0, 1], e.g. 0.99.
+        :return: Value, or None if the sketch is empty.
+        """
+        if not self.count:
+            return None
+        rank = quantile * (self.count - 1)
+        seen = self.zeros
+        if seen > rank:
+            return 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def _collapse(self):
+        """Merge the lowest buckets into one to stay within max_buckets."""
+        indexes = sorted(self.buckets)
+        excess = len(indexes) - self.max_buckets + 1
+        merged = sum(self.buckets.pop(index) for index in indexes[:excess])
+        target = indexes[excess]
+        self.buckets[target] = self.buckets.get(target, 0) + merged
+
+
+# pylint: disable=too-many-instance-attributes
+class RouteLatency:
+    """Live latency of a single route and method."""
+
+    def __init__(self, tracker, entity_name, method, slo_ns=None):
+        """Construct Route Latency.
+
+        :param tracker: LatencyTracker the route belongs to.
+        :param entity_name: Entity name of the route.
+        :param method: HTTP method.
+        :param slo_ns: Latency SLO of the route in nanoseconds, or None.
+        """
+        self.tracker = tracker
+        self.entity_name = entity_name
+        self.method = method
+        self.slo_ns = slo_ns
+        self.over_slo = 0
+        self._current = tracker.new_sketch()
+        self._previous = tracker.new_sketch()
+        self._window_end = time.monotonic() + tracker.window
+        self._lock = threading.Lock()
+
+    def record(self, duration_ns, path=None, trace_id=None):
+        """Record the latency of a request.
+
+        :param duration_ns: Wall time of the request in nanoseconds.
+        :param path: Path of the request, kept for slow requests.
+        :param trace_id: Trace id of the request, kept for slow requests.
+        :return: True if the request was slower than the SLO.
+        """
+        over_slo = self.slo_ns is not None and duration_ns > self.slo_ns
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._window_end:
+                self._rotate(now)
+            self._current.add(duration_ns)
+            if over_slo:
+                self.over_slo += 1
+        if over_slo:
+            self.tracker.exemplars.append(Exemplar(
+                time.time(), self.entity_name, self.method, path,
+                duration_ns / NANOS_PER_SECOND, trace_id))
+        return over_slo
+
+    def get_sketch(self):
+        """Get a sketch of the latencies of the last one or two windows."""
+        sketch = self.tracker.new_sketch()
+        with self._lock:
+            if time.monotonic() >= self._window_end:
+                self._rotate(time.monotonic())
+            sketch.merge(self._previous)
+            sketch.merge(self._current)
+        return sketch
+
+    def get_percentile(self, percentile):
+        """Get a live latency percentile of the route.
+
+        :param percentile: Percentile in [0, 100], e.g. 99.
+        :return: Latency in seconds, or None without recent requests.
+        """
+        value = self.get_sketch().get_quantile(percentile / 100.0)
+        return None if value is None else value / NANOS_PER_SECOND
+
+    def _rotate(self, now):
+        """Start a new window, dropping the previous one."""
+        windows = int((now - self._window_end) // self.tracker.window) + 1
+        self._previous = self._current if windows == 1 \
+            else self.tracker.new_sketch()
+        self._current = self.tracker.new_sketch()
+        self._window_end += windows * self.tracker.window
+
+
+class LatencyTracker:
+    """Live latency sketches, SLOs and slow request exemplars per route."""
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, slo=None, route_slos=None, window=60,
+                 max_exemplars=100, relative_accuracy=0.01):
+        """Construct Latency Tracker.
+
+        :param slo: Latency SLO of every route in seconds, or None.
+        :param route_slos: Dict of entity name to SLO, overriding slo.
+        :param window: Seconds covered by a sketch, queries cover the
+            current and the previous window.
+        :param max_exemplars: Number of slow requests to remember.
+        :param relative_accuracy: Max relative error of percentiles.
+        """
+        self.slo = slo
+        self.route_slos = {name: float(route_slo) for name, route_slo in
+                           (route_slos or {}).items()}
+        self.window = float(window)
+        self.relative_accuracy = relative_accuracy
+        self.exemplars = deque(maxlen=max_exemplars)
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def new_sketch(self):
+        """Create an empty sketch with the accuracy of the tracker."""
+        return LatencySketch(self.relative_accuracy)
+
+    def get_slo(self, entity_name):
+        """Get the latency SLO of a route.
+
+        :param entity_name: Entity name of the route.
+        :return: SLO in seconds, or None.
+        """
+        return self.route_slos.get(entity_name, self.slo)
+
+    def get_route(self, entity_name, method):
+        """Get the live latency of a route, creating it if needed.
+
+        :param entity_name: Entity name of the route.
+        :param method: HTTP method.
+        :return: RouteLatency.
+        """
+        key = (entity_name, method)
+        route = self._routes.get(key)
+        if route is None:
+            with self._lock:
+                route = self._routes.get(key)
+                if route is None:
+                    slo = self.get_slo(entity_name)
+                    route = RouteLatency(
+                        self, entity_name, method,
+                        None if slo is None else int(slo * NANOS_PER_SECOND))
+                    self._routes[key] = route
+        return route
+
+    def get_percentile(self, entity_name, method, percentile):
+        """Get a live latency percentile of a route.
+
+        :param entity_name: Entity name of the route.
+        :param method: HTTP method.
+        :param percentile: Percentile in [0, 100], e.g. 99.
+        :return: Latency in seconds, or None without recent requests.
+        """
+        route = self._routes.get((entity_name, method))
+        return None if route is None else route.get_percentile(percentile)
+
+    def get_snapshot(self, percentiles=(50, 90, 99)):
+        """Get the live latency of every route.
+
+        :param percentiles: Percentiles to get.
+        :return: Dict of (entity name, method) to dict with the count of
+            recent requests, the count over SLO since start and the
+            percentiles in seconds, e.g. 'p99'.
+        """
+        snapshot = {}
+        for key, route in list(self._routes.items()):
+            sketch = route.get_sketch()
+            stats = {'count': sketch.count, 'over_slo': route.over_slo}
+            for percentile in percentiles:
+                value = sketch.get_quantile(percentile / 100.0)
+                stats['p{:g}'.format(percentile)] = None if value is None \
+                    else value / NANOS_PER_SECOND
+            snapshot[key] = stats
+        return snapshot
+
+    def get_exemplars(self):
+        """Get the most recent requests over their SLO, oldest first.
+
+        :return: List of Exemplar.
+        """
+        return list(self.exemplars)
+
+
+def get_latency_tracker():
+    """Get the LatencyTracker of the middleware, or None if not enabled."""
+    return _latency_tracker
+
+
+def set_latency_tracker(tracker):
+    """Set the LatencyTracker returned by get_latency_tracker.
+
+    :param tracker: LatencyTracker.
+    """
+    global _latency_tracker  # pylint: disable=global-statement
+    _latency_tracker = tracker
@@ -0,0 +1,467 @@
+"""
+Background Task Instrumentation.
+
+Reports Celery tasks and Django management commands like the middleware
+reports requests: counters per task and outcome rolled up at report time,
+error counters, latency and CPU time histograms, inflight gauges and a
+span per run, with the same application tags, registry and reporter.
+Celery is optional, and only imported by instrument_celery().
+"""
+import logging
+import threading
+
+from opentracing.ext import tags
+
+from wavefront_pyformance.delta import delta_counter
+from wavefront_pyformance.wavefront_histogram import wavefront_histogram
+
+from .config import ConfigError, load_config
+from .constants import DJANGO_COMPONENT, NULL_TAG_VAL, REPORTER_PREFIX, \
+    WAVEFRONT_PROVIDED_SOURCE
+from .inflight import InflightGauge
+from .metric_cache import RouteMetrics, RouteMetricsCache
+from .recorder import BufferedRecorder, DirectRecorder
+from .rollup import CounterRollup
+from .runtime import get_runtime
+from .sampling import get_trace_sampler
+
+TASK_PREFIX = 'task'
+COMMAND_PREFIX = 'command'
+CELERY_COMPONENT = 'celery'
+
+SUCCESS = 'success'
+FAILURE = 'failure'
+REVOKED = 'revoked'
+
+# Commands serving or prompting until stopped.
+DEFAULT_EXCLUDED_COMMANDS = ('runserver', 'shell', 'dbshell', 'test',
+                             'testserver')
+
+LOGGER = logging.getLogger(__name__)
+
+_instrumentations = {}
+_instrumentations_lock = threading.Lock()
+_celery_runs = {}
+_commands_instrumented = False  # pylint: disable=invalid-name
+
+
+# pylint: disable=too-few-public-methods, too-many-instance-attributes
+class TaskRun:
+    """A running task, from its start to its outcome."""
+
+    __slots__ = ('name', 'module_name', 'func_name', 'inflight', 'start_ns',
+                 'cpu_ns', 'span', 'scope', 'error')
+
+    def __init__(self, name, module_name=None, func_name=None):
+        """Construct Task Run.
+
+        :param name: Name of the task.
+        :param module_name: Module of the task.
+        :param func_name: Function of the task.
+        """
+        self.name = name
+        self.module_name = module_name
+        self.func_name = func_name
+        self.inflight = None
+        self.start_ns = None
+        self.cpu_ns = None
+        self.span = None
+        self.scope = None
+        self.error = None
+
+
+# pylint: disable=too-many-instance-attributes
+class TaskInstrumentation:
+    """Metrics and spans of the runs of one kind of background task.
+
+    Metric handles are resolved once per task and outcome and cached, and
+    runs are recorded through the recorder of WF_BUFFERED_RECORDING, so
+    high-rate short tasks only append to a per-thread buffer.
+    """
+
+    def __init__(self, prefix=TASK_PREFIX, component=CELERY_COMPONENT,
+                 span_kind=tags.SPAN_KIND_CONSUMER, config=None):
+        """Construct Task Instrumentation.
+
+        :param prefix: Prefix of the metric names, e.g. 'task'.
+        :param component: Component tag of the spans.
+        :param span_kind: Span kind tag of the spans, or None.
+        :param config: WavefrontConfig, read from settings by default.
+        :raise ConfigError: If settings are not correctly configured.
+        """
+        config = config or load_config()
+        self.prefix = prefix
+        self.component = component
+        self.span_kind = span_kind
+        application_tags = config.application_tags
+        self.application = application_tags.application or NULL_TAG_VAL
+        self.cluster = application_tags.cluster or NULL_TAG_VAL
+        self.service = application_tags.service or NULL_TAG_VAL
+        self.shard = application_tags.shard or NULL_TAG_VAL
+        self.has_cluster = bool(application_tags.cluster)
+        self.has_shard = bool(application_tags.shard)
+        # Shares the registry and reporting of the middleware.
+        self.runtime = get_runtime()
+        self.registry = self.runtime.get_registry(
+            config.debug_registry if config.debug else None)
+        config.reporter.prefix = REPORTER_PREFIX
+        config.reporter.registry = self.registry
+        self.runtime.prepare(config, config.tracing)
+        self.tracer = config.tracing.tracer if config.trace_all else None
+        self.sampler = get_trace_sampler(config)
+        self.wall_clock = config.wall_clock
+        self.cpu_clock = config.cpu_clock
+        self.metric_cache = RouteMetricsCache(config.metric_cache_size)
+        if config.buffered_recording:
+            self.recorder = BufferedRecorder(self.registry,
+                                             config.record_buffer_size)
+        else:
+            self.recorder = DirectRecorder()
+        self.rollup = CounterRollup(self.registry)
+        # django.total_tasks.inflight
+        self.total_inflight = self.registry.gauge(
+            key='total_{}s.inflight'.format(prefix), gauge=InflightGauge(),
+            tags=self.get_tags_map(cluster=self.cluster,
+                                   service=self.service, shard=self.shard))
+
+    def start(self, name, module_name=None, func_name=None):
+        """Start timing and tracing a run of a task.
+
+        :param name: Name of the task, e.g. 'orders.tasks.ship'.
+        :param module_name: Module of the task.
+        :param func_name: Function of the task.
+        :return: TaskRun to finish.
+        """
+        if not self.runtime.started:
+            self.runtime.start(background=True)
+        run = TaskRun(name, module_name, func_name)
+        run.inflight = self.get_task_metrics(
+            name, None, module_name, func_name).inflight
+        run.inflight.add(1)
+        self.total_inflight.add(1)
+        if self.tracer is not None and \
+                (self.sampler is None or self.sampler.sample(name)):
+            span_tags = {tags.COMPONENT: self.component}
+            if self.span_kind:
+                span_tags[tags.SPAN_KIND] = self.span_kind
+            if module_name:
+                span_tags['django.resource.module'] = module_name
+            if func_name:
+                span_tags['django.resource.func'] = func_name
+            run.span = self.tracer.start_span(operation_name=name,
+                                              tags=span_tags)
+            # Active while the task runs, so its queries and calls are its
+            # children, finished explicitly even if the task leaks a scope.
+            run.scope = self.tracer.scope_manager.activate(
+                run.span, finish_on_close=False)
+        run.start_ns = self.wall_clock()
+        run.cpu_ns = self.cpu_clock()
+        return run
+
+    def finish(self, run, outcome=SUCCESS, error=None):
+        """Record the outcome of a run of a task.
+
+        :param run: TaskRun returned by start.
+        :param outcome: 'success', 'failure', or another outcome such as
+            Celery's 'retry'.
+        :param error: Exception the task failed with, or None.
+        """
+        duration_ns = self.wall_clock() - run.start_ns
+        cpu_ns = self.cpu_clock() - run.cpu_ns
+        run.inflight.add(-1)
+        self.total_inflight.add(-1)
+        # django.task.orders.tasks.ship.success.latency.m
+        self.recorder.record(
+            self.get_task_metrics(run.name, outcome, run.module_name,
+                                  run.func_name), duration_ns, cpu_ns)
+        if run.span is not None:
+            run.scope.close()
+            run.span.set_tag('task.outcome', outcome)
+            if outcome == FAILURE:
+                run.span.set_tag(tags.ERROR, 'true')
+                if error is not None:
+                    run.span.log_kv({'event': 'error',
+                                     'error.kind': type(error).__name__,
+                                     'message': str(error)})
+            run.span.finish()
+
+    def get_task_metrics(self, name, outcome, module_name=None,
+                         func_name=None):
+        """Get cached metric handles of a task, resolving them on a miss.
+
+        :param name: Name of the task.
+        :param outcome: Outcome of the run, None for the inflight gauge.
+        :param module_name: Module of the task.
+        :param func_name: Function of the task.
+        :return: RouteMetrics of the task.
+        """
+        key = (name, outcome, module_name, func_name)
+        task_metrics = self.metric_cache.get(key)
+        if task_metrics is None:
+            if outcome is None:
+                # django.task.orders.tasks.ship.inflight
+                task_metrics = RouteMetrics(inflight=self.registry.gauge(
+                    key='.'.join((self.prefix, name, 'inflight')),
+                    gauge=InflightGauge(),
+                    tags=self.get_tags_map(module_name=module_name,
+                                           func_name=func_name)))
+            else:
+                task_metrics = self._build_task_metrics(
+                    key, name, outcome, module_name, func_name)
+            self.metric_cache.put(key, task_metrics)
+        return task_metrics
+
+    # pylint: disable=too-many-arguments
+    def _build_task_metrics(self, key, name, outcome, module_name,
+                            func_name):
+        """Resolve metric handles of a task outcome from the registry.
+
+        :return: RouteMetrics of the task outcome.
+        """
+        metric_key = '.'.join((self.prefix, name, outcome))
+        complete_tags_map = self.get_tags_map(
+            cluster=self.cluster, service=self.service, shard=self.shard,
+            module_name=module_name, func_name=func_name)
+        overall_per_source_map = self.get_tags_map(
+            cluster=self.cluster, service=self.service, shard=self.shard)
+        overall_per_service_map = self.get_tags_map(
+            cluster=self.cluster, service=self.service,
+            source=WAVEFRONT_PROVIDED_SOURCE)
+        overall_per_application_map = self.get_tags_map(
+            source=WAVEFRONT_PROVIDED_SOURCE)
+
+        # django.task.orders.tasks.ship.success.cumulative.count
+        # django.task.orders.tasks.ship.success.aggregated_per_shard.count
+        # django.task.orders.tasks.ship.success.aggregated_per_service.count
+        # django.task.orders.tasks.ship.success.aggregated_per_cluster.count
+        # django.task.orders.tasks.ship.success.aggregated_per_application.count
+        counters = [self.registry.counter(metric_key + '.cumulative',
+                                          tags=complete_tags_map)]
+        if self.has_shard:
+            counters.append(delta_counter(
+                self.registry, metric_key + '.aggregated_per_shard',
+                tags=self.get_tags_map(
+                    cluster=self.cluster, service=self.service,
+                    shard=self.shard, module_name=module_name,
+                    func_name=func_name, source=WAVEFRONT_PROVIDED_SOURCE)))
+        counters.append(delta_counter(
+            self.registry, metric_key + '.aggregated_per_service',
+            tags=self.get_tags_map(
+                cluster=self.cluster, service=self.service,
+                module_name=module_name, func_name=func_name,
+                source=WAVEFRONT_PROVIDED_SOURCE)))
+        if self.has_cluster:
+            counters.append(delta_counter(
+                self.registry, metric_key + '.aggregated_per_cluster',
+                tags=self.get_tags_map(
+                    cluster=self.cluster, module_name=module_name,
+                    func_name=func_name, source=WAVEFRONT_PROVIDED_SOURCE)))
+        counters.append(delta_counter(
+            self.registry, metric_key + '.aggregated_per_application',
+            tags=self.get_tags_map(module_name=module_name,
+                                   func_name=func_name,
+                                   source=WAVEFRONT_PROVIDED_SOURCE)))
+
+        # django.tasks.completed.aggregated_per_source.count
+        # django.tasks.completed.aggregated_per_service.count
+        # django.tasks.completed.aggregated_per_application.count
+        overall = self.prefix + 's'
+        counters.append(self.registry.counter(
+            overall + '.completed.aggregated_per_source',
+            tags=overall_per_source_map))
+        counters.append(delta_counter(
+            self.registry, overall + '.completed.aggregated_per_service',
+            tags=overall_per_service_map))
+        counters.append(delta_counter(
+            self.registry, overall + '.completed.aggregated_per_application',
+            tags=overall_per_application_map))
+
+        # django.task.orders.tasks.ship.errors.count
+        # django.tasks.errors.aggregated_per_source.count
+        # django.tasks.errors.aggregated_per_service.count
+        # django.tasks.errors.aggregated_per_application.count
+        if outcome == FAILURE:
+            counters.append(self.registry.counter(
+                '.'.join((self.prefix, name, 'errors')),
+                tags=complete_tags_map))
+            counters.append(self.registry.counter(
+                overall + '.errors.aggregated_per_source',
+                tags=overall_per_source_map))
+            counters.append(delta_counter(
+                self.registry, overall + '.errors.aggregated_per_service',
+                tags=overall_per_service_map))
+            counters.append(delta_counter(
+                self.registry, overall + '.errors.aggregated_per_application',
+                tags=overall_per_application_map))
+
+        return RouteMetrics(
+            responses=self.rollup.counter(key, counters),
+            latency=wavefront_histogram(
+                self.registry, metric_key + '.latency',
+                tags=complete_tags_map),
+            cpu_ns=wavefront_histogram(
+                self.registry, metric_key + '.cpu_ns',
+                tags=complete_tags_map),
+            total_time=self.registry.counter(metric_key + '.total_time',
+                                             tags=complete_tags_map))
+
+    # pylint: disable=too-many-arguments
+    def get_tags_map(self, cluster=None, service=None, shard=None,
+                     module_name=None, func_name=None, source=None):
+        """Get tags of a task metric as dict.
+
+        :param cluster: Cluster from application tags.
+        :param service: Service from application tags.
+        :param shard: Shard from application tags.
+        :param module_name: Module of the task.
+        :param func_name: Function of the task.
+        :param source: Name of source.
+        :return: Tags of the metric.
+        """
+        tags_map = {'application': self.application}
+        for key, value in (('cluster', cluster), ('service', service),
+                           ('shard', shard),
+                           ('django.resource.module', module_name),
+                           ('django.resource.func', func_name),
+                           ('source', source)):
+            if value:
+                tags_map[key] = value
+        return tags_map
+
+
+def get_task_instrumentation(prefix=TASK_PREFIX):
+    """Get the instrumentation of a kind of task, created on first use.
+
+    :param prefix: TASK_PREFIX for Celery tasks, COMMAND_PREFIX for
+        management commands.
+    :return: TaskInstrumentation, or None if settings are not correctly
+        configured.
+    """
+    if prefix in _instrumentations:
+        return _instrumentations[prefix]
+    with _instrumentations_lock:
+        if prefix not in _instrumentations:
+            try:
+                _instrumentations[prefix] = TaskInstrumentation(
+                    prefix=prefix,
+                    component=CELERY_COMPONENT if prefix == TASK_PREFIX
+                    else DJANGO_COMPONENT,
+                    span_kind=tags.SPAN_KIND_CONSUMER
+                    if prefix == TASK_PREFIX else None)
+            except ConfigError as e:
+                LOGGER.warning(e)
+                LOGGER.warning("Wavefront %s instrumentation not enabled!",
+                               prefix)
+                _instrumentations[prefix] = None
+        return _instrumentations[prefix]
+
+
+def instrument_celery():
+    """Report every Celery task run by this process.
+
+    Connects to the Celery task signals, so it also covers tasks run
+    eagerly, e.g. with task_always_eager in tests. Call it where the Celery
+    app is created. Settings are read on the first task. Runs of revoked
+    tasks are recorded as 'revoked', and runs a pool process inherited
+    from its parent are forgotten.
+    """
+    # pylint: disable=import-outside-toplevel, import-error
+    from celery import signals
+    signals.task_prerun.connect(
+        _task_prerun, weak=False,
+        dispatch_uid='wavefront_django_sdk.tasks.prerun')
+    signals.task_failure.connect(
+        _task_failure, weak=False,
+        dispatch_uid='wavefront_django_sdk.tasks.failure')
+    signals.task_postrun.connect(
+        _task_postrun, weak=False,
+        dispatch_uid='wavefront_django_sdk.tasks.postrun')
+    signals.task_revoked.connect(
+        _task_revoked, weak=False,
+        dispatch_uid='wavefront_django_sdk.tasks.revoked')
+    signals.worker_process_init.connect(
+        _worker_process_init, weak=False,
+        dispatch_uid='wavefront_django_sdk.tasks.worker_process_init')
+
+
+# pylint: disable=unused-argument
+def _task_prerun(sender=None, task_id=None, task=None, **kwargs):
+    """Start a run of a Celery task."""
+    instrumentation = get_task_instrumentation(TASK_PREFIX)
+    if instrumentation is None or task is None:
+        return
+    module_name, _, func_name = task.name.rpartition('.')
+    _celery_runs[task_id] = instrumentation.start(task.name, module_name,
+                                                  func_name)
+
+
+# pylint: disable=unused-argument
+def _task_failure(sender=None, task_id=None, exception=None, **kwargs):
+    """Keep the exception a Celery task failed with."""
+    run = _celery_runs.get(task_id)
+    if run is not None:
+        run.error = exception
+
+
+# pylint: disable=unused-argument
+def _task_postrun(sender=None, task_id=None, state=None, **kwargs):
+    """Record the outcome of a run of a Celery task."""
+    run = _celery_runs.pop(task_id, None)
+    if run is None:
+        return
+    outcome = state.lower() if state else FAILURE
+    get_task_instrumentation(TASK_PREFIX).finish(run, outcome, run.error)
+
+
+# pylint: disable=unused-argument
+def _task_revoked(sender=None, request=None, **kwargs):
+    """Record a run of a Celery task revoked before its postrun."""
+    run = _celery_runs.pop(getattr(request, 'id', None), None)
+    if run is not None:
+        get_task_instrumentation(TASK_PREFIX).finish(run, REVOKED)
+
+
+# pylint: disable=unused-argument
+def _worker_process_init(**kwargs):
+    """Forget the runs of the parent in a new Celery pool process."""
+    _celery_runs.clear()
+
+
+def instrument_commands(excluded=DEFAULT_EXCLUDED_COMMANDS):
+    """Report every management command run by this process.
+
+    Wraps django.core.management.base.BaseCommand.execute once per process.
+    Call it from manage.py, or AppConfig.ready(). Reporting starts with the
+    first command and is flushed when the process exits.
+
+    :param excluded: Names of commands not to report, e.g. commands
+        serving until stopped.
+    """
+    global _commands_instrumented  # pylint: disable=global-statement
+    with _instrumentations_lock:
+        if _commands_instrumented:
+            return
+        # pylint: disable=import-outside-toplevel
+        from django.core.management.base import BaseCommand
+        execute = BaseCommand.execute
+        excluded = frozenset(excluded)
+
+        def instrumented_execute(command, *args, **options):
+            module_name = type(command).__module__
+            name = module_name.rpartition('.')[2]
+            instrumentation = None if name in excluded else \
+                get_task_instrumentation(COMMAND_PREFIX)
+            if instrumentation is None:
+                return execute(command, *args, **options)
+            run = instrumentation.start(name, module_name, 'handle')
+            try:
+                output = execute(command, *args, **options)
+            except BaseException as e:
+                instrumentation.finish(run, FAILURE, e)
+                raise
+            instrumentation.finish(run, SUCCESS)
+            return output
+
+        instrumented_execute.__wrapped__ = execute
+        BaseCommand.execute = instrumented_execute
+        _commands_instrumented = True
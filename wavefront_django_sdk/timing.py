@@ -0,0 +1,182 @@
+"""
+Request Timing.
+
+Times requests in integer nanoseconds with a monotonic wall clock and a
+per-thread CPU clock, and optionally breaks the wall time of a request
+down into phases.
+"""
+import threading
+import time
+
+try:
+    from contextvars import ContextVar
+except ImportError:
+    # Python < 3.7 serves requests in threads only, never on an event loop.
+    class ContextVar:
+        """Thread-local stand-in for contextvars.ContextVar."""
+
+        def __init__(self, name, default=None):
+            """Construct Context Var.
+
+            :param name: Name of the variable.
+            :param default: Value of the variable until set in a thread.
+            """
+            self.name = name
+            self._default = default
+            self._local = threading.local()
+
+        def get(self):
+            """Get the value of the variable in the current thread."""
+            return getattr(self._local, 'value', self._default)
+
+        def set(self, value):
+            """Set the value of the variable in the current thread."""
+            self._local.value = value
+
+NANOS_PER_SECOND = 1e9
+
+PHASE_MIDDLEWARE_IN = 'middleware_in'
+PHASE_VIEW = 'view'
+PHASE_TEMPLATE = 'template'
+PHASE_SERIALIZATION = 'serialization'
+PHASES = (PHASE_MIDDLEWARE_IN, PHASE_VIEW, PHASE_TEMPLATE,
+          PHASE_SERIALIZATION)
+
+
+def _scaled_clock(clock):
+    """Turn a clock in float seconds into one in integer nanoseconds."""
+    return lambda: int(clock() * NANOS_PER_SECOND)
+
+
+def _get_cpu_clock():
+    """Get the best available CPU clock in integer nanoseconds."""
+    for name in ('thread_time_ns', 'process_time_ns'):
+        clock = getattr(time, name, None)
+        if clock is not None:
+            try:
+                clock()
+            except OSError:
+                continue
+            return clock
+    return _scaled_clock(time.process_time)
+
+
+# Monotonic wall clock in integer nanoseconds.
+wall_clock_ns = getattr(time, 'perf_counter_ns', None) or \
+    _scaled_clock(time.perf_counter)
+
+# CPU time of the current thread in integer nanoseconds, or of the process
+# where the platform can't measure threads.
+cpu_clock_ns = _get_cpu_clock()
+
+
+# pylint: disable=too-many-instance-attributes
+class RequestPhases:
+    """Timestamps of the phases of a single request.
+
+    middleware_in runs from the middleware seeing the request to the view
+    being called, view from then until the view returns, and
+    serialization is the rendering of template responses. Django template
+    rendering anywhere in the request is counted as template instead.
+    """
+
+    __slots__ = ('clock', 'start', 'view_start', 'view_end', 'render_start',
+                 'render_end', 'template', 'template_in_view',
+                 'template_depth', 'template_start')
+
+    def __init__(self, clock, start):
+        """Construct Request Phases.
+
+        :param clock: Wall clock in integer nanoseconds.
+        :param start: Time the middleware saw the request.
+        """
+        self.clock = clock
+        self.start = start
+        self.view_start = None
+        self.view_end = None
+        self.render_start = None
+        self.render_end = None
+        self.template = 0
+        self.template_in_view = 0
+        self.template_depth = 0
+        self.template_start = 0
+
+    def mark_view_end(self):
+        """Mark the view as returned, if not already."""
+        if self.view_end is None and self.view_start is not None:
+            self.view_end = self.clock()
+            self.template_in_view = self.template
+
+    def mark_render_start(self):
+        """Mark the start of the response rendering."""
+        self.mark_view_end()
+        self.render_start = self.clock()
+
+    def mark_render_end(self):
+        """Mark the end of the response rendering."""
+        self.render_end = self.clock()
+
+    def get_durations(self):
+        """Get the duration of every phase.
+
+        :return: Tuple of nanoseconds in the order of PHASES, or None if
+            the request never reached a view.
+        """
+        if self.view_start is None:
+            return None
+        self.mark_view_end()
+        view = self.view_end - self.view_start - self.template_in_view
+        serialization = 0
+        if self.render_start is not None and self.render_end is not None:
+            serialization = max(0, self.render_end - self.render_start -
+                                (self.template - self.template_in_view))
+        return (self.view_start - self.start, max(0, view), self.template,
+                serialization)
+
+
+_current_phases = ContextVar('wf_request_phases', default=None)
+_templates_lock = threading.Lock()
+_templates_instrumented = False  # pylint: disable=invalid-name
+
+
+def set_current_phases(phases):
+    """Set the RequestPhases of the request served in this context.
+
+    :param phases: RequestPhases, or None once the request is done.
+    :return: Token to reset the context var with, None before Python 3.7.
+    """
+    return _current_phases.set(phases)
+
+
+def instrument_templates():
+    """Count the rendering of Django templates towards the template phase.
+
+    Wraps django.template.base.Template.render once per process. Nested
+    templates, e.g. from include tags, are counted once.
+    """
+    global _templates_instrumented  # pylint: disable=global-statement
+    with _templates_lock:
+        if _templates_instrumented:
+            return
+        # pylint: disable=import-outside-toplevel
+        from django.template.base import Template
+        render = Template.render
+
+        def timed_render(self, context):
+            phases = _current_phases.get()
+            if phases is None:
+                return render(self, context)
+            if phases.template_depth == 0:
+                phases.template_start = phases.clock()
+            phases.template_depth += 1
+            try:
+                return render(self, context)
+            finally:
+                phases.template_depth -= 1
+                if phases.template_depth == 0:
+                    phases.template += phases.clock() - \
+                        phases.template_start
+
+        timed_render.__wrapped__ = render
+        Template.render = timed_render
+        _templates_instrumented = True
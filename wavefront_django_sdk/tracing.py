@@ -4,32 +4,138 @@ Wavefront Django Tracing.
 @author: Hao Song (songhao@vmware.com)
 """
 
-from django.urls import resolve
-
 from django_opentracing import tracing
 
+import opentracing
+from opentracing.ext import tags
+
 from .constants import DJANGO_COMPONENT
+from .resolver import get_view_names
+
+
+HTTP_URL_FULL = 'full'
+HTTP_URL_PATH = 'path'
+HTTP_URL_ROUTE = 'route'
+HTTP_URL_OFF = 'off'
+HTTP_URL_MODES = (HTTP_URL_FULL, HTTP_URL_PATH, HTTP_URL_ROUTE, HTTP_URL_OFF)
 
 
 class DjangoTracing(tracing.DjangoTracing):
     """Wavefront Django Tracing."""
 
+    def __init__(self, tracer=None, start_span_cb=None,
+                 http_url=HTTP_URL_FULL):
+        """Construct Wavefront Django Tracing.
+
+        :param tracer: the OpenTracing tracer to trace requests with.
+        :param start_span_cb: callback invoked with every new span.
+        :param http_url: what to record as http.url, one of 'full' (absolute
+            URI), 'path', 'route' (URL pattern) or 'off'.
+        """
+        super().__init__(tracer=tracer, start_span_cb=start_span_cb)
+        self.http_url = http_url
+        self._route_tags = {}
+
+    @property
+    def http_url(self):
+        """Get what is recorded as http.url."""
+        return self._http_url
+
+    @http_url.setter
+    def http_url(self, http_url):
+        if http_url not in HTTP_URL_MODES:
+            raise ValueError("http_url must be one of {}".format(
+                ', '.join(HTTP_URL_MODES)))
+        self._http_url = http_url
+
+    def get_route_tags(self, view_names):
+        """Get the immutable span tags shared by every request of a view.
+
+        :param view_names: ViewNames of the request.
+        :return: tuple of (key, value) tags.
+        """
+        route_tags = self._route_tags.get(view_names)
+        if route_tags is None:
+            _, module_name, func_name = view_names
+            route_tags = ((tags.COMPONENT, DJANGO_COMPONENT),
+                          (tags.SPAN_KIND, tags.SPAN_KIND_RPC_SERVER))
+            if module_name:
+                route_tags += (("django.resource.module", module_name),)
+            if func_name:
+                route_tags += (("django.resource.func", func_name),)
+            self._route_tags[view_names] = route_tags
+        return route_tags
+
+    def get_http_url(self, request):
+        """Get the http.url tag of a request, or None if off.
+
+        :param request: incoming HTTP request.
+        :return: URL to record.
+        """
+        if self._http_url == HTTP_URL_FULL:
+            return request.build_absolute_uri()
+        if self._http_url == HTTP_URL_PATH:
+            return request.path
+        if self._http_url == HTTP_URL_ROUTE:
+            route = getattr(request.resolver_match, 'route', None)
+            return route or request.path
+        return None
+
+    # pylint: disable=arguments-differ
+    def _apply_tracing(self, request, view_func, attributes, start_time=None):
+        """Start the span of a request.
+
+        All tags known before the view runs are set at once when the span
+        starts, from the precomputed tags of the view.
+
+        :param request: incoming HTTP request.
+        :param view_func: function serving the request.
+        :param attributes: request attributes to set as span tags.
+        :param start_time: unix timestamp the request started at, for
+            requests traced only after they completed.
+        :return: scope of the span.
+        """
+        headers = {}
+        for key, val in request.META.items():
+            key = key.lower().replace('_', '-')
+            if key.startswith('http-'):
+                key = key[5:]
+            headers[key] = val
+
+        span_tags = dict(self.get_route_tags(get_view_names(request)))
+        span_tags[tags.HTTP_METHOD] = request.method
+        http_url = self.get_http_url(request)
+        if http_url:
+            span_tags[tags.HTTP_URL] = http_url
+        for attr in attributes:
+            if hasattr(request, attr):
+                payload = str(getattr(request, attr))
+                if payload:
+                    span_tags[attr] = payload
+
+        operation_name = view_func.__name__
+        try:
+            span_ctx = self.tracer.extract(opentracing.Format.HTTP_HEADERS,
+                                           headers)
+            scope = self.tracer.start_active_span(
+                operation_name, child_of=span_ctx, tags=span_tags,
+                start_time=start_time)
+        except (opentracing.InvalidCarrierException,
+                opentracing.SpanContextCorruptedException):
+            scope = self.tracer.start_active_span(
+                operation_name, tags=span_tags, start_time=start_time)
+        self._current_scopes[request] = scope
+        self._call_start_span_cb(scope.span, request)
+        return scope
+
     def _finish_tracing(self, request, response=None, error=None):
         scope = self._current_scopes.pop(request, None)
         if scope is None:
             return
         if response is not None:
-            func_name = resolve(request.path_info).func.__name__
-            module_name = resolve(request.path_info).func.__module__
             scope.span.set_tag("http.status_code", str(response.status_code))
             if 400 <= response.status_code <= 599:
                 scope.span.set_tag("error", "true")
                 error_log = {"error_code": response.status_code}
                 scope.span.log_kv(error_log)
-            scope.span.set_tag("span.kind", "server")
-            scope.span.set_tag("django.resource.module", module_name)
-            scope.span.set_tag("django.resource.func", func_name)
-            scope.span.set_tag("component", DJANGO_COMPONENT)
-            scope.span.set_tag("http.method", request.method)
-            scope.span.set_tag("http.url", request.build_absolute_uri())
         scope.close()